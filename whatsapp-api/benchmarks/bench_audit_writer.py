@@ -0,0 +1,97 @@
+"""
+Audit-log write throughput: one commit per record vs the buffered audit writer
+
+Run from the whatsapp-api directory:
+    python -m benchmarks.bench_audit_writer --records 5000 --producers 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.whatsapp_api.audit_writer import AuditWriter
+from src.whatsapp_api.compression import compact_json
+from src.whatsapp_api.db_models import Base, WhatsAppAPICall
+from src.whatsapp_api import db_operations
+from src.whatsapp_api.db_operations import WhatsAppAPICallOperations, AsyncSessionLocal, utcnow
+
+PAYLOAD = compact_json({"messaging_product": "whatsapp", "to": "971509364178", "type": "template"})
+
+
+def api_call_row(i: int) -> dict:
+    return {
+        'guest_id': i,
+        'direction': 'request',
+        'method': 'POST',
+        'url': 'https://graph.facebook.com/v23.0/0/messages',
+        'headers_id': None,
+        'payload': PAYLOAD,
+        'status_code': None,
+        'response_time_ms': None,
+        'error_message': None
+    }
+
+
+async def run_producers(records: int, producers: int, log_one):
+    per_producer = records // producers
+
+    async def producer(offset: int):
+        for i in range(per_producer):
+            await log_one(offset + i)
+
+    await asyncio.gather(*(producer(p * per_producer) for p in range(producers)))
+    return per_producer * producers
+
+
+async def bench(label: str, records: int, producers: int, use_writer: bool, db_path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    commits = {"count": 0}
+    event.listen(engine.sync_engine, "commit", lambda conn: commits.__setitem__("count", commits["count"] + 1))
+    AsyncSessionLocal.configure(bind=engine)
+
+    writer = AuditWriter()
+    if use_writer:
+        await writer.start()
+
+        async def log_one(i):
+            await writer.record(WhatsAppAPICall.__table__, {'timestamp': utcnow(), **api_call_row(i)})
+    else:
+        async def log_one(i):
+            await WhatsAppAPICallOperations.create_api_call(**api_call_row(i))
+
+    start = time.perf_counter()
+    written = await run_producers(records, producers, log_one)
+    if use_writer:
+        await writer.stop()
+    elapsed = time.perf_counter() - start
+
+    async with engine.connect() as conn:
+        stored = (await conn.execute(select(func.count()).select_from(WhatsAppAPICall))).scalar()
+    await engine.dispose()
+
+    print(
+        f"{label:<16} records={written:<6} stored={stored:<6} elapsed={elapsed:7.3f}s "
+        f"records/s={written / elapsed:9.1f} commits={commits['count']:<6} "
+        f"commits/s={commits['count'] / elapsed:8.1f}"
+    )
+
+
+async def main(records: int, producers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, use_writer in (("commit-per-row", False), ("audit writer", True)):
+            db_path = os.path.join(tmp, f"{label.replace(' ', '_')}.db")
+            Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_path}"))
+            await bench(label, records, producers, use_writer, db_path)
+    AsyncSessionLocal.configure(bind=db_operations.async_engine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=5000, help="audit rows written per variant")
+    parser.add_argument("--producers", type=int, default=20, help="concurrent tasks logging rows")
+    args = parser.parse_args()
+    asyncio.run(main(args.records, args.producers))
@@ -0,0 +1,100 @@
+"""
+Per-message latency of Graph API sends: one ClientSession per call vs the shared pool
+
+Run from the whatsapp-api directory:
+    python -m benchmarks.bench_graph_client --messages 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import aiohttp
+from aiohttp import web
+
+from src.whatsapp_api.graph_client import GraphAPIClient
+
+STUB_RESPONSE = {
+    "messaging_product": "whatsapp",
+    "contacts": [{"input": "971509364178", "wa_id": "971509364178"}],
+    "messages": [{"id": "wamid.BENCHMARK", "message_status": "accepted"}]
+}
+
+MESSAGE = {
+    "messaging_product": "whatsapp",
+    "to": "971509364178",
+    "type": "template",
+    "template": {"name": "pre_invite_0", "language": {"code": "en"}}
+}
+
+
+async def start_stub_server() -> tuple[web.AppRunner, str]:
+    """Start a local Graph API stub that answers every send with a success payload"""
+    async def messages(request: web.Request) -> web.Response:
+        await request.json()
+        return web.json_response(STUB_RESPONSE)
+
+    app = web.Application()
+    app.router.add_post("/{version}/{phone_id}/messages", messages)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/v23.0/0/messages"
+
+
+async def per_call_session(url: str, count: int) -> List[float]:
+    """The previous behaviour: a fresh ClientSession (and connection) per message"""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=MESSAGE) as response:
+                await response.json()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def shared_session(url: str, count: int) -> List[float]:
+    """The lifespan-owned pooled client"""
+    client = GraphAPIClient()
+    await client.start()
+    latencies = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            async with client.session.post(url, json=MESSAGE) as response:
+                await response.json()
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        await client.close()
+    return latencies
+
+
+def summarize(name: str, latencies: List[float]):
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{name:<18} n={len(ordered):<6} mean={statistics.mean(ordered):7.3f}ms "
+        f"p50={statistics.median(ordered):7.3f}ms p99={p99:7.3f}ms"
+    )
+
+
+async def main(messages: int):
+    runner, url = await start_stub_server()
+    try:
+        # Warm up the stub and the interpreter before measuring
+        await shared_session(url, 20)
+        summarize("per-call session", await per_call_session(url, messages))
+        summarize("shared session", await shared_session(url, messages))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500, help="messages sent per variant")
+    args = parser.parse_args()
+    asyncio.run(main(args.messages))
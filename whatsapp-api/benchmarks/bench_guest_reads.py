@@ -0,0 +1,145 @@
+"""
+CPU time and memory per guest-list request: the old ORM read path against the Core one
+
+    orm        ORM objects -> dicts -> response_model validation -> json (the old GET /api/guests)
+    core       Core rows -> GuestShape dicts -> orjson, the whole list in one go
+    core-paged the same, a GUEST_PAGE_SIZE_MAX page at a time, as the page loads it
+
+Run from the whatsapp-api directory:
+    python -m benchmarks.bench_guest_reads --sizes 10000,100000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from typing import List
+
+# The database engines are created at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ["WEDDING_DB_PATH"] = os.path.join(_tmp.name, "bench.db")
+
+from pydantic import TypeAdapter
+from sqlalchemy import insert, func, select
+
+from src.whatsapp_api.db_models import Guest
+from src.whatsapp_api.db_operations import (
+    GuestOperations, GUEST_PAGE_SIZE_MAX, engine, init_database,
+    get_async_db_session, get_phone_class
+)
+from src.whatsapp_api.models import GuestResponse
+from src.whatsapp_api.rest.crud import encode_json_array
+
+import orjson
+
+GUEST_LIST_ADAPTER = TypeAdapter(List[GuestResponse])
+
+
+def seed(total: int):
+    """Add guests until there are `total`"""
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count(Guest.id))).scalar()
+        conn.execute(insert(Guest), [
+            {
+                'first_name': f'Guest{i}',
+                'last_name': 'Bench',
+                'phone': f'+9715{i:08d}',
+                'group_id': f'group-{i // 4:06d}',
+                'is_group_primary': i % 4 == 0,
+                'ready': i % 3 == 0,
+                'sent_to_whatsapp': 'succeeded' if i % 2 else 'pending',
+                'message_id': f'wamid.{i}' if i % 2 else None,
+            }
+            for i in range(existing, total)
+        ])
+
+
+async def orm_guest_list() -> bytes:
+    """GET /api/guests before the Core read path, with response_model=List[GuestResponse]"""
+    guests = []
+    async with get_async_db_session() as session:
+        stream = await session.stream_scalars(select(Guest).order_by(Guest.group_id, Guest.is_group_primary.desc()))
+        async for partition in stream.partitions(500):
+            for guest in partition:
+                guests.append({
+                    'id': guest.id, 'prefix': guest.prefix, 'first_name': guest.first_name,
+                    'last_name': guest.last_name, 'greeting_name': guest.greeting_name, 'phone': guest.phone,
+                    'group_id': guest.group_id, 'is_group_primary': guest.is_group_primary, 'ready': guest.ready,
+                    'sent_to_whatsapp': guest.sent_to_whatsapp, 'api_call_at': guest.api_call_at,
+                    'sent_at': guest.sent_at, 'delivered_at': guest.delivered_at, 'read_at': guest.read_at,
+                    'responded_with_button': guest.responded_with_button, 'message_id': guest.message_id,
+                    'delivery_status': guest.delivery_status, 'failed_at': guest.failed_at,
+                    'delivery_error': guest.delivery_error, 'calling_code': guest.calling_code,
+                    'created_at': guest.created_at, 'updated_at': guest.updated_at,
+                    'phone_class': get_phone_class(guest.calling_code),
+                })
+    # What FastAPI does with a response_model, then JSONResponse.render
+    content = GUEST_LIST_ADAPTER.dump_python(GUEST_LIST_ADAPTER.validate_python(guests), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+async def core_guest_list() -> bytes:
+    guests = await GuestOperations.get_all_guests()
+    return encode_json_array(guests)
+
+
+async def core_guest_pages() -> bytes:
+    """Every page of GET /api/guests; returns the last page's body"""
+    cursor = None
+    while True:
+        page = await GuestOperations.list_guests_page(limit=GUEST_PAGE_SIZE_MAX, cursor=cursor)
+        body = b'{"guests":' + encode_json_array(page.pop('guests')) + b',' + orjson.dumps(page)[1:]
+        cursor = page['next_cursor']
+        if cursor is None:
+            return body
+
+
+READ_PATHS = {
+    'orm': orm_guest_list,
+    'core': core_guest_list,
+    'core-paged': core_guest_pages,
+}
+
+
+async def measure(read_path, repeat: int) -> dict:
+    await read_path()  # warm caches and connections
+    cpu_ms = []
+    wall_ms = []
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        await read_path()
+        cpu_ms.append((time.process_time() - cpu) * 1000)
+        wall_ms.append((time.perf_counter() - wall) * 1000)
+
+    # Separate run: tracemalloc slows everything down
+    tracemalloc.start()
+    await read_path()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_ms": min(cpu_ms), "wall_ms": min(wall_ms), "peak_mib": peak / 2 ** 20}
+
+
+async def main(args):
+    init_database()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    paths = args.paths.split(",")
+    print(f"{'guests':>8} {'path':<11} {'cpu ms':>9} {'wall ms':>9} {'peak MiB':>9}")
+    for size in sorted(sizes):
+        seed(size)
+        for name in paths:
+            result = await measure(READ_PATHS[name], args.repeat)
+            print(
+                f"{size:>8} {name:<11} {result['cpu_ms']:>9.1f} {result['wall_ms']:>9.1f} {result['peak_mib']:>9.1f}"
+            )
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated guest counts")
+    parser.add_argument("--paths", default=",".join(READ_PATHS), help="comma-separated read paths to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per path; the fastest is reported")
+    asyncio.run(main(parser.parse_args()))
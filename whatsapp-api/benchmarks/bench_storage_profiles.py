@@ -0,0 +1,155 @@
+"""
+Concurrent webhook writes and guest-list reads under each SQLite storage profile
+
+Run from the whatsapp-api directory:
+    python -m benchmarks.bench_storage_profiles --seconds 10 --writers 8 --readers 4
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from src.whatsapp_api.db_models import Base, Guest, WebhookPayload
+from src.whatsapp_api.db_operations import STATUS_UPDATE_STATEMENT, STATUS_PRECEDENCE, utcnow
+from src.whatsapp_api.storage import STORAGE_PROFILES, apply_storage_profile
+from src.whatsapp_api.webhook_queue import percentile
+
+STATUSES = ['sent', 'delivered', 'read']
+
+
+class RoleStats:
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.lock_errors = 0
+        self.other_errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, started: float, error: Exception = None):
+        with self._lock:
+            if error is None:
+                self.latencies_ms.append((time.perf_counter() - started) * 1000)
+            elif "locked" in str(error):
+                self.lock_errors += 1
+            else:
+                self.other_errors += 1
+
+
+def seed(engine, guests: int):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Guest), [
+            {
+                'first_name': f'Guest{i}',
+                'last_name': 'Bench',
+                'phone': f'9715{i:08d}',
+                'group_id': f'group-{i // 4}',
+                'is_group_primary': i % 4 == 0,
+                'ready': True,
+                'sent_to_whatsapp': 'succeeded',
+                'message_id': f'wamid.{i}',
+            }
+            for i in range(guests)
+        ])
+
+
+def webhook_writer(engine, guests: int, batch: int, deadline: float, stats: RoleStats):
+    """One webhook payload per transaction: the audit row plus a batch of status updates"""
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        rows = []
+        for guest_id in rng.sample(range(1, guests + 1), batch):
+            status = rng.choice(STATUSES)
+            row = {
+                'b_guest_id': guest_id, 'b_status': status, 'b_rank': STATUS_PRECEDENCE[status],
+                'b_sent_at': None, 'b_delivered_at': None, 'b_read_at': None, 'b_failed_at': None,
+                'b_error': None,
+            }
+            row[f'b_{status}_at'] = utcnow()
+            rows.append(row)
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(WebhookPayload).values(
+                    timestamp=utcnow(), event_type='delivered', payload=json.dumps(rows, default=str),
+                    is_multiple=True, processed=False
+                ))
+                conn.execute(STATUS_UPDATE_STATEMENT, rows)
+        except OperationalError as e:
+            stats.record(started, e)
+            continue
+        stats.record(started)
+
+
+def guest_list_reader(engine, deadline: float, stats: RoleStats):
+    """What GET /api/guests does: load every guest through the ORM"""
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            with Session(engine) as session:
+                session.query(Guest).all()
+        except OperationalError as e:
+            stats.record(started, e)
+            continue
+        stats.record(started)
+
+
+def summarize(profile: str, role: str, stats: RoleStats, seconds: float):
+    lats = stats.latencies_ms
+    p50 = percentile(lats, 0.50) or 0.0
+    p99 = percentile(lats, 0.99) or 0.0
+    print(
+        f"{profile:<8} {role:<7} ops={len(lats):<6} ops/s={len(lats) / seconds:8.1f} "
+        f"p50={p50:8.2f}ms p99={p99:8.2f}ms lock_errors={stats.lock_errors:<5} "
+        f"other_errors={stats.other_errors}"
+    )
+
+
+def bench(profile: str, db_path: str, args) -> Dict[str, RoleStats]:
+    engine = create_engine(f"sqlite:///{db_path}", pool_size=args.writers + args.readers)
+    apply_storage_profile(engine, STORAGE_PROFILES[profile])
+    seed(engine, args.guests)
+
+    writers, readers = RoleStats(), RoleStats()
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(target=webhook_writer, args=(engine, args.guests, args.batch, deadline, writers))
+        for _ in range(args.writers)
+    ] + [
+        threading.Thread(target=guest_list_reader, args=(engine, deadline, readers))
+        for _ in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    summarize(profile, "writes", writers, args.seconds)
+    summarize(profile, "reads", readers, args.seconds)
+    return {"writes": writers, "reads": readers}
+
+
+def main(args):
+    profiles = args.profiles.split(",")
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in profiles:
+            bench(profile, os.path.join(tmp, f"{profile}.db"), args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profiles", default=",".join(STORAGE_PROFILES), help="comma-separated profiles to compare")
+    parser.add_argument("--seconds", type=float, default=10, help="run time per profile")
+    parser.add_argument("--writers", type=int, default=8, help="threads applying webhook payloads")
+    parser.add_argument("--readers", type=int, default=4, help="threads loading the guest list")
+    parser.add_argument("--guests", type=int, default=2000, help="guests in the database")
+    parser.add_argument("--batch", type=int, default=50, help="statuses per webhook payload")
+    main(parser.parse_args())
@@ -0,0 +1,336 @@
+"""
+Synthetic large-wedding dataset: guests in family groups, the Graph API calls
+that sent their invites and the webhooks that followed, shaped like
+SAMPLE_DATA_DOCUMENTATION.md
+
+The same seed always produces the same rows, and a database can be grown from
+one scale to the next: guests already present are skipped.
+
+Run from the whatsapp-api directory:
+    python -m benchmarks.datagen --scale 100k --db /tmp/wedding-100k.db
+"""
+import os
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Tuple
+
+from src.whatsapp_api.compression import compact_json
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+# Invites went out from this moment; guests were added in the weeks before
+CAMPAIGN_START = datetime(2025, 7, 16, 15, 0, 0)
+GRAPH_URL = 'https://graph.facebook.com/v23.0/647078395158968/messages'
+BUSINESS_PHONE = '15556489771'
+TEMPLATE_NAME = 'wedding_pre_invite_1'
+
+# Calling code, national-number prefix and share of guests
+COUNTRIES = [('971', '5', 45), ('91', '9', 30), ('44', '7', 10), ('1', '2', 8), ('61', '4', 4), ('65', '8', 3)]
+# Guests per group, and share of groups of that size
+GROUP_SIZES = [(1, 30), (2, 35), (3, 15), (4, 12), (5, 5), (6, 3)]
+PREFIXES = [None] * 6 + ['Mr.', 'Mrs.', 'Ms.', 'Dr.']
+FIRST_NAMES = [
+    'Madhav', 'Priya', 'Arjun', 'Ananya', 'Rohan', 'Kavya', 'Vikram', 'Meera', 'Aditya', 'Isha',
+    'Omar', 'Layla', 'James', 'Sarah', 'Daniel', 'Aisha', 'Rahul', 'Neha', 'Sameer', 'Tara',
+]
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Khan', 'Singh', 'Mehta', 'Reddy', 'Smith', 'Williams', 'Rao']
+# Set only for guests whose invite went out; every row carries them so rows insert as one batch
+CAMPAIGN_FIELDS = (
+    'api_call_at', 'sent_at', 'delivered_at', 'read_at', 'responded_with_button', 'message_id',
+    'delivery_status', 'failed_at', 'delivery_error'
+)
+
+# Header sets stored once in audit_headers (see populate)
+REQUEST_HEADERS = {"Content-Type": "application/json", "Authorization": "Bearer [REDACTED]"}
+RESPONSE_HEADERS = {"content-type": "application/json"}
+WEBHOOK_HEADERS = {
+    "host": "vectorreasoning.space",
+    "user-agent": "facebookexternalua",
+    "accept": "*/*",
+    "accept-encoding": "deflate, gzip",
+    "content-type": "application/json",
+    "x-forwarded-proto": "https",
+    "x-hub-signature-256": "[REDACTED]",
+}
+
+
+def parse_scale(scale: str) -> int:
+    """'100k' -> 100000; plain numbers are accepted too"""
+    scale = scale.strip().lower()
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(scale)
+
+
+def message_id_for(guest_id: int) -> str:
+    return f'wamid.BENCH{guest_id:012d}'
+
+
+def _weighted(rng: random.Random, choices: List[Tuple]) -> Tuple:
+    return rng.choices(choices, weights=[choice[-1] for choice in choices])[0]
+
+
+def status_webhook(message_id: str, status: str, recipient: str, at: datetime) -> Dict[str, Any]:
+    """A sent/delivered/read receipt as Meta posts it"""
+    receipt: Dict[str, Any] = {
+        "id": message_id,
+        "status": status,
+        "timestamp": str(int(at.timestamp())),
+        "recipient_id": recipient,
+    }
+    if status == 'failed':
+        receipt["errors"] = [{"code": 131026, "title": "Message undeliverable"}]
+    elif status != 'read':
+        receipt["conversation"] = {"id": f"conv{message_id[-12:]}", "origin": {"type": "utility"}}
+        receipt["pricing"] = {"billable": True, "pricing_model": "PMP", "category": "utility", "type": "regular"}
+    return _webhook({"statuses": [receipt]})
+
+
+def button_webhook(phone: str, context_message_id: str, at: datetime, name: str = 'Guest') -> Dict[str, Any]:
+    """A guest tapping the invite template's quick-reply button"""
+    return _webhook({
+        "contacts": [{"profile": {"name": name}, "wa_id": phone}],
+        "messages": [{
+            "context": {"from": BUSINESS_PHONE, "id": context_message_id},
+            "from": phone,
+            "id": f"wamid.REPLY{context_message_id[-12:]}",
+            "timestamp": str(int(at.timestamp())),
+            "type": "button",
+            "button": {"payload": "Send me the invite", "text": "Send me the invite"},
+        }],
+    })
+
+
+def _webhook(value: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "1908606383273862",
+            "changes": [{
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": BUSINESS_PHONE, "phone_number_id": "647078395158968"},
+                    **value,
+                },
+                "field": "messages",
+            }],
+        }],
+    }
+
+
+def template_request(phone: str, name: str) -> Dict[str, Any]:
+    return {
+        "messaging_product": "whatsapp",
+        "to": phone,
+        "type": "template",
+        "template": {
+            "name": TEMPLATE_NAME,
+            "language": {"code": "en_US"},
+            "components": [{
+                "type": "body",
+                "parameters": [{"type": "text", "text": name, "parameter_name": "name"}],
+            }],
+        },
+    }
+
+
+def generate_guests(count: int, seed: int = 0, campaign: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    `count` guest rows with ids 1..count, a whole group at a time.
+
+    About 80% of guests with a phone are ready. With `campaign`, most of those
+    were sent an invite and have moved through sent -> delivered -> read, a
+    few failed, and some tapped the invite button; without it every invite is
+    still to be sent. Every primary has a phone, as do most other members.
+    """
+    rng = random.Random(seed)
+    guest_id = 0
+    group_number = 0
+    while guest_id < count:
+        group_number += 1
+        size = min(_weighted(rng, GROUP_SIZES)[0], count - guest_id)
+        last_name = rng.choice(LAST_NAMES)
+        code, national_prefix, _ = _weighted(rng, COUNTRIES)
+        group_id = f'{rng.choice(FIRST_NAMES).lower()}-{group_number}'
+        for member in range(size):
+            guest_id += 1
+            is_primary = member == 0
+            has_phone = is_primary or rng.random() < 0.7
+            first_name = rng.choice(FIRST_NAMES)
+            guest = {
+                'id': guest_id,
+                'prefix': rng.choice(PREFIXES),
+                'first_name': first_name,
+                'last_name': last_name,
+                'greeting_name': f'{first_name} {last_name}' if rng.random() < 0.2 else None,
+                'phone': f'+{code}{national_prefix}{guest_id:08d}' if has_phone else None,
+                'calling_code': code if has_phone else None,
+                'group_id': group_id,
+                'is_group_primary': is_primary,
+                'ready': has_phone and rng.random() < 0.8,
+                'sent_to_whatsapp': 'pending',
+                'created_at': CAMPAIGN_START - timedelta(days=30) + timedelta(seconds=rng.randrange(28 * 86400)),
+                **dict.fromkeys(CAMPAIGN_FIELDS),
+            }
+            if campaign and guest['ready'] and rng.random() < 0.9:
+                _add_campaign_progress(guest, rng)
+            guest['updated_at'] = max(
+                value for value in (guest['created_at'], *(guest[field] for field in CAMPAIGN_FIELDS))
+                if isinstance(value, datetime)
+            )
+            yield guest
+
+
+def _add_campaign_progress(guest: Dict[str, Any], rng: random.Random):
+    api_call_at = CAMPAIGN_START + timedelta(seconds=guest['id'] // 10)
+    guest['api_call_at'] = api_call_at
+    if rng.random() < 0.02:
+        guest['sent_to_whatsapp'] = 'failed'
+        return
+    guest['sent_to_whatsapp'] = 'succeeded'
+    guest['message_id'] = message_id_for(guest['id'])
+    guest['sent_at'] = api_call_at + timedelta(seconds=3)
+    guest['delivery_status'] = 'sent'
+    roll = rng.random()
+    if roll < 0.02:
+        guest['delivery_status'] = 'failed'
+        guest['failed_at'] = guest['sent_at'] + timedelta(seconds=2)
+        guest['delivery_error'] = '131026: Message undeliverable'
+        return
+    if roll < 0.95:
+        guest['delivery_status'] = 'delivered'
+        guest['delivered_at'] = guest['sent_at'] + timedelta(seconds=rng.randrange(1, 600))
+    if roll < 0.80:
+        guest['delivery_status'] = 'read'
+        guest['read_at'] = guest['delivered_at'] + timedelta(seconds=rng.randrange(5, 86400))
+        if rng.random() < 0.4:
+            guest['responded_with_button'] = guest['read_at'] + timedelta(seconds=rng.randrange(5, 3600))
+
+
+def api_call_rows(guest: Dict[str, Any], header_ids: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    The request/response pair logged for a guest's invite, as log_whatsapp_api_call
+    stores them; `header_ids` holds the audit_headers ids of the 'request' and
+    'response' header sets
+    """
+    if not guest.get('api_call_at'):
+        return []
+    phone = guest['phone'].lstrip('+')
+    name = guest['greeting_name'] or f"{guest['first_name']} {guest['last_name']}"
+    request = {
+        'timestamp': guest['api_call_at'], 'guest_id': guest['id'], 'direction': 'request', 'method': 'POST',
+        'url': GRAPH_URL, 'headers_id': header_ids['request'], 'payload': compact_json(template_request(phone, name)),
+        'status_code': None, 'response_time_ms': None, 'error_message': None,
+    }
+    if guest['sent_to_whatsapp'] == 'succeeded':
+        status_code, error, body = 200, None, {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": phone, "wa_id": phone}],
+            "messages": [{"id": guest['message_id'], "message_status": "accepted"}],
+        }
+    else:
+        status_code, error, body = 400, "(#100) Invalid parameter", {"error": {
+            "message": "(#100) Invalid parameter", "type": "OAuthException", "code": 100,
+            "error_data": {"messaging_product": "whatsapp", "details": "Parameter name is missing or empty"},
+            "fbtrace_id": "AtNAiNFtBJ0eRXu9pUoX0HW",
+        }}
+    response = {
+        **request, 'timestamp': guest['api_call_at'] + timedelta(seconds=1), 'direction': 'response',
+        'headers_id': header_ids['response'], 'payload': compact_json(body),
+        'status_code': status_code, 'response_time_ms': 250 + guest['id'] % 500, 'error_message': error,
+    }
+    return [request, response]
+
+
+def webhook_rows(guest: Dict[str, Any], header_ids: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Every webhook a guest's invite produced, as log_webhook_payload stores them"""
+    if not guest.get('message_id'):
+        return []
+    phone = guest['phone'].lstrip('+')
+    events = [(status, guest[column]) for status, column in (
+        ('sent', 'sent_at'), ('delivered', 'delivered_at'), ('read', 'read_at'), ('failed', 'failed_at')
+    ) if guest.get(column)]
+    rows = [
+        {'timestamp': at, 'guest_id': guest['id'], 'event_type': status,
+         'payload': compact_json(status_webhook(guest['message_id'], status, phone, at))}
+        for status, at in events
+    ]
+    if guest.get('responded_with_button'):
+        at = guest['responded_with_button']
+        payload = button_webhook(phone, guest['message_id'], at, guest['first_name'])
+        rows.append({'timestamp': at, 'guest_id': guest['id'], 'event_type': 'incoming_message',
+                     'payload': compact_json(payload)})
+    for row in rows:
+        row.update(headers_id=header_ids['webhook'], processed=True, is_multiple=False)
+    return rows
+
+
+def populate(
+    engine, guests: int, seed: int = 0, audit: bool = True, campaign: bool = True, batch_size: int = 10000
+) -> int:
+    """
+    Grow the (initialised) database at `engine` to `guests` guests, with
+    their audit rows when `audit` is set (see generate_guests for `campaign`).
+    Returns how many guests were added.
+    """
+    from sqlalchemy import func, insert, select
+    from src.whatsapp_api.db_models import Guest, WhatsAppAPICall, WebhookPayload
+    from src.whatsapp_api.db_operations import AuditHeaderOperations
+    from src.whatsapp_api.logging_utils import canonical_headers
+
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.max(Guest.id))).scalar() or 0
+        header_ids = {
+            name: AuditHeaderOperations.intern_sync(conn, canonical_headers(headers))
+            for name, headers in (('request', REQUEST_HEADERS), ('response', RESPONSE_HEADERS),
+                                  ('webhook', WEBHOOK_HEADERS))
+        }
+
+    added = 0
+    batch: List[Dict[str, Any]] = []
+
+    def flush():
+        with engine.begin() as conn:
+            conn.execute(insert(Guest), batch)
+            if audit:
+                api_calls = [row for guest in batch for row in api_call_rows(guest, header_ids)]
+                webhooks = [row for guest in batch for row in webhook_rows(guest, header_ids)]
+                if api_calls:
+                    conn.execute(insert(WhatsAppAPICall), api_calls)
+                if webhooks:
+                    conn.execute(insert(WebhookPayload), webhooks)
+        batch.clear()
+
+    for guest in generate_guests(guests, seed, campaign):
+        if guest['id'] <= existing:
+            continue
+        batch.append(guest)
+        added += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", default="1k", help=f"guest count: {', '.join(SCALES)} or a number")
+    parser.add_argument("--db", required=True, help="SQLite file to create or grow")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-audit", action="store_true", help="guests only, without API call and webhook rows")
+    parser.add_argument("--unsent", action="store_true", help="no invites sent yet: every ready guest is pending")
+    args = parser.parse_args()
+
+    # The database engines are created at import time
+    os.environ["WEDDING_DB_PATH"] = os.path.abspath(args.db)
+    from src.whatsapp_api.db_operations import engine, init_database
+
+    init_database()
+    added = populate(engine, parse_scale(args.scale), args.seed, audit=not args.no_audit, campaign=not args.unsent)
+    print(f"Added {added} guests to {args.db}")
+
+
+if __name__ == "__main__":
+    main()
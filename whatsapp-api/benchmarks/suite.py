@@ -0,0 +1,359 @@
+"""
+Microbenchmark suite: time and peak memory per operation on a synthetic
+wedding (benchmarks.datagen) at each scale, checked against stored baselines
+
+Run from the whatsapp-api directory:
+    python -m benchmarks.suite --scales 1k,100k          # compare with benchmarks/baselines.json
+    python -m benchmarks.suite --scales 1k,100k --save   # record these results as the baselines
+
+The dataset is generated into a temporary database, growing from one scale to
+the next; set BENCH_DB_PATH to keep it between runs (1m takes a few minutes to
+generate). Exits with status 1 when an operation is slower or uses more memory
+than its baseline by more than --threshold.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Awaitable, Dict, Any, List, Optional
+
+# The database engines are created at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ["WEDDING_DB_PATH"] = os.getenv("BENCH_DB_PATH") or os.path.join(_tmp.name, "bench.db")
+
+import httpx
+from sqlalchemy import func, select
+
+from src.whatsapp_api.db_models import Guest
+from src.whatsapp_api.db_operations import GuestOperations, engine, init_database, get_phone_class
+from src.whatsapp_api.guest_index import guest_index
+from src.whatsapp_api.logging_utils import extract_webhook_event_type
+from src.whatsapp_api.phone_countries import calling_code_for
+from src.whatsapp_api.webhook_events import parse_webhook
+
+from benchmarks.datagen import SCALES, CAMPAIGN_START, parse_scale, populate, status_webhook, button_webhook
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_THRESHOLD = 0.25
+# Differences below these are noise whatever the ratio
+TIME_NOISE_MS = 0.002
+MEMORY_NOISE_KIB = 32.0
+SAMPLE_SIZE = 1000
+
+
+@dataclass
+class Sample:
+    """Inputs drawn from the dataset at one scale, the same for every benchmark"""
+    guest_ids: List[int]
+    phones: List[str]
+    calling_codes: List[Optional[str]]
+    message_ids: List[str]
+    status_payloads: List[Dict[str, Any]] = field(default_factory=list)
+    button_payloads: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class Benchmark:
+    name: str
+    make: Callable[[Sample], Callable[[], Awaitable]]
+    calls: int = 1                     # operations per timed run; results are per operation
+    max_guests: Optional[int] = None   # skipped above this scale (e.g. whole-list reads)
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, calls: int = 1, max_guests: Optional[int] = None):
+    def register(make):
+        BENCHMARKS[name] = Benchmark(name, make, calls, max_guests)
+        return make
+    return register
+
+
+def load_sample(seed: int = 0) -> Sample:
+    rng = random.Random(seed)
+    with engine.connect() as conn:
+        total = conn.execute(select(func.max(Guest.id))).scalar() or 0
+        ids = rng.sample(range(1, total + 1), min(SAMPLE_SIZE, total))
+        rows = conn.execute(
+            select(Guest.id, Guest.phone, Guest.calling_code, Guest.message_id).where(Guest.id.in_(ids))
+        ).all()
+    rng.shuffle(rows)
+    sample = Sample(
+        guest_ids=[row.id for row in rows],
+        phones=[row.phone for row in rows if row.phone],
+        calling_codes=[row.calling_code for row in rows],
+        message_ids=[row.message_id for row in rows if row.message_id],
+    )
+    at = CAMPAIGN_START + timedelta(days=1)
+    for i, message_id in enumerate(sample.message_ids):
+        phone = sample.phones[i % len(sample.phones)].lstrip('+')
+        sample.status_payloads.append(status_webhook(message_id, ('sent', 'delivered', 'read')[i % 3], phone, at))
+        sample.button_payloads.append(button_webhook(phone, message_id, at))
+    return sample
+
+
+# Pure functions on the webhook and guest-list paths
+
+@benchmark("get_phone_class", calls=SAMPLE_SIZE)
+def bench_get_phone_class(sample: Sample):
+    async def run():
+        for calling_code in sample.calling_codes:
+            get_phone_class(calling_code)
+    return run
+
+
+@benchmark("calling_code_for", calls=SAMPLE_SIZE)
+def bench_calling_code_for(sample: Sample):
+    async def run():
+        for phone in sample.phones:
+            calling_code_for(phone)
+    return run
+
+
+@benchmark("extract_webhook_event_type", calls=SAMPLE_SIZE)
+def bench_extract_webhook_event_type(sample: Sample):
+    payloads = sample.status_payloads + sample.button_payloads
+
+    async def run():
+        for payload in payloads:
+            extract_webhook_event_type(payload)
+    return run
+
+
+@benchmark("parse_webhook.status", calls=SAMPLE_SIZE)
+def bench_parse_status_webhook(sample: Sample):
+    async def run():
+        for payload in sample.status_payloads:
+            parse_webhook(payload)
+    return run
+
+
+@benchmark("parse_webhook.button", calls=SAMPLE_SIZE)
+def bench_parse_button_webhook(sample: Sample):
+    async def run():
+        for payload in sample.button_payloads:
+            parse_webhook(payload)
+    return run
+
+
+# GuestOperations
+
+@benchmark("GuestOperations.get_guest", calls=100)
+def bench_get_guest(sample: Sample):
+    async def run():
+        for guest_id in sample.guest_ids[:100]:
+            await GuestOperations.get_guest(guest_id)
+    return run
+
+
+@benchmark("GuestOperations.resolve_webhook_guests", calls=100)
+def bench_resolve_webhook_guests(sample: Sample):
+    parsed = [parse_webhook(payload) for payload in sample.status_payloads[:100]]
+
+    async def run():
+        guest_index.clear()  # measure the database lookup, not the cache
+        for webhook in parsed:
+            await GuestOperations.resolve_webhook_guests(webhook.message_ids, webhook.phones)
+    return run
+
+
+@benchmark("GuestOperations.apply_status_updates", calls=100)
+def bench_apply_status_updates(sample: Sample):
+    parsed = [parse_webhook(payload) for payload in sample.status_payloads[:100]]
+
+    async def run():
+        for webhook in parsed:
+            matches = await GuestOperations.resolve_webhook_guests(webhook.message_ids, webhook.phones)
+            await GuestOperations.apply_status_updates(webhook, matches)
+    return run
+
+
+@benchmark("GuestOperations.list_guests_page")
+def bench_list_guests_page(sample: Sample):
+    return GuestOperations.list_guests_page
+
+
+@benchmark("GuestOperations.list_guests_page.calling_code")
+def bench_list_guests_page_by_country(sample: Sample):
+    return lambda: GuestOperations.list_guests_page(calling_code='44')
+
+
+@benchmark("GuestOperations.get_ready_guests_for_whatsapp")
+def bench_get_ready_guests(sample: Sample):
+    return GuestOperations.get_ready_guests_for_whatsapp
+
+
+@benchmark("GuestOperations.count_guests_by_country")
+def bench_count_guests_by_country(sample: Sample):
+    return GuestOperations.count_guests_by_country
+
+
+@benchmark("GuestOperations.get_all_guests", max_guests=SCALES['100k'])
+def bench_get_all_guests(sample: Sample):
+    return GuestOperations.get_all_guests
+
+
+# HTTP endpoints, in process
+
+def http_get(path: str):
+    from src.whatsapp_api.main import app
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            response = await client.get(path)
+            response.raise_for_status()
+    return run
+
+
+@benchmark("GET /api/guests")
+def bench_get_guests_endpoint(sample: Sample):
+    return http_get("/api/guests")
+
+
+@benchmark("GET /api/guests?ready=true&calling_code=971")
+def bench_get_filtered_guests_endpoint(sample: Sample):
+    return http_get("/api/guests?ready=true&calling_code=971")
+
+
+@benchmark("GET /api/guests/countries")
+def bench_guest_countries_endpoint(sample: Sample):
+    return http_get("/api/guests/countries")
+
+
+async def measure(operation: Callable[[], Awaitable], calls: int, repeat: int) -> Dict[str, float]:
+    await operation()  # warm caches and connections
+    wall_ms = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await operation()
+        wall_ms.append((time.perf_counter() - started) * 1000)
+
+    # Separate run: tracemalloc slows everything down
+    tracemalloc.start()
+    await operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"time_ms": min(wall_ms) / calls, "peak_kib": peak / 1024}
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": f"{platform.system()} {platform.machine()}",
+    }
+
+
+def load_baselines(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {"environment": {}, "scales": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path: str, baselines: Dict[str, Any]):
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def regressions(result: Dict[str, float], baseline: Optional[Dict[str, float]], threshold: float) -> List[str]:
+    """Which of time and memory grew by more than `threshold` (a fraction) over the baseline"""
+    if not baseline:
+        return []
+    found = []
+    for metric, noise in (("time_ms", TIME_NOISE_MS), ("peak_kib", MEMORY_NOISE_KIB)):
+        limit = baseline[metric] * (1 + threshold)
+        if result[metric] > limit and result[metric] - baseline[metric] > noise:
+            found.append(metric)
+    return found
+
+
+def change(result: Dict[str, float], baseline: Optional[Dict[str, float]], metric: str) -> str:
+    if not baseline or not baseline.get(metric):
+        return "new"
+    return f"{(result[metric] / baseline[metric] - 1) * 100:+.0f}%"
+
+
+async def main(args) -> int:
+    init_database()
+    scales = sorted((scale.strip().lower() for scale in args.scales.split(",")), key=parse_scale)
+    names = [name.strip() for name in args.only.split(",")] if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    baselines = load_baselines(args.baselines)
+    if not args.save and baselines["environment"] and baselines["environment"] != environment():
+        print(f"warning: baselines were recorded on {baselines['environment']}, this is {environment()}")
+
+    print(f"{'scale':>6} {'benchmark':<48} {'ms/op':>10} {'time':>6} {'peak KiB':>10} {'mem':>6}")
+    failed = []
+    for scale in scales:
+        guests = parse_scale(scale)
+        with engine.connect() as conn:
+            existing = conn.execute(select(func.count(Guest.id))).scalar()
+        if existing > guests:
+            print(f"# skipping {scale}: the database already has {existing} guests")
+            continue
+        added = populate(engine, guests, args.seed, audit=not args.no_audit)
+        if added:
+            print(f"# generated {added} guests for {scale}")
+        with engine.connect() as conn:
+            # Start every scale with an empty WAL so earlier writes do not skew the timings
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        sample = load_sample(args.seed)
+        scale_baselines = baselines["scales"].setdefault(scale, {})
+        for name in names:
+            bench = BENCHMARKS[name]
+            if bench.max_guests is not None and guests > bench.max_guests:
+                continue
+            result = await measure(bench.make(sample), bench.calls, args.repeat)
+            baseline = scale_baselines.get(name)
+            regressed = regressions(result, baseline, args.threshold)
+            if regressed:
+                failed.append(f"{scale} {name}: {', '.join(regressed)}")
+            print(
+                f"{scale:>6} {name:<48} {result['time_ms']:>10.4f} {change(result, baseline, 'time_ms'):>6} "
+                f"{result['peak_kib']:>10.1f} {change(result, baseline, 'peak_kib'):>6}"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+            sys.stdout.flush()
+            if args.save:
+                scale_baselines[name] = {metric: round(value, 6) for metric, value in result.items()}
+
+    if args.save:
+        baselines["environment"] = environment()
+        save_baselines(args.baselines, baselines)
+        print(f"Saved baselines to {args.baselines}")
+        return 0
+    if failed:
+        print(f"\n{len(failed)} regression(s) beyond {args.threshold:.0%}:")
+        for line in failed:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", default="1k,100k", help=f"comma-separated: {', '.join(SCALES)} or guest counts")
+    parser.add_argument("--only", help="comma-separated benchmark names (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark; the fastest is reported")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed growth over the baseline, as a fraction (0.25 = 25%%)")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="baselines JSON file")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--seed", type=int, default=0, help="dataset seed")
+    parser.add_argument("--no-audit", action="store_true", help="generate guests without API call and webhook rows")
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,242 @@
+"""
+Full invite campaign against the local fake Graph API
+
+Seeds a database with a synthetic wedding whose invites are all still to be
+sent, starts the application (uvicorn, in a subprocess) pointed at the fake
+API, presses "Send Invites" and waits until every invite has been sent and
+every status webhook processed. Reports invites/sec, webhook events/sec,
+send-to-read latency and SQLite lock errors.
+
+Run from the whatsapp-api directory:
+    python -m loadtest.driver --guests 5000 --rate 80 --throttle-rate 0.01 --error-rate 0.01
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Optional, Dict, Any, List
+
+# The database engines are created at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ["WEDDING_DB_PATH"] = os.path.join(_tmp.name, "loadtest.db")
+
+import aiohttp
+from sqlalchemy import select
+
+from src.whatsapp_api.db_models import Guest
+from src.whatsapp_api.db_operations import engine, init_database
+from src.whatsapp_api.webhook_queue import percentile
+
+from benchmarks.datagen import populate
+from loadtest.fake_graph import FakeGraphAPI, add_config_arguments, config_from_args
+
+# Outbox states with work still to do
+UNFINISHED_STATES = ('pending', 'claimed', 'in_flight')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app(port: int, log_path: str, **env: str) -> subprocess.Popen:
+    """Run the application under uvicorn with `env` added to this process's environment"""
+    with open(log_path, "w") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.whatsapp_api.main:app",
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+def stop_app(app: subprocess.Popen):
+    app.terminate()
+    try:
+        app.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        app.kill()
+
+
+async def wait_until_up(session: aiohttp.ClientSession, app_url: str, app: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise RuntimeError(f"The application exited with status {app.returncode}")
+        try:
+            async with session.get(f"{app_url}/whatsapp/stats") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"The application did not start within {timeout}s")
+
+
+def campaign_finished(app_stats: Dict[str, Any], fake: FakeGraphAPI) -> bool:
+    outbox = app_stats["invite_outbox"]
+    queue = app_stats["webhook_queue"]
+    return (
+        not any(outbox.get(state) for state in UNFINISHED_STATES)
+        and fake.pending_webhooks == 0
+        and queue["depth"] == 0
+        and queue["processed"] + queue["errors"] >= queue["accepted"]
+    )
+
+
+def send_to_read_latencies(fake: FakeGraphAPI) -> List[float]:
+    """
+    Seconds from the API accepting each invite to the application storing its
+    'read' status. Guests who then tapped the invite button are left out: the
+    button reply moves updated_at on again.
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(Guest.message_id, Guest.updated_at)
+            .where(Guest.delivery_status == 'read', Guest.responded_with_button.is_(None))
+        ).all()
+    latencies = []
+    for message_id, read_applied_at in rows:
+        message = fake.messages.get(message_id)
+        if message is not None:
+            latencies.append((read_applied_at - message.accepted_at).total_seconds())
+    return latencies
+
+
+def rate(count: int, first: Optional[float], last: Optional[float]) -> Optional[float]:
+    if not count or first is None or last is None or last <= first:
+        return None
+    return count / (last - first)
+
+
+def build_report(args, fake: FakeGraphAPI, app_stats: Dict[str, Any], elapsed: float, finished: bool) -> Dict[str, Any]:
+    latencies = send_to_read_latencies(fake)
+    dispatcher = app_stats["invite_dispatcher"]
+    queue = app_stats["webhook_queue"]
+    return {
+        "guests": args.guests,
+        "finished": finished,
+        "elapsed_s": round(elapsed, 2),
+        "invites": {
+            "sent": dispatcher["sent"],
+            "failed": dispatcher["failed"],
+            "retries": dispatcher["retries"],
+            "per_second": rate(fake.accepted, fake.first_accept, fake.last_accept),
+        },
+        "graph_api": fake.stats(),
+        "webhooks": {
+            "processed": queue["processed"],
+            "errors": queue["errors"],
+            "shed_503": queue["rejected"],
+            "per_second": rate(fake.webhooks_posted, fake.first_webhook, fake.last_webhook),
+            "queue_lag_ms_p99": queue["lag_ms_p99"],
+        },
+        "send_to_read_s": {
+            "samples": len(latencies),
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        "db_lock_errors": app_stats["database"]["lock_errors"],
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    def number(value, digits=1):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    invites, webhooks, latency, graph = (
+        report["invites"], report["webhooks"], report["send_to_read_s"], report["graph_api"]
+    )
+    print()
+    print(f"Campaign of {report['guests']} guests {'finished' if report['finished'] else 'TIMED OUT'} "
+          f"in {report['elapsed_s']}s")
+    print(f"  invites        {invites['sent']} sent, {invites['failed']} failed, {invites['retries']} retries, "
+          f"{number(invites['per_second'])}/s")
+    print(f"  graph api      {graph['throttled']} throttled (429), {graph['errors']} errors (500), "
+          f"{graph['rejected']} rejected")
+    print(f"  webhooks       {webhooks['processed']} processed, {webhooks['errors']} errors, "
+          f"{webhooks['shed_503']} shed with 503, {number(webhooks['per_second'])}/s, "
+          f"queue lag p99 {number(webhooks['queue_lag_ms_p99'])} ms")
+    print(f"  send -> read   p50 {number(latency['p50'], 2)}s, p90 {number(latency['p90'], 2)}s, "
+          f"p99 {number(latency['p99'], 2)}s, max {number(latency['max'], 2)}s ({latency['samples']} guests)")
+    print(f"  db lock errors {report['db_lock_errors']}")
+
+
+async def run(args) -> Dict[str, Any]:
+    init_database()
+    populate(engine, args.guests, args.seed, audit=False, campaign=False)
+
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+    fake = FakeGraphAPI(config_from_args(args, f"{app_url}/whatsapp/webhook"))
+    graph_port = await fake.start()
+    log_path = args.app_log or os.path.join(_tmp.name, "app.log")
+    app = start_app(
+        app_port, log_path,
+        WHATSAPP_API_BASE_URL=f"http://127.0.0.1:{graph_port}",
+        WHATSAPP_TOKEN="loadtest",
+        WHATSAPP_PHONE_NUMBER_ID="loadtest",
+        INVITE_RATE_PER_SECOND=str(args.rate),
+        INVITE_MAX_CONCURRENCY=str(args.concurrency),
+    )
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, app_url, app)
+            started = time.monotonic()
+            async with session.post(f"{app_url}/whatsapp/send-invites-to-ready-guests") as response:
+                queued = (await response.json()).get("queued_count", 0)
+            print(f"Queued {queued} invites (app log: {log_path})")
+
+            finished = False
+            while time.monotonic() - started < args.timeout:
+                await asyncio.sleep(1)
+                async with session.get(f"{app_url}/whatsapp/stats") as response:
+                    app_stats = await response.json()
+                dispatcher, queue = app_stats["invite_dispatcher"], app_stats["webhook_queue"]
+                print(
+                    f"  {time.monotonic() - started:6.1f}s  sent {dispatcher['sent']:>6}  "
+                    f"failed {dispatcher['failed']:>4}  retries {dispatcher['retries']:>4}  "
+                    f"webhooks {queue['processed']:>7}  queue {queue['depth']:>4}  "
+                    f"pending callbacks {fake.pending_webhooks:>6}  "
+                    f"lock errors {app_stats['database']['lock_errors']}"
+                )
+                sys.stdout.flush()
+                if campaign_finished(app_stats, fake):
+                    finished = True
+                    break
+            return build_report(args, fake, app_stats, time.monotonic() - started, finished)
+    finally:
+        stop_app(app)
+        await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guests", type=int, default=2000, help="guests in the synthetic wedding")
+    parser.add_argument("--rate", type=float, default=80, help="INVITE_RATE_PER_SECOND for the app")
+    parser.add_argument("--concurrency", type=int, default=10, help="INVITE_MAX_CONCURRENCY for the app")
+    parser.add_argument("--timeout", type=float, default=600, help="give up after this many seconds")
+    parser.add_argument("--app-log", help="where the application's output goes (default: a temporary file)")
+    parser.add_argument("--json", help="also write the report to this file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    raise SystemExit(0 if report["finished"] else 1)
+
+
+if __name__ == "__main__":
+    main()
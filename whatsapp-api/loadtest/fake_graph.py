@@ -0,0 +1,358 @@
+"""
+Local stand-in for the WhatsApp Cloud API (graph.facebook.com) for load tests
+
+Accepts template sends on POST /{version}/{phone_number_id}/messages with a
+configurable latency, injects 429 throttling and 5xx errors, issues message
+ids, and then calls the application's /whatsapp/webhook back with each
+message's sent -> delivered -> read statuses (and some invite button taps),
+retrying on 503 as Meta does.
+
+Run from the whatsapp-api directory, then start the app with
+WHATSAPP_API_BASE_URL=http://127.0.0.1:8081:
+    python -m loadtest.fake_graph --port 8081 --webhook-url http://127.0.0.1:8000/whatsapp/webhook
+"""
+import re
+import math
+import time
+import uuid
+import base64
+import random
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.datagen import status_webhook, button_webhook
+
+logger = logging.getLogger(__name__)
+
+_NON_DIGITS = re.compile(r'\D')
+
+# Graph error bodies for the injected failures
+THROTTLED_ERROR = {"message": "(#130429) Rate limit hit", "type": "OAuthException", "code": 130429}
+SERVER_ERROR = {"message": "(#131000) Something went wrong", "type": "OAuthException", "code": 131000}
+INVALID_PARAMETER_ERROR = {"message": "(#100) Invalid parameter", "type": "OAuthException", "code": 100}
+AUTH_ERROR = {"message": "Invalid OAuth access token", "type": "OAuthException", "code": 190}
+
+
+class Latency:
+    """
+    A delay distribution given as a spec string, in milliseconds:
+        fixed:50            always 50 ms
+        uniform:20,200      anywhere from 20 to 200 ms
+        lognormal:80,0.5    median 80 ms with a long tail (sigma 0.5)
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, args = spec.partition(':')
+        try:
+            self.kind = kind
+            self.args = [float(arg) for arg in args.split(',')] if args else []
+        except ValueError:
+            raise ValueError(f"Bad latency '{spec}'; expected e.g. fixed:50, uniform:20,200 or lognormal:80,0.5")
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2}.get(kind)
+        if expected is None or len(self.args) != expected:
+            raise ValueError(f"Bad latency '{spec}'; expected e.g. fixed:50, uniform:20,200 or lognormal:80,0.5")
+
+    def sample(self, rng: random.Random) -> float:
+        """One delay in seconds"""
+        if self.kind == 'fixed':
+            ms = self.args[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.args)
+        else:
+            median, sigma = self.args
+            ms = rng.lognormvariate(math.log(median), sigma)
+        return max(0.0, ms) / 1000
+
+    def __repr__(self) -> str:
+        return self.spec
+
+
+@dataclass
+class FakeGraphConfig:
+    latency: Latency = field(default_factory=lambda: Latency('lognormal:120,0.4'))
+    throttle_rate: float = 0.0       # share of sends answered 429
+    error_rate: float = 0.0          # share of sends answered 500
+    max_rps: float = 0.0             # sends per second before every further one gets 429 (0 = no limit)
+    retry_after: Optional[float] = None  # Retry-After seconds sent with 429s
+    webhook_url: Optional[str] = None
+    # Delays between the send and 'sent', then 'delivered', then 'read', then a button tap
+    sent_delay: Latency = field(default_factory=lambda: Latency('uniform:500,1500'))
+    delivered_delay: Latency = field(default_factory=lambda: Latency('lognormal:1500,0.5'))
+    read_delay: Latency = field(default_factory=lambda: Latency('lognormal:4000,0.6'))
+    button_delay: Latency = field(default_factory=lambda: Latency('lognormal:3000,0.5'))
+    undeliverable_rate: float = 0.02  # share of messages that end 'failed' instead of delivered
+    read_rate: float = 0.85           # share of delivered messages that are read
+    button_rate: float = 0.3          # share of read messages answered with the invite button
+    webhook_concurrency: int = 50
+    webhook_attempts: int = 5
+    seed: int = 0
+
+
+@dataclass
+class Message:
+    message_id: str
+    phone: str
+    accepted_at: datetime  # naive UTC, like the application's timestamps
+
+
+class FakeGraphAPI:
+    """The fake API server and its webhook sender, with counters for the load driver"""
+
+    def __init__(self, config: FakeGraphConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.messages: Dict[str, Message] = {}
+        self.requests = 0
+        self.accepted = 0
+        self.throttled = 0
+        self.errors = 0
+        self.rejected = 0
+        self.webhooks_posted = 0
+        self.webhook_retries = 0
+        self.webhook_failures = 0
+        self.first_accept: Optional[float] = None
+        self.last_accept: Optional[float] = None
+        self.first_webhook: Optional[float] = None
+        self.last_webhook: Optional[float] = None
+        self._window_start = 0.0
+        self._window_count = 0
+        self._callbacks: set = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._webhook_slots: Optional[asyncio.Semaphore] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def pending_webhooks(self) -> int:
+        """Messages whose status webhooks are still to be delivered"""
+        return len(self._callbacks)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/{version}/{phone_number_id}/messages', self.send_message)
+        app.router.add_get('/_fake/stats', self.stats_endpoint)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """Serve on host:port (0 picks a free port) and return the port"""
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._webhook_slots = asyncio.Semaphore(self.config.webhook_concurrency)
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        logger.info(f"Fake Graph API listening on http://{host}:{port}")
+        return port
+
+    async def stop(self):
+        for task in list(self._callbacks):
+            task.cancel()
+        await asyncio.gather(*self._callbacks, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._session is not None:
+            await self._session.close()
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.config.latency.sample(self.rng))
+
+        if not request.headers.get('Authorization', '').startswith('Bearer '):
+            self.rejected += 1
+            return web.json_response({"error": AUTH_ERROR}, status=401)
+        try:
+            body = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.json_response({"error": INVALID_PARAMETER_ERROR}, status=400)
+        problem = self._validate(body)
+        if problem:
+            self.rejected += 1
+            error = {**INVALID_PARAMETER_ERROR, "error_data": {"messaging_product": "whatsapp", "details": problem}}
+            return web.json_response({"error": error}, status=400)
+
+        if self._over_rate_limit() or self.rng.random() < self.config.throttle_rate:
+            self.throttled += 1
+            headers = {"Retry-After": str(self.config.retry_after)} if self.config.retry_after is not None else None
+            return web.json_response({"error": THROTTLED_ERROR}, status=429, headers=headers)
+        if self.rng.random() < self.config.error_rate:
+            self.errors += 1
+            return web.json_response({"error": SERVER_ERROR}, status=500)
+
+        phone = _NON_DIGITS.sub('', body['to'])
+        message = Message(new_message_id(phone), phone, datetime.now(timezone.utc).replace(tzinfo=None))
+        self.messages[message.message_id] = message
+        self.accepted += 1
+        now = time.monotonic()
+        self.first_accept = self.first_accept or now
+        self.last_accept = now
+        if self.config.webhook_url:
+            task = asyncio.create_task(self._status_sequence(message))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+        return web.json_response({
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": body['to'], "wa_id": phone}],
+            "messages": [{"id": message.message_id, "message_status": "accepted"}],
+        })
+
+    @staticmethod
+    def _validate(body: Any) -> Optional[str]:
+        if not isinstance(body, dict) or body.get('messaging_product') != 'whatsapp':
+            return "messaging_product must be whatsapp"
+        if not _NON_DIGITS.sub('', str(body.get('to') or '')):
+            return "Recipient phone number is missing"
+        template = body.get('template') or {}
+        if body.get('type') != 'template' or not template.get('name'):
+            return "Template name is missing"
+        for component in template.get('components') or []:
+            for parameter in component.get('parameters') or []:
+                if parameter.get('type') == 'text' and not parameter.get('parameter_name'):
+                    return "Parameter name is missing or empty"
+        return None
+
+    def _over_rate_limit(self) -> bool:
+        if not self.config.max_rps:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count > self.config.max_rps
+
+    async def _status_sequence(self, message: Message):
+        """Post the message's statuses to the application in order, as WhatsApp would"""
+        config = self.config
+        await asyncio.sleep(config.sent_delay.sample(self.rng))
+        await self._post(status_webhook(message.message_id, 'sent', message.phone, _utc_now()))
+
+        await asyncio.sleep(config.delivered_delay.sample(self.rng))
+        if self.rng.random() < config.undeliverable_rate:
+            await self._post(status_webhook(message.message_id, 'failed', message.phone, _utc_now()))
+            return
+        await self._post(status_webhook(message.message_id, 'delivered', message.phone, _utc_now()))
+
+        if self.rng.random() >= config.read_rate:
+            return
+        await asyncio.sleep(config.read_delay.sample(self.rng))
+        await self._post(status_webhook(message.message_id, 'read', message.phone, _utc_now()))
+
+        if self.rng.random() < config.button_rate:
+            await asyncio.sleep(config.button_delay.sample(self.rng))
+            await self._post(button_webhook(message.phone, message.message_id, _utc_now()))
+
+    async def _post(self, payload: Dict[str, Any]) -> bool:
+        """Deliver one webhook, retrying on errors and 503 like Meta; True once acknowledged"""
+        delay = 1.0
+        for attempt in range(self.config.webhook_attempts):
+            if attempt:
+                self.webhook_retries += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+            try:
+                async with self._webhook_slots:
+                    async with self._session.post(self.config.webhook_url, json=payload) as response:
+                        await response.read()
+                        if response.status == 200:
+                            self.webhooks_posted += 1
+                            now = time.monotonic()
+                            self.first_webhook = self.first_webhook or now
+                            self.last_webhook = now
+                            return True
+                        retry_after = response.headers.get('Retry-After')
+                        if retry_after and retry_after.isdigit():
+                            delay = max(delay, float(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Webhook delivery failed: {str(e)}")
+        self.webhook_failures += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "accepted": self.accepted,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "webhooks_posted": self.webhooks_posted,
+            "webhook_retries": self.webhook_retries,
+            "webhook_failures": self.webhook_failures,
+            "pending_webhooks": self.pending_webhooks,
+        }
+
+    async def stats_endpoint(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+
+def new_message_id(phone: str) -> str:
+    """A message id in the format of the real API: 'wamid.' and base64 of the recipient and a unique id"""
+    raw = b'\x18' + bytes([len(phone)]) + phone.encode() + b'\x15\x02\x00\x11\x18\x12' + uuid.uuid4().bytes + b'\x00'
+    return 'wamid.' + base64.b64encode(raw).decode()
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeGraphConfig()
+    parser.add_argument("--latency", type=Latency, default=defaults.latency,
+                        help="send latency: fixed:MS, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (default %(default)s)")
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate, help="share of sends answered 429")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="share of sends answered 500")
+    parser.add_argument("--max-rps", type=float, default=defaults.max_rps, help="throughput limit before 429s (0 = none)")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--sent-delay", type=Latency, default=defaults.sent_delay, help="send -> 'sent' webhook")
+    parser.add_argument("--delivered-delay", type=Latency, default=defaults.delivered_delay, help="'sent' -> 'delivered'")
+    parser.add_argument("--read-delay", type=Latency, default=defaults.read_delay, help="'delivered' -> 'read'")
+    parser.add_argument("--read-rate", type=float, default=defaults.read_rate, help="share of delivered messages read")
+    parser.add_argument("--button-rate", type=float, default=defaults.button_rate,
+                        help="share of read messages answered with the invite button")
+    parser.add_argument("--undeliverable-rate", type=float, default=defaults.undeliverable_rate,
+                        help="share of messages that fail to deliver")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace, webhook_url: Optional[str]) -> FakeGraphConfig:
+    return FakeGraphConfig(
+        latency=args.latency, throttle_rate=args.throttle_rate, error_rate=args.error_rate, max_rps=args.max_rps,
+        retry_after=args.retry_after, webhook_url=webhook_url, sent_delay=args.sent_delay,
+        delivered_delay=args.delivered_delay, read_delay=args.read_delay, read_rate=args.read_rate,
+        button_rate=args.button_rate, undeliverable_rate=args.undeliverable_rate, seed=args.seed,
+    )
+
+
+async def serve(args: argparse.Namespace):
+    fake = FakeGraphAPI(config_from_args(args, args.webhook_url))
+    await fake.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--webhook-url", help="the app's webhook, e.g. http://127.0.0.1:8000/whatsapp/webhook")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
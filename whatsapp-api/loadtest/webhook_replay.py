@@ -0,0 +1,425 @@
+"""
+Replay captured webhooks from webhook_payloads against a scratch copy of a database
+
+Copies the given database, reads its stored webhook payloads in timestamp
+order and replays them on the copy with their original spacing divided by
+--speed (or as fast as possible with --speed max), either by posting them to
+/whatsapp/webhook of the application started on the copy (--mode http) or by
+calling the webhook processing pipeline directly (--mode pipeline). Reports
+throughput, per-payload latency percentiles and which guest fields changed.
+
+With --reset-statuses every guest's receipt fields are cleared first, so the
+replay has to rebuild them; guests whose rebuilt fields differ from the
+captured database are reported as mismatches and the exit status is 1.
+
+Run from the whatsapp-api directory:
+    python -m loadtest.webhook_replay wedding.db --speed 10
+    python -m loadtest.webhook_replay wedding.db --speed max --mode http --reset-statuses --diff diff.jsonl
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+# The database engines are created at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ["WEDDING_DB_PATH"] = os.path.join(_tmp.name, "replay.db")
+
+import aiohttp
+from sqlalchemy import delete, func, select, update
+
+from src.whatsapp_api.db_models import AuditHeaders, Guest, WebhookEventKey, WebhookPayload
+from src.whatsapp_api.db_operations import engine, get_db_path, init_database
+from src.whatsapp_api.webhook_events import parse_webhook
+from src.whatsapp_api.webhook_queue import percentile, WEBHOOK_WORKERS
+
+from loadtest.driver import free_port, start_app, stop_app, wait_until_up
+
+logger = logging.getLogger(__name__)
+
+# Guest fields written by webhooks; the diff and --reset-statuses cover these
+WEBHOOK_FIELDS = (
+    'sent_at', 'delivered_at', 'read_at', 'failed_at', 'responded_with_button', 'delivery_status', 'delivery_error'
+)
+
+# Payloads in flight at once over HTTP (the app queues them for its own workers)
+HTTP_CONCURRENCY = 50
+
+
+@dataclass
+class Capture:
+    """One stored webhook payload and when the replay should deliver it (seconds from the start)"""
+    id: int
+    timestamp: datetime
+    payload: Dict[str, Any]
+    headers: Dict[str, Any]
+    due: float = 0.0
+
+
+def copy_database(source: str, target: str):
+    """Consistent copy of a (possibly live, WAL-mode) SQLite database"""
+    src = sqlite3.connect(f"file:{os.path.abspath(source)}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def parse_speed(value: str) -> Optional[float]:
+    """'1', '10', '10x' -> a multiplier; 'max' -> None (no waiting between payloads)"""
+    if value.lower() == 'max':
+        return None
+    speed = float(value.lower().rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def load_captures(
+    speed: Optional[float], since: Optional[datetime], until: Optional[datetime], limit: Optional[int]
+) -> Tuple[List[Capture], int]:
+    """Stored payloads in timestamp order with their replay times, and how many could not be decoded"""
+    query = select(
+        WebhookPayload.id, WebhookPayload.timestamp, WebhookPayload.payload,
+        func.coalesce(AuditHeaders.headers, WebhookPayload.headers).label('headers')
+    ).outerjoin(AuditHeaders, AuditHeaders.id == WebhookPayload.headers_id)
+    if since:
+        query = query.where(WebhookPayload.timestamp >= since)
+    if until:
+        query = query.where(WebhookPayload.timestamp < until)
+    query = query.order_by(WebhookPayload.timestamp, WebhookPayload.id)
+    if limit:
+        query = query.limit(limit)
+
+    captures, undecodable = [], 0
+    with engine.connect() as conn:
+        for row in conn.execute(query):
+            try:
+                payload = json.loads(row.payload)
+                headers = json.loads(row.headers) if row.headers else {}
+            except (TypeError, ValueError):
+                undecodable += 1
+                continue
+            captures.append(Capture(row.id, row.timestamp, payload, headers))
+
+    if captures and speed is not None:
+        start = captures[0].timestamp
+        for capture in captures:
+            capture.due = (capture.timestamp - start).total_seconds() / speed
+    return captures, undecodable
+
+
+def guest_states() -> Dict[int, Tuple]:
+    """Each guest's webhook fields, by guest id"""
+    columns = [getattr(Guest, name) for name in WEBHOOK_FIELDS]
+    with engine.connect() as conn:
+        return {row[0]: tuple(row[1:]) for row in conn.execute(select(Guest.id, *columns))}
+
+
+def reset_statuses():
+    with engine.begin() as conn:
+        conn.execute(update(Guest).values({name: None for name in WEBHOOK_FIELDS}))
+
+
+def diff_states(before: Dict[int, Tuple], after: Dict[int, Tuple]) -> List[Dict[str, Any]]:
+    """Changed fields per guest: [{"id": 7, "read_at": [before, after], ...}, ...]"""
+    changes = []
+    for guest_id, new in after.items():
+        old = before.get(guest_id, (None,) * len(WEBHOOK_FIELDS))
+        fields = {name: [o, n] for name, o, n in zip(WEBHOOK_FIELDS, old, new) if o != n}
+        if fields:
+            changes.append({"id": guest_id, **fields})
+    return changes
+
+
+def summarize_diff(changes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    fields = Counter(name for change in changes for name in change if name != "id")
+    transitions = Counter(
+        f"{change['delivery_status'][0]} -> {change['delivery_status'][1]}"
+        for change in changes if 'delivery_status' in change
+    )
+    return {"guests": len(changes), "fields": dict(fields), "delivery_status": dict(transitions)}
+
+
+def count_events(captures: List[Capture]) -> int:
+    """Statuses and messages carried by the payloads"""
+    events = 0
+    for capture in captures:
+        parsed = parse_webhook(capture.payload)
+        events += len(parsed.statuses) + len(parsed.messages)
+    return events
+
+
+class Replayer:
+    """Delivers captures on schedule with at most `concurrency` in flight, timing each one"""
+
+    def __init__(self, concurrency: int):
+        self._slots = asyncio.Semaphore(concurrency)
+        self.latencies_ms: List[float] = []
+        self.failures = 0
+        self.retries = 0
+
+    async def deliver(self, capture: Capture):
+        raise NotImplementedError
+
+    async def run(self, captures: List[Capture], paced: bool = True) -> float:
+        """
+        Replay everything; returns the elapsed seconds. Latency counts from
+        each payload's due time when `paced` (so falling behind shows up), and
+        from when it was handed over otherwise.
+        """
+        started = time.monotonic()
+        tasks = []
+        for capture in captures:
+            delay = started + capture.due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._slots.acquire()
+            timed_from = started + capture.due if paced else time.monotonic()
+            tasks.append(asyncio.create_task(self._timed(capture, timed_from)))
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+    async def _timed(self, capture: Capture, timed_from: float):
+        try:
+            await self.deliver(capture)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Replay of webhook payload {capture.id} failed: {str(e)}")
+        finally:
+            self.latencies_ms.append((time.monotonic() - timed_from) * 1000)
+            self._slots.release()
+
+
+class PipelineReplayer(Replayer):
+    """Calls the webhook processing (guest lookup, payload log, status updates) in this process"""
+
+    async def deliver(self, capture: Capture):
+        from src.whatsapp_api.rest.whatsapp import process_webhook_payload
+        await process_webhook_payload(capture.payload, capture.headers)
+
+
+class HttpReplayer(Replayer):
+    """Posts each payload to the app's webhook, redelivering after a 503 as Meta does"""
+
+    def __init__(self, concurrency: int, session: aiohttp.ClientSession, webhook_url: str):
+        super().__init__(concurrency)
+        self.session = session
+        self.webhook_url = webhook_url
+
+    async def deliver(self, capture: Capture):
+        while True:
+            async with self.session.post(self.webhook_url, json=capture.payload) as response:
+                if response.status != 503:
+                    response.raise_for_status()
+                    return
+                retry_after = float(response.headers.get("Retry-After", "1"))
+            self.retries += 1
+            await asyncio.sleep(retry_after)
+
+
+async def replay_pipeline(
+    captures: List[Capture], concurrency: int, paced: bool
+) -> Tuple[Replayer, float, Dict[str, Any]]:
+    from src.whatsapp_api.audit_writer import audit_writer
+    from src.whatsapp_api.guest_index import guest_index
+    from src.whatsapp_api.webhook_dedupe import webhook_dedupe
+
+    await guest_index.warm()
+    await audit_writer.start()
+    await webhook_dedupe.start()
+    replayer = PipelineReplayer(concurrency)
+    try:
+        elapsed = await replayer.run(captures, paced)
+    finally:
+        await webhook_dedupe.stop()
+        await audit_writer.stop()
+    return replayer, elapsed, {"webhook_dedupe": webhook_dedupe.stats()}
+
+
+async def replay_http(
+    captures: List[Capture], concurrency: int, paced: bool, app_log: str
+) -> Tuple[Replayer, float, Dict[str, Any]]:
+    port = free_port()
+    app_url = f"http://127.0.0.1:{port}"
+    app = start_app(port, app_log, WEDDING_DB_PATH=str(get_db_path()))
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, app_url, app)
+            replayer = HttpReplayer(concurrency, session, f"{app_url}/whatsapp/webhook")
+            started = time.monotonic()
+            await replayer.run(captures, paced)
+            # The app acknowledges before processing: wait for its queue to drain
+            while True:
+                async with session.get(f"{app_url}/whatsapp/stats") as response:
+                    app_stats = await response.json()
+                queue = app_stats["webhook_queue"]
+                if queue["depth"] == 0 and queue["processed"] + queue["errors"] >= queue["accepted"]:
+                    break
+                await asyncio.sleep(0.1)
+            return replayer, time.monotonic() - started, app_stats
+    finally:
+        stop_app(app)
+
+
+def build_report(
+    args, captures: List[Capture], undecodable: int, replayer: Replayer, elapsed: float,
+    app_stats: Dict[str, Any], changes: List[Dict[str, Any]], mismatches: Optional[int]
+) -> Dict[str, Any]:
+    latencies = replayer.latencies_ms
+    events = count_events(captures)
+    dedupe = app_stats.get("webhook_dedupe", {})
+    report = {
+        "mode": args.mode,
+        "speed": args.speed,
+        "payloads": len(captures),
+        "events": events,
+        "undecodable": undecodable,
+        "failures": replayer.failures,
+        "elapsed_s": round(elapsed, 3),
+        "payloads_per_second": len(captures) / elapsed if elapsed else None,
+        "events_per_second": events / elapsed if elapsed else None,
+        # pipeline: until processed; http: until acknowledged by the app (see Replayer.run)
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        # Events the capture itself holds more than once (redeliveries), dropped by the app
+        "duplicate_events": dedupe.get("duplicate_events"),
+        "payloads_skipped": dedupe.get("payloads_skipped"),
+        "guest_changes": summarize_diff(changes),
+        "mismatches": mismatches,
+    }
+    if args.mode == 'http':
+        app_queue = app_stats.get("webhook_queue", {})
+        report["http"] = {
+            "redelivered_after_503": replayer.retries,
+            "queue_lag_ms_p50": app_queue.get("lag_ms_p50"),
+            "queue_lag_ms_p99": app_queue.get("lag_ms_p99"),
+            "queue_errors": app_queue.get("errors"),
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    def number(value, digits=1):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    latency, changes = report["latency_ms"], report["guest_changes"]
+    print(f"Replayed {report['payloads']} payloads ({report['events']} events) over {report['mode']} "
+          f"at speed {report['speed']} in {report['elapsed_s']}s")
+    if report["undecodable"] or report["failures"]:
+        print(f"  skipped        {report['undecodable']} undecodable, {report['failures']} failed")
+    print(f"  throughput     {number(report['payloads_per_second'])} payloads/s, "
+          f"{number(report['events_per_second'])} events/s")
+    print(f"  latency        p50 {number(latency['p50'], 2)} ms, p90 {number(latency['p90'], 2)} ms, "
+          f"p99 {number(latency['p99'], 2)} ms, max {number(latency['max'], 2)} ms")
+    if report["duplicate_events"]:
+        print(f"  duplicates     {report['duplicate_events']} redelivered events dropped, "
+              f"{report['payloads_skipped']} payloads skipped entirely")
+    if "http" in report:
+        http = report["http"]
+        print(f"  app queue      lag p50 {number(http['queue_lag_ms_p50'])} ms, "
+              f"p99 {number(http['queue_lag_ms_p99'])} ms, {http['queue_errors']} errors, "
+              f"{http['redelivered_after_503']} redelivered after 503")
+    print(f"  guests changed {changes['guests']}")
+    for name, count in sorted(changes["fields"].items()):
+        print(f"    {name:<22} {count}")
+    for transition, count in sorted(changes["delivery_status"].items(), key=lambda item: -item[1]):
+        print(f"    delivery_status {transition}: {count}")
+    if report["mismatches"] is not None:
+        print(f"  mismatches     {report['mismatches']} guests differ from the captured database")
+
+
+def json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+async def run(args) -> Dict[str, Any]:
+    copy_database(args.database, get_db_path())
+    init_database()  # brings an older capture up to the current schema
+    with engine.begin() as conn:
+        # Every captured event was processed once already; without this they would all be skipped as redeliveries
+        conn.execute(delete(WebhookEventKey))
+
+    speed = parse_speed(args.speed)
+    captures, undecodable = load_captures(speed, args.since, args.until, args.limit)
+    if not captures:
+        raise SystemExit(f"No webhook payloads to replay in {args.database}")
+
+    captured = guest_states()
+    if args.reset_statuses:
+        reset_statuses()
+    before = guest_states() if args.reset_statuses else captured
+    print(f"Replaying {len(captures)} payloads from {captures[0].timestamp} to {captures[-1].timestamp}")
+    sys.stdout.flush()
+
+    if args.mode == 'http':
+        concurrency = args.concurrency or HTTP_CONCURRENCY
+        replayer, elapsed, app_stats = await replay_http(
+            captures, concurrency, speed is not None, args.app_log or os.path.join(_tmp.name, "app.log")
+        )
+    else:
+        replayer, elapsed, app_stats = await replay_pipeline(
+            captures, args.concurrency or WEBHOOK_WORKERS, speed is not None
+        )
+
+    after = guest_states()
+    changes = diff_states(before, after)
+    mismatches = len(diff_states(captured, after)) if args.reset_statuses else None
+    if args.diff:
+        with open(args.diff, "w") as f:
+            for change in changes:
+                f.write(json.dumps(change, default=json_default) + "\n")
+    if args.keep:
+        copy_database(get_db_path(), args.keep)
+    return build_report(args, captures, undecodable, replayer, elapsed, app_stats, changes, mismatches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("database", help="SQLite database with captured webhook_payloads (only read)")
+    parser.add_argument("--speed", default="1", help="1 = original pacing, 10 = ten times faster, max = no waiting")
+    parser.add_argument("--mode", choices=("pipeline", "http"), default="pipeline",
+                        help="call the processing directly, or post to the app started under uvicorn")
+    parser.add_argument("--concurrency", type=int,
+                        help=f"payloads in flight (default {WEBHOOK_WORKERS} for pipeline, {HTTP_CONCURRENCY} for http)")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="only payloads stored at or after this time")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="only payloads stored before this time")
+    parser.add_argument("--limit", type=int, help="replay at most this many payloads")
+    parser.add_argument("--reset-statuses", action="store_true",
+                        help="clear the guests' receipt fields first and check the replay rebuilds them")
+    parser.add_argument("--diff", help="write the changed fields of every guest to this JSONL file")
+    parser.add_argument("--keep", help="save the scratch database here afterwards")
+    parser.add_argument("--app-log", help="where the application's output goes in http mode")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    try:
+        parse_speed(args.speed)
+    except (ValueError, argparse.ArgumentTypeError):
+        parser.error(f"bad --speed '{args.speed}'; expected a multiplier such as 1, 10 or 10x, or max")
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=json_default)
+    raise SystemExit(1 if report["mismatches"] or report["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
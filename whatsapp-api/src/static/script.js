@@ -1,6 +1,9 @@
 
 // Global variables
 let guests = [];
+const GUEST_PAGE_SIZE = 1000;
+let syncToken = null;      // watermark of the data in `guests`, from the API's sync_token
+let guestListEtag = null;  // ETag of the last delta request, for If-None-Match
 let isPhoneValid = false;
 let formValidationState = {
     prefix: true,  // Optional, so default valid
@@ -288,13 +291,57 @@ function showMessage(message, type) {
     }, 5000);
 }
 
-// Fetch and display guests
-async function loadGuests() {
-    try {
-        const response = await fetch('/api/guests');
+// Fetch every page of /api/guests for a query; resolves to null when the server answers 304
+async function fetchGuestPages(baseParams, etag) {
+    const fetched = [];
+    let deleted = [];
+    let token = null;
+    let firstEtag = null;
+    let cursor = null;
+    do {
+        const params = new URLSearchParams(baseParams);
+        if (cursor) params.set('cursor', cursor);
+        const headers = (!cursor && etag) ? { 'If-None-Match': etag } : {};
+        const response = await fetch(`/api/guests?${params}`, { headers, cache: 'no-store' });
+        if (response.status === 304) return null;
         if (!response.ok) throw new Error('Failed to fetch guests');
         
-        guests = await response.json();
+        const page = await response.json();
+        if (!cursor) {
+            token = page.sync_token;
+            firstEtag = response.headers.get('ETag');
+            deleted = page.deleted || [];
+        }
+        fetched.push(...page.guests);
+        cursor = page.next_cursor;
+    } while (cursor);
+    return { guests: fetched, deleted, syncToken: token, etag: firstEtag };
+}
+
+// Apply changed and deleted guests to the local list, keeping the server's (group_id, id) order
+function mergeGuests(changed, deletedIds) {
+    const byId = new Map(guests.map(guest => [guest.id, guest]));
+    changed.forEach(guest => byId.set(guest.id, guest));
+    deletedIds.forEach(id => byId.delete(id));
+    guests = [...byId.values()].sort((a, b) =>
+        a.group_id < b.group_id ? -1 : a.group_id > b.group_id ? 1 : a.id - b.id
+    );
+}
+
+// Fetch and display guests: the full list once, then only what changed since
+async function loadGuests() {
+    try {
+        if (syncToken === null) {
+            const result = await fetchGuestPages({ limit: GUEST_PAGE_SIZE });
+            guests = result.guests;
+            syncToken = result.syncToken;
+        } else {
+            const result = await fetchGuestPages({ limit: GUEST_PAGE_SIZE, since: syncToken }, guestListEtag);
+            if (result === null) return;  // 304: nothing changed
+            mergeGuests(result.guests, result.deleted);
+            syncToken = result.syncToken;
+            guestListEtag = result.etag;
+        }
         displayGuests();
     } catch (error) {
         console.error('Error loading guests:', error);
@@ -302,6 +349,34 @@ async function loadGuests() {
     }
 }
 
+// Apply a pushed status change; unknown guests mean our copy is behind, so delta sync instead
+function applyGuestEvent(event) {
+    const changed = JSON.parse(event.data).guests;
+    const byId = new Map(guests.map(guest => [guest.id, guest]));
+    if (changed.some(guest => !byId.has(guest.id))) {
+        loadGuests();
+        return;
+    }
+    changed.forEach(guest => Object.assign(byId.get(guest.id), guest));
+    displayGuests();
+}
+
+// Follow guest status changes as the server pushes them, polling only without EventSource
+function subscribeToGuestEvents() {
+    if (!window.EventSource) {
+        setInterval(loadGuests, 30000);
+        return;
+    }
+    const source = new EventSource('/api/guests/events');
+    source.addEventListener('guests', applyGuestEvent);
+    // The server dropped events we were too slow for; fetch what changed instead
+    source.addEventListener('resync', loadGuests);
+    // Also fires on every reconnect: catch up on whatever happened while disconnected
+    source.addEventListener('open', () => {
+        if (syncToken !== null) loadGuests();
+    });
+}
+
 // Display guests in table
 function displayGuests() {
     const tbody = document.getElementById('guests-tbody');
@@ -319,13 +394,22 @@ function displayGuests() {
     table.style.display = 'table';
     noGuestsDiv.style.display = 'none';
     
+    const groups = new Map();
     guests.forEach(guest => {
+        if (!groups.has(guest.group_id)) groups.set(guest.group_id, []);
+        groups.get(guest.group_id).push(guest);
+    });
+    setReadyToggle(document.getElementById('ready-all-toggle'), guests);
+    
+    guests.forEach((guest, index) => {
         const row = document.createElement('tr');
         
         // UI logic for ready checkbox
         const isSent = guest.sent_to_whatsapp !== 'pending';
         const readyCheckboxDisabled = isSent || !guest.phone;
         
+        const isFirstOfGroup = index === 0 || guests[index - 1].group_id !== guest.group_id;
+        
         if (!guest.ready && isSent) {
             console.error(`Inconsistency Error: Guest ID ${guest.id} is not marked as ready but has been sent to WhatsApp.`);
         }
@@ -337,7 +421,7 @@ function displayGuests() {
             <td>${guest.last_name}</td>
             <td>${guest.greeting_name || ''}</td>
             <td class="${guest.phone_class || ''}">${formatPhoneForDisplay(guest.phone)}</td>
-            <td>${guest.group_id}</td>
+            <td>${guest.group_id}${isFirstOfGroup ? `<input type="checkbox" class="group-ready-toggle" data-group-id="${guest.group_id}" title="Mark the whole group as ready">` : ''}</td>
             <td>${guest.is_group_primary ? 'Yes' : 'No'}</td>
             <td>
                 <input type="checkbox" 
@@ -346,7 +430,7 @@ function displayGuests() {
                        onchange="updateReady(${guest.id}, this.checked)"
                        title="${!guest.phone ? 'Phone number required to mark as ready' : (isSent ? 'Already sent' : 'Mark as ready for invite')}">
             </td>
-            <td>${guest.sent_to_whatsapp}</td>
+            <td title="${guest.delivery_error || ''}">${guest.sent_to_whatsapp}${guest.delivery_status ? ` (${guest.delivery_status})` : ''}</td>
             <td>${formatDateTime(guest.api_call_at)}</td>
             <td>${formatDateTime(guest.sent_at)}</td>
             <td>${formatDateTime(guest.delivered_at)}</td>
@@ -361,6 +445,48 @@ function displayGuests() {
         `;
         tbody.appendChild(row);
     });
+    
+    tbody.querySelectorAll('.group-ready-toggle').forEach(toggle => {
+        setReadyToggle(toggle, groups.get(toggle.dataset.groupId));
+        toggle.addEventListener('change', () => bulkUpdateReady({ group_ids: [toggle.dataset.groupId] }, toggle.checked));
+    });
+}
+
+// Whether a guest's ready flag can still change (the rule the server applies to bulk updates)
+function canToggleReady(guest) {
+    return guest.sent_to_whatsapp === 'pending' && !!guest.phone;
+}
+
+// Show a bulk toggle as checked when every guest it controls is ready, mixed when some are
+function setReadyToggle(toggle, members) {
+    const toggleable = members.filter(canToggleReady);
+    const readyCount = toggleable.filter(guest => guest.ready).length;
+    toggle.disabled = toggleable.length === 0;
+    toggle.checked = toggleable.length > 0 && readyCount === toggleable.length;
+    toggle.indeterminate = readyCount > 0 && readyCount < toggleable.length;
+}
+
+// Set ready for many guests with one request
+async function bulkUpdateReady(selection, ready) {
+    try {
+        const response = await fetch('/api/guests', {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ...selection, ready, return_rows: true })
+        });
+        
+        if (!response.ok) throw new Error('Failed to update guests');
+        
+        const result = await response.json();
+        mergeGuests(result.guests, []);
+        displayGuests();
+        showMessage(`${result.updated} guest${result.updated === 1 ? '' : 's'} updated`, 'success');
+    } catch (error) {
+        console.error('Error updating guests:', error);
+        showMessage('Failed to update guests', 'error');
+        // Reload to restore correct state
+        loadGuests();
+    }
 }
 
 // Update guest ready status
@@ -380,6 +506,7 @@ async function updateReady(guestId, ready) {
         if (index !== -1) {
             guests[index] = updatedGuest;
         }
+        displayGuests();  // refresh the group and select-all toggles
         
         showMessage('Guest updated successfully', 'success');
     } catch (error) {
@@ -558,9 +685,20 @@ document.addEventListener('DOMContentLoaded', function() {
     const sendInvitesBtn = document.getElementById('send-invites-btn');
     sendInvitesBtn.addEventListener('click', sendInvites);
     
+    // Mark every pending guest ready (or not) at once
+    const readyAllToggle = document.getElementById('ready-all-toggle');
+    readyAllToggle.addEventListener('change', () => {
+        const ready = readyAllToggle.checked;
+        if (!confirm(`Mark every pending guest with a phone as ${ready ? 'ready' : 'not ready'}?`)) {
+            displayGuests();
+            return;
+        }
+        bulkUpdateReady({ filter: {} }, ready);
+    });
+    
     // Initial submit button state
     updateSubmitButtonState();
     
-    // Refresh guests every 30 seconds to see webhook updates
-    setInterval(loadGuests, 30000);
+    // Live webhook and send updates
+    subscribeToGuestEvents();
 });
@@ -0,0 +1,213 @@
+import os
+import gzip
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+import orjson
+from sqlalchemy import Table, delete, func, select
+
+logger = logging.getLogger(__name__)
+
+# Retention of the audit tables; 0 days keeps every row
+AUDIT_RETENTION_DAYS = float(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
+AUDIT_ARCHIVE_MAX_BYTES = int(os.getenv("AUDIT_ARCHIVE_MAX_BYTES", str(64 * 1024 * 1024)))
+AUDIT_RETENTION_INTERVAL = float(os.getenv("AUDIT_RETENTION_INTERVAL", "3600"))
+# Rows archived and deleted per transaction, and the pause between transactions
+AUDIT_RETENTION_BATCH_SIZE = int(os.getenv("AUDIT_RETENTION_BATCH_SIZE", "500"))
+AUDIT_RETENTION_BATCH_PAUSE = float(os.getenv("AUDIT_RETENTION_BATCH_PAUSE", "0.05"))
+
+# JSON-valued columns, written to the archive as JSON rather than as strings
+JSON_COLUMNS = ('payload', 'headers')
+
+
+class ArchiveWriter:
+    """
+    Rolling archive files for one table: {table}-{YYYYMMDD}-{n}.jsonl.gz,
+    starting a new file once the current one reaches max_bytes. Every batch
+    is its own complete gzip member, synced to disk before the caller
+    deletes the rows, so a crash can at worst archive a batch twice.
+    gzip, zcat and Python's gzip module read the members as one file.
+    """
+
+    def __init__(self, directory: Path, table_name: str, max_bytes: int = AUDIT_ARCHIVE_MAX_BYTES):
+        self.directory = directory
+        self.table_name = table_name
+        self.max_bytes = max_bytes
+        self.path: Optional[Path] = None
+
+    def _next_path(self) -> Path:
+        stem = f"{self.table_name}-{datetime.now().strftime('%Y%m%d')}"
+        sequence = 0
+        while True:
+            path = self.directory / f"{stem}-{sequence:03d}.jsonl.gz"
+            if not path.exists() or path.stat().st_size < self.max_bytes:
+                return path
+            sequence += 1
+
+    def append(self, lines: List[bytes]) -> Path:
+        """Write one batch of JSON lines durably; returns the file written"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self._next_path()
+        with open(self.path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+                archive.write(b''.join(line + b'\n' for line in lines))
+            raw.flush()
+            os.fsync(raw.fileno())
+        return self.path
+
+
+def archive_line(row: Dict[str, Any]) -> bytes:
+    record = {}
+    for name, value in row.items():
+        if name in JSON_COLUMNS and isinstance(value, str):
+            try:
+                value = orjson.loads(value)
+            except orjson.JSONDecodeError:
+                pass
+        record[name] = value
+    return orjson.dumps(record)
+
+
+class AuditRetention:
+    """
+    Background job that moves old audit rows (whatsapp_api_calls,
+    webhook_payloads) out of the database.
+
+    Every AUDIT_RETENTION_INTERVAL seconds, rows older than
+    AUDIT_RETENTION_DAYS are copied, oldest first, to rolling compressed
+    archive files in AUDIT_ARCHIVE_DIR and then deleted, AUDIT_RETENTION_BATCH_SIZE
+    rows per transaction with a short pause in between, so the write lock is
+    never held for long and webhook and invite writes get in between batches.
+    Shared header sets (audit_headers) are written out with each row and kept.
+    """
+
+    def __init__(
+        self,
+        days: float = AUDIT_RETENTION_DAYS,
+        archive_dir: str = AUDIT_ARCHIVE_DIR,
+        interval: float = AUDIT_RETENTION_INTERVAL,
+        batch_size: int = AUDIT_RETENTION_BATCH_SIZE,
+        batch_pause: float = AUDIT_RETENTION_BATCH_PAUSE
+    ):
+        self.days = days
+        self.archive_dir = Path(archive_dir)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._task: Optional[asyncio.Task] = None
+        self._writers: Dict[str, ArchiveWriter] = {}
+        self.runs = 0
+        self.archived: Dict[str, int] = {}
+        self.last_run_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.days > 0
+
+    async def start(self):
+        """Start the periodic job (no-op when AUDIT_RETENTION_DAYS is 0)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="audit-retention")
+        logger.info(
+            f"Audit retention started (keep {self.days} days, archive to {self.archive_dir}, "
+            f"every {self.interval}s)"
+        )
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "days": self.days,
+            "runs": self.runs,
+            "archived": dict(self.archived),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_error": self.last_error,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Audit retention run failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Archive and delete every audit row older than the cutoff; returns rows moved per table"""
+        from .db_models import WhatsAppAPICall, WebhookPayload, utcnow
+
+        cutoff = (now or utcnow()) - timedelta(days=self.days)
+        moved = {}
+        for model in (WhatsAppAPICall, WebhookPayload):
+            moved[model.__tablename__] = await self._archive_table(model.__table__, cutoff)
+        self.runs += 1
+        self.last_run_at = utcnow()
+        self.last_error = None
+        if any(moved.values()):
+            logger.info(f"Archived audit rows older than {cutoff}: {moved}")
+        return moved
+
+    async def _archive_table(self, table: Table, cutoff: datetime) -> int:
+        from .db_models import AuditHeaders
+        from .db_operations import get_async_db_session
+
+        writer = self._writers.setdefault(table.name, ArchiveWriter(self.archive_dir, table.name))
+        columns = [column for column in table.columns if column.name not in ('headers', 'headers_id')]
+        query = (
+            select(*columns, func.coalesce(AuditHeaders.headers, table.c.headers).label('headers'))
+            .outerjoin(AuditHeaders, AuditHeaders.id == table.c.headers_id)
+            .where(table.c.timestamp < cutoff)
+            .order_by(table.c.timestamp)
+            .limit(self.batch_size)
+        )
+        moved = 0
+        while True:
+            async with get_async_db_session() as session:
+                rows = (await session.execute(query)).mappings().all()
+            if not rows:
+                return moved
+            await asyncio.to_thread(writer.append, [archive_line(dict(row)) for row in rows])
+            async with get_async_db_session() as session:
+                await session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+            moved += len(rows)
+            self.archived[table.name] = self.archived.get(table.name, 0) + len(rows)
+            await asyncio.sleep(self.batch_pause)
+
+
+audit_retention = AuditRetention()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and delete audit rows older than a cutoff")
+    parser.add_argument("--days", type=float, default=AUDIT_RETENTION_DAYS or None, required=not AUDIT_RETENTION_DAYS,
+                        help="keep rows from the last this many days (default: AUDIT_RETENTION_DAYS)")
+    parser.add_argument("--archive-dir", default=AUDIT_ARCHIVE_DIR)
+    parser.add_argument("--batch-size", type=int, default=AUDIT_RETENTION_BATCH_SIZE, help="rows per transaction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from .db_operations import init_database
+    init_database()
+    retention = AuditRetention(days=args.days, archive_dir=args.archive_dir, batch_size=args.batch_size)
+    moved = asyncio.run(retention.run_once())
+    print(orjson.dumps(moved, option=orjson.OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import Table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration for the audit tables
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "0.5"))
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", "10000"))
+
+# Queued by stop() to let the flusher finish its current batch and exit
+_STOP = object()
+
+
+class AuditWriter:
+    """
+    Buffered writer for whatsapp_api_calls, webhook_payloads and
+    webhook_event_keys rows.
+
+    Records are queued in memory and written by a single background task with
+    one executemany INSERT per table per flush. A flush happens once
+    AUDIT_BATCH_SIZE records are waiting or AUDIT_FLUSH_INTERVAL seconds after
+    the first one arrived. The buffer is bounded: when AUDIT_MAX_BUFFER records
+    are waiting, producers wait for the next flush instead of growing memory.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        max_buffer: int = AUDIT_MAX_BUFFER
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.records_written = 0
+        self.flushes = 0
+        self.failed_records = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Start the background flusher"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_buffer)
+        self._task = asyncio.create_task(self._run(), name="audit-writer")
+        logger.info(
+            f"Audit writer started (batch_size={self.batch_size}, "
+            f"flush_interval={self.flush_interval}s, max_buffer={self.max_buffer})"
+        )
+
+    async def stop(self):
+        """Stop the flusher after writing everything still buffered"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        logger.info(f"Audit writer stopped ({self.records_written} records written in {self.flushes} flushes)")
+
+    async def record(self, table: Table, row: Dict[str, Any]):
+        """Queue one row for `table`; waits only if the buffer is full"""
+        await self._queue.put((table, row))
+
+    def stats(self) -> Dict[str, Any]:
+        """Buffer depth and write counters"""
+        return {
+            "buffered": self._queue.qsize() if self._queue else 0,
+            "records_written": self.records_written,
+            "flushes": self.flushes,
+            "failed_records": self.failed_records,
+        }
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            # Give the batch until the flush interval to fill up
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # Shutdown: write whatever is left
+        batch = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
+        await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Table, Dict[str, Any]]]):
+        """Write a batch with one executemany INSERT per table in a single transaction"""
+        if not batch:
+            return
+        from .db_operations import get_async_db_session
+
+        by_table: Dict[Table, List[Dict[str, Any]]] = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+
+        try:
+            async with get_async_db_session() as session:
+                for table, rows in by_table.items():
+                    # One cached statement run over all rows; building a multi-row VALUES
+                    # statement instead costs more to compile than SQLite takes to run it.
+                    # A row already stored (a webhook event key written twice) is skipped.
+                    await session.execute(sqlite_insert(table).on_conflict_do_nothing(), rows)
+            self.records_written += len(batch)
+            self.flushes += 1
+        except Exception as e:
+            self.failed_records += len(batch)
+            logger.error(f"Failed to write {len(batch)} audit records: {str(e)}", exc_info=True)
+
+
+audit_writer = AuditWriter()
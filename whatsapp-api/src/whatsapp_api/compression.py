@@ -0,0 +1,81 @@
+import zlib
+from typing import Optional, Union
+
+import orjson
+from sqlalchemy.types import Text, TypeDecorator
+
+# Stored values start with a format byte. Values written before compression
+# are plain TEXT and are returned unchanged.
+RAW = b'\x00'           # UTF-8 text that did not get smaller when compressed
+DEFLATE_DICT_V1 = b'\x01'  # raw deflate with AUDIT_ZDICT_V1 as the preset dictionary
+
+# Preset dictionary of the JSON that audit rows repeat (Graph API requests and
+# responses, webhook envelopes and receipts). Audit payloads are a few hundred
+# bytes, too small for plain deflate to find much to share; with this
+# dictionary a delivery receipt shrinks about 7x. Never edit it: rows written
+# with it need the exact bytes to decompress. Add a new format byte instead.
+AUDIT_ZDICT_V1 = ''.join((
+    '{"Content-Type":"application/json","Authorization":"Bearer [REDACTED]"}',
+    '{"error":{"message":"(#', '","type":"OAuthException","code":',
+    '"error_data":{"messaging_product":"whatsapp","details":"', '"fbtrace_id":"',
+    '{"messaging_product":"whatsapp","to":"', '","type":"template","template":{"name":"',
+    '","language":{"code":"en_US"},"components":[{"type":"body","parameters":[{"type":"text","text":"',
+    '","parameter_name":"name"}]}]}}',
+    '{"messaging_product":"whatsapp","contacts":[{"input":"', '","wa_id":"', '"}],"messages":[{"id":"wamid.',
+    '","message_status":"accepted"}]}',
+    '"errors":[{"code":131026,"title":"Message undeliverable"',
+    '"contacts":[{"profile":{"name":"', '"}],"messages":[{"context":{"from":"', '","id":"wamid.', '"from":"',
+    '","timestamp":"', '","type":"button","button":{"payload":"', '","text":"',
+    '"conversation":{"id":"', '","origin":{"type":"utility"}},"pricing":{"billable":true,"pricing_model":"PMP",'
+    '"category":"utility","type":"regular"}}]},"field":"messages"}]}]}',
+    '{"object":"whatsapp_business_account","entry":[{"id":"',
+    '","changes":[{"value":{"messaging_product":"whatsapp","metadata":{"display_phone_number":"',
+    '","phone_number_id":"', '"},"statuses":[{"id":"wamid.', '","status":"delivered","timestamp":"',
+    '","recipient_id":"',
+)).encode()
+
+
+def compact_json(value) -> bytes:
+    """JSON without indentation or spaces, as stored in the audit tables"""
+    return orjson.dumps(value)
+
+
+def compress_text(value: Union[str, bytes]) -> bytes:
+    data = value.encode() if isinstance(value, str) else value
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, AUDIT_ZDICT_V1)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) < len(data):
+        return DEFLATE_DICT_V1 + compressed
+    return RAW + data
+
+
+def decompress_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """Text back from compress_text(); text stored before compression passes through"""
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    if data[:1] == DEFLATE_DICT_V1:
+        decompressor = zlib.decompressobj(-15, AUDIT_ZDICT_V1)
+        return (decompressor.decompress(data[1:]) + decompressor.flush()).decode()
+    if data[:1] == RAW:
+        return data[1:].decode()
+    raise ValueError(f"Unknown compressed text format {data[:1]!r}")
+
+
+class CompressedText(TypeDecorator):
+    """
+    A TEXT column stored compressed (see compress_text). Reads return str,
+    so callers see the same text they wrote, whether str or UTF-8 bytes.
+    The column stays declared as TEXT: SQLite keeps the compressed values as
+    BLOBs next to the plain text of older rows.
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
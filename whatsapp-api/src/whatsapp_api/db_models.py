@@ -1,12 +1,25 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Index, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from datetime import datetime
+from datetime import datetime, timezone
+
+from .phone_countries import calling_code_for
+from .compression import CompressedText
 
 Base = declarative_base()
 
 
+def utcnow() -> datetime:
+    """Naive UTC timestamp, matching what SQLite's CURRENT_TIMESTAMP stores"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def phone_calling_code(context) -> str:
+    """Column default: the calling code of the phone being inserted"""
+    return calling_code_for(context.get_current_parameters().get('phone'))
+
+
 class Guest(Base):
     __tablename__ = 'guests'
     
@@ -16,6 +29,8 @@ class Guest(Base):
     last_name = Column(String, nullable=False)
     greeting_name = Column(String)
     phone = Column(String, unique=True)
+    # Derived from phone on insert (phones are never updated)
+    calling_code = Column(String(3), default=phone_calling_code)
     group_id = Column(String, nullable=False)
     is_group_primary = Column(Boolean, nullable=False)
     ready = Column(Boolean, nullable=False, default=False)
@@ -26,8 +41,12 @@ class Guest(Base):
     read_at = Column(DateTime)
     responded_with_button = Column(DateTime)
     message_id = Column(String)
+    delivery_status = Column(String(20))  # furthest webhook status reached: sent/failed/delivered/read
+    failed_at = Column(DateTime)
+    delivery_error = Column(Text)
     created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Set in Python for microsecond resolution: it is the delta-sync watermark for the guest list
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     
     # Relationships
     api_calls = relationship("WhatsAppAPICall", back_populates="guest")
@@ -37,9 +56,41 @@ class Guest(Base):
     __table_args__ = (
         Index('idx_group_id', 'group_id'),
         Index('idx_message_id', 'message_id'),
+        # Full list order, and the per-group primary checks as a covering index
+        Index('idx_guest_group_primary', group_id, is_group_primary.desc()),
+        # Partial indexes: only the guests "Send Invites" would queue, and only sent invites by send time
+        Index(
+            'idx_guest_ready_to_send', ready, sent_to_whatsapp,
+            sqlite_where=and_(ready == True, sent_to_whatsapp == 'pending', phone.isnot(None))
+        ),
+        Index('idx_guest_recent_sends', api_call_at, sqlite_where=message_id.isnot(None)),
+        # Filter + keyset order for the paginated guest list; SQLite appends id to every index
+        Index('idx_guest_ready_group', 'ready', 'group_id'),
+        Index('idx_guest_sent_group', 'sent_to_whatsapp', 'group_id'),
+        Index('idx_guest_delivery_group', 'delivery_status', 'group_id'),
+        Index('idx_guest_updated_at', 'updated_at'),
+        Index('idx_guest_calling_code_group', 'calling_code', 'group_id'),
     )
 
 
+class GuestTombstone(Base):
+    """One row per deleted guest, written by a trigger, so delta syncs can report deletions"""
+    __tablename__ = 'guest_tombstones'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    guest_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=func.now())
+
+
+class AuditHeaders(Base):
+    """One row per distinct header set; audit rows point at it instead of repeating it"""
+    __tablename__ = 'audit_headers'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    digest = Column(String(32), nullable=False, unique=True)
+    headers = Column(CompressedText, nullable=False)
+
+
 class WhatsAppAPICall(Base):
     __tablename__ = 'whatsapp_api_calls'
     
@@ -49,8 +100,9 @@ class WhatsAppAPICall(Base):
     direction = Column(String(10))  # 'request' or 'response'
     method = Column(String(10))
     url = Column(Text)
-    headers = Column(Text)
-    payload = Column(Text)
+    headers = Column(CompressedText)  # only on rows written before headers_id
+    headers_id = Column(Integer, ForeignKey('audit_headers.id'))
+    payload = Column(CompressedText)
     status_code = Column(Integer)
     response_time_ms = Column(Integer)
     error_message = Column(Text)
@@ -72,8 +124,9 @@ class WebhookPayload(Base):
     timestamp = Column(DateTime, default=func.now())
     guest_id = Column(Integer, ForeignKey('guests.id'))
     event_type = Column(String(50))
-    payload = Column(Text)
-    headers = Column(Text)
+    payload = Column(CompressedText)
+    headers = Column(CompressedText)  # only on rows written before headers_id
+    headers_id = Column(Integer, ForeignKey('audit_headers.id'))
     processed = Column(Boolean, default=False)
     is_multiple = Column(Boolean, default=False)
     
@@ -85,4 +138,43 @@ class WebhookPayload(Base):
         Index('idx_webhooks_timestamp', 'timestamp'),
         Index('idx_webhooks_event_type', 'event_type'),
         Index('idx_webhooks_guest_id', 'guest_id'),
-    )
\ No newline at end of file
+    )
+
+
+class WebhookEventKey(Base):
+    """Key of every webhook event processed, so a redelivered event is recognised (see webhook_dedupe.py)"""
+    __tablename__ = 'webhook_event_keys'
+    
+    event_key = Column(String, primary_key=True)
+    received_at = Column(DateTime, nullable=False, default=utcnow)
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_webhook_event_keys_received_at', 'received_at'),
+    )
+
+
+class OutboxJob(Base):
+    __tablename__ = 'invite_outbox'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    guest_id = Column(Integer, ForeignKey('guests.id'), nullable=False, unique=True)
+    state = Column(String(20), nullable=False, default='pending')  # pending/claimed/in_flight/succeeded/failed
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False)
+    claimed_by = Column(String(64))
+    lease_expires_at = Column(DateTime)
+    message_id = Column(String)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    # Relationships
+    guest = relationship("Guest")
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_outbox_claim', 'state', 'available_at'),
+        Index('idx_outbox_lease', 'state', 'lease_expires_at'),
+        Index('idx_outbox_claimed_by', 'claimed_by'),
+    )
@@ -1,25 +1,48 @@
-from sqlalchemy import create_engine, func
-from datetime import datetime
+from sqlalchemy import create_engine, func, insert, update, delete, inspect, text, case, and_, or_, tuple_, bindparam, DateTime, literal as literal_value
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Set
 from pathlib import Path
+import os
+import time
+import json
+import base64
+import hashlib
+import binascii
 import asyncio
+import logging
+from collections import OrderedDict
 from contextlib import asynccontextmanager, contextmanager
 
-from .db_models import Base, Guest, WhatsAppAPICall, WebhookPayload
-from .models import GuestCreate, GuestUpdate, GuestResponse
+from .db_models import (
+    Base, Guest, GuestTombstone, AuditHeaders, WhatsAppAPICall, WebhookPayload, WebhookEventKey, OutboxJob, utcnow
+)
+from .models import GuestCreate, GuestUpdate, GuestBulkUpdate, GuestResponse
+from .webhook_events import StatusEvent, ParsedWebhook, GuestMatches
+from .guest_index import guest_index, normalize_phone
+from .phone_countries import calling_code_for, regions_for
+from .storage import SQLITE_STORAGE_PROFILE, storage_pragmas, apply_storage_profile, describe_storage, db_lock_errors
+from .metrics import db_session_seconds, db_commit_seconds
+
+logger = logging.getLogger(__name__)
 
 # Database configuration
-DB_PATH = Path("wedding.db")
+DB_PATH = Path(os.getenv("WEDDING_DB_PATH", "wedding.db"))
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
 
-# Create engines
+# Create engines; both get the same SQLite pragmas (see storage.py)
 engine = create_engine(DATABASE_URL, echo=False)
 async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+STORAGE_PRAGMAS = storage_pragmas()
+apply_storage_profile(engine, STORAGE_PRAGMAS)
+apply_storage_profile(async_engine.sync_engine, STORAGE_PRAGMAS)
+db_lock_errors.watch(engine)
+db_lock_errors.watch(async_engine.sync_engine)
 
 # Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -28,35 +51,98 @@ AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, expire_on_co
 
 def init_database():
     """Initialize database tables"""
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+    with engine.connect() as conn:
+        logger.info(f"Database {DB_PATH} ({SQLITE_STORAGE_PROFILE} profile): {describe_storage(conn)}")
+
+
+# Records deleted guests for delta syncs, whichever code path deletes them
+GUEST_TOMBSTONE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS trg_guest_tombstone AFTER DELETE ON guests
+BEGIN
+    INSERT INTO guest_tombstones (guest_id, deleted_at) VALUES (OLD.id, CURRENT_TIMESTAMP);
+END
+"""
+
+
+def upgrade_schema():
+    """
+    Bring an existing database up to the current models.
+    
+    create_all() only creates missing tables, so columns and indexes added to
+    existing tables are created here. Only additive changes are handled.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        conn.execute(text(GUEST_TOMBSTONE_TRIGGER))
+        backfill_calling_codes(conn)
+
+
+def backfill_calling_codes(conn):
+    """Derive calling_code for guests stored before the column existed"""
+    rows = conn.execute(
+        select(Guest.id, Guest.phone).where(Guest.calling_code.is_(None), Guest.phone.is_not(None))
+    ).all()
+    updates = [
+        {'b_id': guest_id, 'b_calling_code': code}
+        for guest_id, phone in rows
+        if (code := calling_code_for(phone)) is not None
+    ]
+    if updates:
+        conn.execute(
+            update(Guest.__table__)
+            .where(Guest.__table__.c.id == bindparam('b_id'))
+            .values(calling_code=bindparam('b_calling_code')),
+            updates
+        )
+        logger.info(f"Stored the calling code of {len(updates)} existing guests")
 
 
 @contextmanager
 def get_db_session():
     """Get synchronous database session"""
+    started = time.perf_counter()
     session = SessionLocal()
     try:
         yield session
+        committing = time.perf_counter()
         session.commit()
+        db_commit_seconds.observe(time.perf_counter() - committing, 'sync')
     except Exception:
         session.rollback()
         raise
     finally:
         session.close()
+        db_session_seconds.observe(time.perf_counter() - started, 'sync')
 
 
 @asynccontextmanager
 async def get_async_db_session():
     """Get asynchronous database session"""
+    started = time.perf_counter()
     session = AsyncSessionLocal()
     try:
         yield session
+        committing = time.perf_counter()
         await session.commit()
+        db_commit_seconds.observe(time.perf_counter() - committing, 'async')
     except Exception:
         await session.rollback()
         raise
     finally:
         await session.close()
+        db_session_seconds.observe(time.perf_counter() - started, 'async')
 
 
 # Country code to CSS class mapping
@@ -68,83 +154,358 @@ COUNTRY_CODE_COLORS = {
 }
 
 
-def get_phone_class(phone: Optional[str]) -> str:
-    """Get CSS class based on phone country code"""
-    if not phone or not phone.startswith('+'):
-        return 'cc-other'
+def get_phone_class(calling_code: Optional[str]) -> str:
+    """Get CSS class for a guest's stored calling code"""
+    return COUNTRY_CODE_COLORS.get(calling_code, 'cc-other')
+
+
+def _earliest(column, param_name: str):
+    """SET expression keeping the earlier of the stored and the incoming timestamp"""
+    incoming = bindparam(param_name, type_=DateTime)
+    return case(
+        (and_(incoming.isnot(None), or_(column.is_(None), column > incoming)), incoming),
+        else_=column
+    )
+
+
+# Webhook status precedence; a guest's delivery_status only ever moves up this order
+STATUS_PRECEDENCE = {'sent': 1, 'failed': 2, 'delivered': 3, 'read': 4}
+STATUS_TIMESTAMP_FIELDS = {'sent': 'sent_at', 'delivered': 'delivered_at', 'read': 'read_at', 'failed': 'failed_at'}
+
+_guests = Guest.__table__
+_stored_rank = case(
+    *[(_guests.c.delivery_status == status, rank) for status, rank in STATUS_PRECEDENCE.items()],
+    else_=0
+)
+STATUS_UPDATE_STATEMENT = (
+    update(_guests)
+    .where(_guests.c.id == bindparam('b_guest_id'))
+    .values(
+        sent_at=_earliest(_guests.c.sent_at, 'b_sent_at'),
+        delivered_at=_earliest(_guests.c.delivered_at, 'b_delivered_at'),
+        read_at=_earliest(_guests.c.read_at, 'b_read_at'),
+        failed_at=_earliest(_guests.c.failed_at, 'b_failed_at'),
+        delivery_status=case(
+            (bindparam('b_rank') > _stored_rank, bindparam('b_status')),
+            else_=_guests.c.delivery_status
+        ),
+        delivery_error=func.coalesce(bindparam('b_error'), _guests.c.delivery_error)
+    )
+)
+BUTTON_RESPONSE_UPDATE_STATEMENT = (
+    update(_guests)
+    .where(_guests.c.id == bindparam('b_guest_id'))
+    .values(responded_with_button=_earliest(_guests.c.responded_with_button, 'b_responded_at'))
+)
+
+
+# Rows per chunk when loading the full guest list; the event loop gets a turn between chunks
+GUEST_LIST_PARTITION_SIZE = int(os.getenv("GUEST_LIST_PARTITION_SIZE", "500"))
+
+
+# Fields a guest can be returned with (?fields= narrows the list to some of them)
+GUEST_COLUMNS = {column.name: column for column in Guest.__table__.columns}
+GUEST_FIELDS = list(GUEST_COLUMNS) + ['phone_class']
+
+
+class GuestShape:
+    """
+    How guests are read and turned into API dicts for one set of fields.
     
-    # Extract country code (1-3 digits after +)
-    for length in [3, 2, 1]:
-        if len(phone) > length:
-            prefix = phone[1:length+1]
-            if prefix in COUNTRY_CODE_COLORS:
-                return COUNTRY_CODE_COLORS[prefix]
+    Every guest read selects columns() with Core and passes the row tuples
+    to serialize(), so the API representation is defined in one place and no
+    ORM objects are built. The columns are the returned fields in response
+    order, then any column only needed internally (group_id for cursors,
+    calling_code for phone_class).
+    """
     
-    return 'cc-other'
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        fields = list(fields or GUEST_FIELDS)
+        unknown = [field for field in fields if field not in GUEST_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        self.fields = fields
+        self.names = list(dict.fromkeys(['id'] + [field for field in fields if field in GUEST_COLUMNS]))
+        selected = self.names + [name for name in ('group_id', 'calling_code') if name not in self.names]
+        self.column_names = selected
+        self.calling_code_position = selected.index('calling_code') if 'phone_class' in fields else None
+    
+    def columns(self) -> list:
+        return [GUEST_COLUMNS[name] for name in self.column_names]
+    
+    def serialize(self, rows: Iterable) -> List[Dict[str, Any]]:
+        """API dicts for rows selected with columns()"""
+        names = self.names
+        if self.calling_code_position is None:
+            return [dict(zip(names, row)) for row in rows]
+        calling_code_position = self.calling_code_position
+        guests = []
+        for row in rows:
+            guest = dict(zip(names, row))
+            guest['phone_class'] = get_phone_class(row[calling_code_position])
+            guests.append(guest)
+        return guests
+
+
+FULL_GUEST = GuestShape()
+
+
+# Page sizes for GET /api/guests
+GUEST_PAGE_SIZE = int(os.getenv("GUEST_PAGE_SIZE", "500"))
+GUEST_PAGE_SIZE_MAX = int(os.getenv("GUEST_PAGE_SIZE_MAX", "5000"))
+
+# Delta syncs re-send changes this close to the watermark, in case a transaction
+# that stamped its rows earlier committed after the watermark was taken
+GUEST_SYNC_OVERLAP_SECONDS = float(os.getenv("GUEST_SYNC_OVERLAP_SECONDS", "2"))
+
+
+def _encode_token(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_token(token: str) -> list:
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    values = json.loads(raw)
+    if not isinstance(values, list):
+        raise ValueError
+    return values
+
+
+def encode_guest_cursor(group_id: str, guest_id: int) -> str:
+    """Opaque keyset cursor pointing just after (group_id, guest_id)"""
+    return _encode_token([group_id, guest_id])
+
+
+def decode_guest_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        group_id, guest_id = _decode_token(cursor)
+        if not isinstance(group_id, str) or not isinstance(guest_id, int):
+            raise ValueError
+        return group_id, guest_id
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+
+
+def encode_sync_token(version: tuple[Optional[datetime], int]) -> str:
+    """Opaque delta-sync watermark: (latest guest updated_at, latest tombstone id)"""
+    updated_at, tombstone_id = version
+    return _encode_token([updated_at.isoformat() if updated_at else None, tombstone_id])
+
+
+def decode_sync_token(token: str) -> tuple[Optional[datetime], int]:
+    try:
+        updated_at, tombstone_id = _decode_token(token)
+        if not isinstance(tombstone_id, int):
+            raise ValueError
+        return (datetime.fromisoformat(updated_at) if updated_at else None, tombstone_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid since token")
+
+
+def guest_filter_conditions(
+    group_id: Optional[str] = None,
+    ready: Optional[bool] = None,
+    sent_to_whatsapp: Optional[str] = None,
+    delivery_status: Optional[str] = None,
+    calling_code: Optional[str] = None
+) -> list:
+    """WHERE conditions for the guest list filters; delivery_status='none' matches no receipt yet"""
+    conditions = []
+    if group_id is not None:
+        conditions.append(Guest.group_id == group_id)
+    if ready is not None:
+        conditions.append(Guest.ready == ready)
+    if sent_to_whatsapp is not None:
+        conditions.append(Guest.sent_to_whatsapp == sent_to_whatsapp)
+    if delivery_status is not None:
+        conditions.append(
+            Guest.delivery_status.is_(None) if delivery_status == 'none'
+            else Guest.delivery_status == delivery_status
+        )
+    if calling_code is not None:
+        if not calling_code.isdigit():
+            raise ValueError("calling_code must contain digits only")
+        conditions.append(Guest.calling_code == calling_code)
+    return conditions
+
+
+def group_rule_error(group_exists: bool, group_has_primary: bool, is_primary: bool) -> Optional[str]:
+    """Why a guest cannot join a group in its current state, or None if it can"""
+    if not group_exists:
+        # New group must start with primary
+        if not is_primary:
+            return "First member of a group must be the primary contact"
+    elif is_primary and group_has_primary:
+        return "Group already has a primary contact"
+    # Non-primary is always allowed for existing groups
+    return None
 
 
 class GuestOperations:
     """Database operations for guests"""
     
     @staticmethod
-    def get_all_guests() -> List[Dict[str, Any]]:
-        """Get all guests from database"""
-        with get_db_session() as session:
-            guests = session.query(Guest).order_by(Guest.group_id, Guest.is_group_primary.desc()).all()
-            
-            result = []
-            for guest in guests:
-                guest_dict = {
-                    'id': guest.id,
-                    'prefix': guest.prefix,
-                    'first_name': guest.first_name,
-                    'last_name': guest.last_name,
-                    'greeting_name': guest.greeting_name,
-                    'phone': guest.phone,
-                    'group_id': guest.group_id,
-                    'is_group_primary': guest.is_group_primary,
-                    'ready': guest.ready,
-                    'sent_to_whatsapp': guest.sent_to_whatsapp,
-                    'api_call_at': guest.api_call_at,
-                    'sent_at': guest.sent_at,
-                    'delivered_at': guest.delivered_at,
-                    'read_at': guest.read_at,
-                    'responded_with_button': guest.responded_with_button,
-                    'message_id': guest.message_id,
-                    'created_at': guest.created_at,
-                    'updated_at': guest.updated_at,
-                    'phone_class': get_phone_class(guest.phone)
+    async def list_guests_page(
+        limit: int = GUEST_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        group_id: Optional[str] = None,
+        ready: Optional[bool] = None,
+        sent_to_whatsapp: Optional[str] = None,
+        delivery_status: Optional[str] = None,
+        calling_code: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        since: Optional[str] = None,
+        version: Optional[tuple] = None
+    ) -> Dict[str, Any]:
+        """
+        One page of guests in (group_id, id) order.
+        
+        `cursor` is the next_cursor of the previous page. Each filter has an
+        index ending in group_id (and implicitly id), so a page costs the same
+        however many guests there are. delivery_status='none' matches guests
+        without any delivery receipt. Raises ValueError for bad arguments.
+        
+        `since` is the sync_token of an earlier response: only guests changed
+        after it are returned, and the first page also lists the ids of guests
+        deleted since then. `version` is get_guest_list_version() if the
+        caller already has it.
+        Returns {'guests': [...], 'next_cursor': str or None, 'sync_token': str}
+        plus 'deleted': [ids] for delta requests.
+        """
+        limit = max(1, min(limit, GUEST_PAGE_SIZE_MAX))
+        shape = GuestShape(fields) if fields else FULL_GUEST
+        
+        query = select(*shape.columns()).order_by(Guest.group_id, Guest.id).limit(limit + 1)
+        if cursor:
+            after_group_id, after_id = decode_guest_cursor(cursor)
+            query = query.where(tuple_(Guest.group_id, Guest.id) > tuple_(after_group_id, after_id))
+        query = query.where(*guest_filter_conditions(group_id, ready, sent_to_whatsapp, delivery_status, calling_code))
+        deleted = None
+        if since:
+            watermark, tombstone_id = decode_sync_token(since)
+            if watermark is not None:
+                # unlikely(): few guests change between syncs, so search idx_guest_updated_at
+                # and sort the changes rather than walk every group in order
+                query = query.where(
+                    func.unlikely(Guest.updated_at >= watermark - timedelta(seconds=GUEST_SYNC_OVERLAP_SECONDS))
+                )
+        
+        async with get_async_db_session() as session:
+            if version is None:
+                version = await GuestOperations.get_guest_list_version(session)
+            rows = (await session.execute(query)).all()
+            if since and not cursor:
+                result = await session.execute(
+                    select(GuestTombstone.guest_id)
+                    .where(GuestTombstone.id > tombstone_id)
+                    .order_by(GuestTombstone.id)
+                )
+                deleted = list(dict.fromkeys(result.scalars()))
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_guest_cursor(rows[-1].group_id, rows[-1].id)
+        
+        page = {'guests': shape.serialize(rows), 'next_cursor': next_cursor, 'sync_token': encode_sync_token(version)}
+        if deleted is not None:
+            page['deleted'] = deleted
+        return page
+    
+    @staticmethod
+    async def get_guest_status_rows(guest_ids: List[int], fields: Iterable[str]) -> List[Dict[str, Any]]:
+        """Selected columns of the given guests, as dicts"""
+        shape = GuestShape(fields)
+        async with get_async_db_session() as session:
+            result = await session.execute(select(*shape.columns()).where(Guest.id.in_(guest_ids)))
+            return shape.serialize(result)
+    
+    @staticmethod
+    async def count_guests_by_country() -> List[Dict[str, Any]]:
+        """Guest, ready and sent counts per calling code, largest first; None collects unknown phones"""
+        query = (
+            select(
+                Guest.calling_code,
+                func.count(Guest.id).label('guests'),
+                func.sum(case((Guest.ready, 1), else_=0)).label('ready'),
+                func.sum(case((Guest.sent_to_whatsapp != 'pending', 1), else_=0)).label('sent'),
+            )
+            .group_by(Guest.calling_code)
+            .order_by(func.count(Guest.id).desc(), Guest.calling_code)
+        )
+        async with get_async_db_session() as session:
+            result = await session.execute(query)
+            return [
+                {
+                    'calling_code': row.calling_code,
+                    'regions': list(regions_for(row.calling_code)),
+                    'phone_class': get_phone_class(row.calling_code),
+                    'guests': row.guests,
+                    'ready': row.ready,
+                    'sent': row.sent,
                 }
-                result.append(guest_dict)
-            
-            return result
+                for row in result
+            ]
     
     @staticmethod
-    def validate_group_rules(group_id: str, is_primary: bool, session: Session) -> Optional[str]:
-        """Validate group rules for adding a guest"""
-        # Check if group exists
-        existing_guests = session.query(Guest).filter(Guest.group_id == group_id).all()
-        
-        if not existing_guests:
-            # New group must start with primary
-            if not is_primary:
-                return "First member of a group must be the primary contact"
-        else:
-            # Existing group
-            if is_primary:
-                primary_count = sum(1 for guest in existing_guests if guest.is_group_primary)
-                if primary_count > 0:
-                    return "Group already has a primary contact"
-            # Non-primary is always allowed for existing groups
+    async def get_guest_list_version(session: Optional[AsyncSession] = None) -> tuple[Optional[datetime], int]:
+        """
+        (latest updated_at, latest tombstone id): changes whenever any guest is
+        added, changed or deleted. Both are index lookups.
+        """
+        query = select(
+            select(func.max(Guest.updated_at)).scalar_subquery(),
+            select(func.coalesce(func.max(GuestTombstone.id), 0)).scalar_subquery()
+        )
+        if session is not None:
+            return tuple((await session.execute(query)).one())
+        async with get_async_db_session() as session:
+            return tuple((await session.execute(query)).one())
+    
+    
+    @staticmethod
+    async def get_all_guests() -> List[Dict[str, Any]]:
+        """
+        Get all guests from database
         
-        return None
+        Rows are streamed in GUEST_LIST_PARTITION_SIZE chunks so building a
+        large list never holds the event loop for more than one chunk.
+        """
+        result = []
+        async with get_async_db_session() as session:
+            stream = await session.stream(
+                select(*FULL_GUEST.columns()).order_by(Guest.group_id, Guest.is_group_primary.desc())
+            )
+            async for partition in stream.partitions(GUEST_LIST_PARTITION_SIZE):
+                result.extend(FULL_GUEST.serialize(partition))
+                await asyncio.sleep(0)
+        return result
+    
+    @staticmethod
+    async def get_guest(guest_id: int) -> Optional[Dict[str, Any]]:
+        """Get a single guest by id"""
+        async with get_async_db_session() as session:
+            result = await session.execute(select(*FULL_GUEST.columns()).where(Guest.id == guest_id))
+            rows = FULL_GUEST.serialize(result)
+            return rows[0] if rows else None
+    
+    @staticmethod
+    async def validate_group_rules(group_id: str, is_primary: bool, session: AsyncSession) -> Optional[str]:
+        """Validate group rules for adding a guest"""
+        result = await session.execute(
+            select(func.count(Guest.id), func.sum(case((Guest.is_group_primary, 1), else_=0)))
+            .where(Guest.group_id == group_id)
+        )
+        member_count, primary_count = result.one()
+        return group_rule_error(member_count > 0, bool(primary_count), is_primary)
     
     @staticmethod
-    def create_guest(guest_data: GuestCreate) -> Dict[str, Any]:
+    async def create_guest(guest_data: GuestCreate) -> Dict[str, Any]:
         """Create a new guest"""
-        with get_db_session() as session:
+        async with get_async_db_session() as session:
             # Validate group rules
-            error = GuestOperations.validate_group_rules(
+            error = await GuestOperations.validate_group_rules(
                 guest_data.group_id, 
                 guest_data.is_group_primary, 
                 session
@@ -152,46 +513,11 @@ class GuestOperations:
             if error:
                 raise ValueError(error)
             
-            # Create guest
-            guest = Guest(
-                prefix=guest_data.prefix,
-                first_name=guest_data.first_name,
-                last_name=guest_data.last_name,
-                greeting_name=guest_data.greeting_name,
-                phone=guest_data.phone,
-                group_id=guest_data.group_id,
-                is_group_primary=guest_data.is_group_primary,
-                ready=guest_data.ready
-            )
-            
             try:
-                session.add(guest)
-                session.flush()  # Get the ID
-                
-                # Return guest data
-                guest_dict = {
-                    'id': guest.id,
-                    'prefix': guest.prefix,
-                    'first_name': guest.first_name,
-                    'last_name': guest.last_name,
-                    'greeting_name': guest.greeting_name,
-                    'phone': guest.phone,
-                    'group_id': guest.group_id,
-                    'is_group_primary': guest.is_group_primary,
-                    'ready': guest.ready,
-                    'sent_to_whatsapp': guest.sent_to_whatsapp,
-                    'api_call_at': guest.api_call_at,
-                    'sent_at': guest.sent_at,
-                    'delivered_at': guest.delivered_at,
-                    'read_at': guest.read_at,
-                    'responded_with_button': guest.responded_with_button,
-                    'message_id': guest.message_id,
-                    'created_at': guest.created_at,
-                    'updated_at': guest.updated_at,
-                    'phone_class': get_phone_class(guest.phone)
-                }
-                
-                return guest_dict
+                result = await session.execute(
+                    insert(Guest).values(**guest_data.model_dump()).returning(*FULL_GUEST.columns())
+                )
+                return FULL_GUEST.serialize(result)[0]
                 
             except IntegrityError as e:
                 if "UNIQUE constraint failed: guests.phone" in str(e):
@@ -199,150 +525,312 @@ class GuestOperations:
                 raise
     
     @staticmethod
-    def update_guest(guest_id: int, update_data: GuestUpdate) -> Optional[Dict[str, Any]]:
-        """Update a guest"""
-        with get_db_session() as session:
-            guest = session.query(Guest).filter(Guest.id == guest_id).first()
-            if not guest:
-                return None
+    async def import_guest_batch(rows: List[Tuple[int, GuestCreate]]) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Validate and insert one batch of imported guests in a single transaction.
+        
+        `rows` are (line number, guest) in file order. Phone uniqueness and the
+        group rules are checked with one query each for the whole batch, then
+        applied row by row as if the guests were created one at a time.
+        Returns (guests created, [{"line": ..., "error": ...}] for rejected rows).
+        """
+        async with get_async_db_session() as session:
+            phones = {guest.phone for _, guest in rows if guest.phone}
+            taken_phones = set()
+            if phones:
+                result = await session.execute(select(Guest.phone).where(Guest.phone.in_(phones)))
+                taken_phones = set(result.scalars().all())
             
-            # Only ready field can be updated (as per design document)
-            if update_data.ready is not None:
-                guest.ready = update_data.ready
+            # group_id -> whether it has a primary, for groups that already exist
+            result = await session.execute(
+                select(Guest.group_id, func.sum(case((Guest.is_group_primary, 1), else_=0)))
+                .where(Guest.group_id.in_({guest.group_id for _, guest in rows}))
+                .group_by(Guest.group_id)
+            )
+            groups = {group_id: bool(primary_count) for group_id, primary_count in result.all()}
             
-            session.flush()
+            accepted = []
+            errors = []
+            batch_phones = set()
+            for line, guest in rows:
+                if guest.phone in taken_phones:
+                    error = "Phone number already exists for another guest"
+                elif guest.phone in batch_phones:
+                    error = "Phone number appears earlier in the import"
+                else:
+                    error = group_rule_error(
+                        guest.group_id in groups, groups.get(guest.group_id, False), guest.is_group_primary
+                    )
+                if error:
+                    errors.append({"line": line, "error": error})
+                    continue
+                if guest.phone:
+                    batch_phones.add(guest.phone)
+                groups[guest.group_id] = groups.get(guest.group_id, False) or guest.is_group_primary
+                accepted.append(guest.model_dump())
             
-            # Return updated guest
-            guest_dict = {
-                'id': guest.id,
-                'prefix': guest.prefix,
-                'first_name': guest.first_name,
-                'last_name': guest.last_name,
-                'greeting_name': guest.greeting_name,
-                'phone': guest.phone,
-                'group_id': guest.group_id,
-                'is_group_primary': guest.is_group_primary,
-                'ready': guest.ready,
-                'sent_to_whatsapp': guest.sent_to_whatsapp,
-                'api_call_at': guest.api_call_at,
-                'sent_at': guest.sent_at,
-                'delivered_at': guest.delivered_at,
-                'read_at': guest.read_at,
-                'responded_with_button': guest.responded_with_button,
-                'message_id': guest.message_id,
-                'created_at': guest.created_at,
-                'updated_at': guest.updated_at,
-                'phone_class': get_phone_class(guest.phone)
-            }
+            if accepted:
+                await session.execute(insert(Guest), accepted)
+            return len(accepted), errors
+    
+    @staticmethod
+    async def update_guest(guest_id: int, update_data: GuestUpdate) -> Optional[Dict[str, Any]]:
+        """Update a guest"""
+        async with get_async_db_session() as session:
+            # Only ready field can be updated (as per design document)
+            if update_data.ready is not None:
+                result = await session.execute(
+                    update(Guest)
+                    .where(Guest.id == guest_id, Guest.ready != update_data.ready)
+                    .values(ready=update_data.ready)
+                    .returning(*FULL_GUEST.columns()),
+                    execution_options={"synchronize_session": False}
+                )
+                rows = FULL_GUEST.serialize(result)
+                if rows:
+                    guest_index.invalidate_guest(guest_id)
+                    return rows[0]
             
-            return guest_dict
+            # Nothing to change: return the guest as it is, if it exists
+            result = await session.execute(select(*FULL_GUEST.columns()).where(Guest.id == guest_id))
+            rows = FULL_GUEST.serialize(result)
+            return rows[0] if rows else None
     
     @staticmethod
-    async def get_guest_by_phone(phone: str) -> Optional[Guest]:
-        """Get guest by phone number (async)"""
+    async def bulk_update_ready(bulk_update: GuestBulkUpdate) -> Dict[str, Any]:
+        """
+        Set `ready` for every guest the selection matches, in one UPDATE.
+        
+        Only guests still pending an invite are changed, and only guests with
+        a phone can be marked ready, as in the UI. Rows already in the wanted
+        state are left alone so their updated_at does not move.
+        Returns {'updated': count, 'guest_ids': [...]} plus 'guests' with the
+        changed rows when bulk_update.return_rows is set.
+        """
+        conditions = [Guest.sent_to_whatsapp == 'pending', Guest.ready != bulk_update.ready]
+        if bulk_update.ready:
+            conditions.append(and_(Guest.phone.is_not(None), Guest.phone != ''))
+        if bulk_update.ids is not None:
+            conditions.append(Guest.id.in_(bulk_update.ids))
+        if bulk_update.group_ids is not None:
+            conditions.append(Guest.group_id.in_(bulk_update.group_ids))
+        if bulk_update.filter is not None:
+            conditions.extend(guest_filter_conditions(**bulk_update.filter.model_dump()))
+        
+        statement = update(Guest).where(*conditions).values(ready=bulk_update.ready, updated_at=utcnow())
+        options = {"synchronize_session": False}
+        guests = None
         async with get_async_db_session() as session:
-            result = await session.execute(
-                select(Guest).where(Guest.phone == phone)
-            )
-            return result.scalar_one_or_none()
+            if bulk_update.return_rows:
+                result = await session.execute(statement.returning(*FULL_GUEST.columns()), execution_options=options)
+                guests = sorted(FULL_GUEST.serialize(result), key=lambda guest: (guest['group_id'], guest['id']))
+                guest_ids = [guest['id'] for guest in guests]
+            else:
+                result = await session.execute(statement.returning(Guest.id), execution_options=options)
+                guest_ids = sorted(result.scalars().all())
+        
+        for guest_id in guest_ids:
+            guest_index.invalidate_guest(guest_id)
+        response = {'updated': len(guest_ids), 'guest_ids': guest_ids}
+        if guests is not None:
+            response['guests'] = guests
+        return response
     
     @staticmethod
-    async def get_guest_by_message_id(message_id: str) -> Optional[Guest]:
-        """Get guest by message ID (async)"""
+    async def get_ready_guests_for_whatsapp() -> List[Dict[str, Any]]:
+        """Get all ready guests who haven't been sent invites"""
         async with get_async_db_session() as session:
             result = await session.execute(
-                select(Guest).where(Guest.message_id == message_id)
+                select(
+                    Guest.id, Guest.prefix, Guest.first_name, Guest.last_name,
+                    Guest.greeting_name, Guest.phone
+                ).where(
+                    Guest.ready == True,
+                    Guest.sent_to_whatsapp == 'pending',
+                    Guest.phone.isnot(None)
+                )
             )
-            return result.scalar_one_or_none()
+            return [dict(row._mapping) for row in result]
     
     @staticmethod
-    def get_ready_guests_for_whatsapp():
-        """Get all ready guests who haven't been sent invites"""
-        with get_db_session() as session:
-            guests = session.query(Guest).filter(
-                Guest.ready == True,
-                Guest.sent_to_whatsapp == 'pending',
-                Guest.phone.isnot(None)
-            ).all()
-            
-            result = []
-            for guest in guests:
-                guest_dict = {
-                    'id': guest.id,
-                    'prefix': guest.prefix,
-                    'first_name': guest.first_name,
-                    'last_name': guest.last_name,
-                    'greeting_name': guest.greeting_name,
-                    'phone': guest.phone
-                }
-                result.append(guest_dict)
-            
-            return result
+    async def resolve_webhook_guests(message_ids: Iterable[str], phones: Iterable[str]) -> GuestMatches:
+        """
+        Find every guest a webhook payload refers to.
+        
+        Keys are answered from the in-memory guest index first; whatever it
+        misses is fetched with a single query and added to the index.
+        """
+        matches, message_ids, phones = guest_index.lookup(message_ids, phones)
+        if not message_ids and not phones:
+            return matches
+        
+        # Stored phones may or may not carry the '+' that WhatsApp leaves off
+        phones_by_normalized = {normalize_phone(phone): phone for phone in phones}
+        stored_phones = set(phones) | {f"+{digits}" for digits in phones_by_normalized if digits}
+        conditions = []
+        if message_ids:
+            conditions.append(Guest.message_id.in_(message_ids))
+        if phones:
+            conditions.append(Guest.phone.in_(stored_phones))
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                select(Guest.id, Guest.message_id, Guest.phone).where(or_(*conditions))
+            )
+            for guest_id, message_id, phone in result:
+                if message_id in message_ids:
+                    matches.by_message_id[message_id] = guest_id
+                    guest_index.put_message_id(message_id, guest_id)
+                payload_phone = phones_by_normalized.get(normalize_phone(phone))
+                if payload_phone is not None:
+                    matches.by_phone[payload_phone] = guest_id
+                    guest_index.put_phone(phone, guest_id)
+        return matches
     
     @staticmethod
-    def update_guest_api_call_time(guest_id: int):
-        """Update api_call_at timestamp for a guest"""
-        with get_db_session() as session:
-            guest = session.query(Guest).filter(Guest.id == guest_id).first()
-            if guest:
-                guest.api_call_at = func.now()
-                session.flush()
+    async def get_recent_message_guests(limit: int) -> List[tuple]:
+        """(guest_id, message_id, phone) of the most recently sent invites, newest first"""
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                select(Guest.id, Guest.message_id, Guest.phone)
+                .where(Guest.message_id.isnot(None))
+                .order_by(Guest.api_call_at.desc())
+                .limit(limit)
+            )
+            return [tuple(row) for row in result]
     
     @staticmethod
-    def update_guest_whatsapp_status(guest_id: int, status: str, message_id: Optional[str] = None):
-        """Update guest's WhatsApp send status"""
-        with get_db_session() as session:
-            guest = session.query(Guest).filter(Guest.id == guest_id).first()
-            if guest:
-                guest.sent_to_whatsapp = status
-                if message_id:
-                    guest.message_id = message_id
-                session.flush()
+    def summarize_status_updates(
+        statuses: List[StatusEvent],
+        by_message_id: Dict[str, int]
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Collapse the statuses of one webhook payload to one change set per guest.
+        
+        Each timestamp field keeps its earliest value, and the status with the
+        highest precedence (read > delivered > failed > sent) is the one that counts.
+        Statuses for messages that belong to no guest are dropped.
+        """
+        changes: Dict[int, Dict[str, Any]] = {}
+        for status in statuses:
+            rank = STATUS_PRECEDENCE.get(status.status)
+            guest_id = by_message_id.get(status.message_id)
+            if rank is None or guest_id is None:
+                continue
+            change = changes.setdefault(guest_id, {
+                'b_guest_id': guest_id,
+                'b_status': None,
+                'b_rank': 0,
+                'b_sent_at': None,
+                'b_delivered_at': None,
+                'b_read_at': None,
+                'b_failed_at': None,
+                'b_error': None,
+            })
+            if rank > change['b_rank']:
+                change['b_rank'] = rank
+                change['b_status'] = status.status
+            if status.timestamp:
+                key = f"b_{STATUS_TIMESTAMP_FIELDS[status.status]}"
+                dt = datetime.fromtimestamp(status.timestamp)
+                if change[key] is None or dt < change[key]:
+                    change[key] = dt
+            if status.error:
+                change['b_error'] = status.error
+        return changes
     
     @staticmethod
-    async def update_guest_status_by_message_id(message_id: str, status: str, timestamp: int):
-        """Update guest status based on message ID from webhook"""
-        from datetime import datetime
+    async def apply_status_updates(parsed: ParsedWebhook, matches: GuestMatches) -> int:
+        """
+        Apply a webhook payload's statuses and invite button replies in one transaction.
+        
+        `matches` comes from resolve_webhook_guests(), so nothing is looked up
+        again here: both UPDATEs are single executemany statements keyed by
+        guest id. Updates are monotonic: timestamps only move earlier, and
+        delivery_status never moves back down the precedence order, so
+        receipts arriving out of order cannot undo each other.
+        Returns the number of guest rows matched.
+        """
+        changes = GuestOperations.summarize_status_updates(parsed.statuses, matches.by_message_id)
+        responses: Dict[int, datetime] = {}
+        for message in parsed.messages:
+            guest_id = matches.by_phone.get(message.phone)
+            if not message.is_invite_request or guest_id is None or not message.timestamp:
+                continue
+            dt = datetime.fromtimestamp(message.timestamp)
+            if guest_id not in responses or dt < responses[guest_id]:
+                responses[guest_id] = dt
+        
+        if not changes and not responses:
+            return 0
         
+        matched = 0
         async with get_async_db_session() as session:
-            result = await session.execute(
-                select(Guest).where(Guest.message_id == message_id)
-            )
-            guest = result.scalar_one_or_none()
-            
-            if guest:
-                # Convert Unix timestamp to datetime
-                dt = datetime.fromtimestamp(timestamp)
-                
-                if status == 'sent':
-                    guest.sent_at = dt
-                elif status == 'delivered':
-                    guest.delivered_at = dt
-                elif status == 'read':
-                    guest.read_at = dt
-                
-                await session.flush()
-                return guest
-            return None
+            if changes:
+                result = await session.execute(STATUS_UPDATE_STATEMENT, list(changes.values()))
+                matched += result.rowcount
+            if responses:
+                result = await session.execute(
+                    BUTTON_RESPONSE_UPDATE_STATEMENT,
+                    [{'b_guest_id': guest_id, 'b_responded_at': dt} for guest_id, dt in responses.items()]
+                )
+                matched += result.rowcount
+        return matched
+
+
+# Header sets remembered per process; real traffic has only a handful
+AUDIT_HEADER_CACHE_SIZE = 1000
+
+
+def headers_digest(headers: bytes) -> str:
+    return hashlib.blake2b(headers, digest_size=16).hexdigest()
+
+
+class AuditHeaderOperations:
+    """
+    Shared header sets for the audit tables.
+    
+    Audit rows store a headers_id instead of their own copy of the headers;
+    each distinct set (by content digest) is stored once in audit_headers.
+    Known digests are answered from a bounded LRU in memory, so only a new
+    set (or one evicted by AUDIT_HEADER_CACHE_SIZE others) costs a query.
+    """
+    
+    _ids: "OrderedDict[str, int]" = OrderedDict()
     
     @staticmethod
-    async def update_guest_button_response(phone: str, timestamp: int):
-        """Update guest button response timestamp"""
-        from datetime import datetime
-        
-        async with get_async_db_session() as session:
-            result = await session.execute(
-                select(Guest).where(Guest.phone == phone)
-            )
-            guest = result.scalar_one_or_none()
-            
-            if guest:
-                # Convert Unix timestamp to datetime
-                dt = datetime.fromtimestamp(timestamp)
-                guest.responded_with_button = dt
-                await session.flush()
-                return guest
-            return None
+    def _insert_statement(digest: str, headers: bytes):
+        return sqlite_insert(AuditHeaders).values(digest=digest, headers=headers).on_conflict_do_nothing(
+            index_elements=['digest']
+        )
+    
+    @staticmethod
+    def _remember(digest: str, header_id: int):
+        AuditHeaderOperations._ids[digest] = header_id
+        if len(AuditHeaderOperations._ids) > AUDIT_HEADER_CACHE_SIZE:
+            AuditHeaderOperations._ids.popitem(last=False)
+    
+    @staticmethod
+    async def intern(headers: bytes) -> int:
+        """The audit_headers id for this (canonical JSON) header set, storing it if it is new"""
+        digest = headers_digest(headers)
+        header_id = AuditHeaderOperations._ids.get(digest)
+        if header_id is not None:
+            AuditHeaderOperations._ids.move_to_end(digest)
+        else:
+            async with get_async_db_session() as session:
+                await session.execute(AuditHeaderOperations._insert_statement(digest, headers))
+                header_id = (await session.execute(
+                    select(AuditHeaders.id).where(AuditHeaders.digest == digest)
+                )).scalar_one()
+            AuditHeaderOperations._remember(digest, header_id)
+        return header_id
+    
+    @staticmethod
+    def intern_sync(conn, headers: bytes) -> int:
+        """intern() on a sync connection, for bulk loaders"""
+        digest = headers_digest(headers)
+        conn.execute(AuditHeaderOperations._insert_statement(digest, headers))
+        return conn.execute(select(AuditHeaders.id).where(AuditHeaders.digest == digest)).scalar_one()
 
 
 class WhatsAppAPICallOperations:
@@ -354,8 +842,8 @@ class WhatsAppAPICallOperations:
         direction: str,
         method: str,
         url: str,
-        headers: str,
-        payload: Optional[str] = None,
+        headers_id: Optional[int] = None,
+        payload: Optional[bytes] = None,
         status_code: Optional[int] = None,
         response_time_ms: Optional[int] = None,
         error_message: Optional[str] = None
@@ -367,7 +855,7 @@ class WhatsAppAPICallOperations:
                 direction=direction,
                 method=method,
                 url=url,
-                headers=headers,
+                headers_id=headers_id,
                 payload=payload,
                 status_code=status_code,
                 response_time_ms=response_time_ms,
@@ -385,8 +873,8 @@ class WebhookPayloadOperations:
     @staticmethod
     async def create_webhook_payload(
         event_type: str,
-        payload: str,
-        headers: str,
+        payload: bytes,
+        headers_id: Optional[int] = None,
         guest_id: Optional[int] = None,
         is_multiple: bool = False
     ) -> WebhookPayload:
@@ -396,7 +884,7 @@ class WebhookPayloadOperations:
                 guest_id=guest_id,
                 event_type=event_type,
                 payload=payload,
-                headers=headers,
+                headers_id=headers_id,
                 processed=False,
                 is_multiple=is_multiple
             )
@@ -406,6 +894,291 @@ class WebhookPayloadOperations:
             return webhook
 
 
+class WebhookEventKeyOperations:
+    """Keys of processed webhook events (see webhook_dedupe.py)"""
+    
+    @staticmethod
+    async def get_recent_keys(limit: int) -> List[str]:
+        """The most recently received keys, newest first"""
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                select(WebhookEventKey.event_key).order_by(WebhookEventKey.received_at.desc()).limit(limit)
+            )
+            return list(result.scalars())
+    
+    @staticmethod
+    async def find_seen(keys: List[str]) -> Set[str]:
+        """Which of `keys` are stored"""
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                select(WebhookEventKey.event_key).where(WebhookEventKey.event_key.in_(keys))
+            )
+            return set(result.scalars())
+    
+    @staticmethod
+    async def add_keys(keys: List[str]):
+        now = utcnow()
+        async with get_async_db_session() as session:
+            await session.execute(
+                sqlite_insert(WebhookEventKey)
+                .values([{'event_key': key, 'received_at': now} for key in keys])
+                .on_conflict_do_nothing(index_elements=['event_key'])
+            )
+    
+    @staticmethod
+    async def prune(before: datetime) -> int:
+        """Delete keys received before `before`; returns how many"""
+        async with get_async_db_session() as session:
+            result = await session.execute(delete(WebhookEventKey).where(WebhookEventKey.received_at < before))
+            return result.rowcount
+
+
+class OutboxOperations:
+    """
+    Durable invite outbox.
+
+    Jobs move pending -> claimed -> in_flight -> succeeded/failed. Every
+    transition is a conditional UPDATE on (id, state, claimed_by), so two
+    workers can never own the same job, and a claim whose lease expires
+    (worker crashed or was killed) is returned to pending for any other
+    worker to pick up.
+    """
+    
+    ACTIVE_STATES = ('claimed', 'in_flight')
+    
+    @staticmethod
+    async def enqueue_ready_guests() -> List[int]:
+        """Create pending jobs for every ready, unsent guest and mark those guests queued. Returns their ids."""
+        now = utcnow()
+        async with get_async_db_session() as session:
+            ready = select(
+                Guest.id, literal_value('pending'), literal_value(0), literal_value(now)
+            ).where(
+                Guest.ready == True,
+                Guest.sent_to_whatsapp == 'pending',
+                Guest.phone.isnot(None)
+            )
+            stmt = sqlite_insert(OutboxJob).from_select(
+                ['guest_id', 'state', 'attempts', 'available_at'], ready
+            )
+            # A guest put back to 'pending' after a finished job is queued again
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['guest_id'],
+                set_={
+                    'state': 'pending',
+                    'attempts': 0,
+                    'available_at': now,
+                    'claimed_by': None,
+                    'lease_expires_at': None,
+                    'last_error': None,
+                },
+                where=OutboxJob.state.in_(('succeeded', 'failed'))
+            ).returning(OutboxJob.guest_id)
+            result = await session.execute(stmt)
+            queued_ids = [row[0] for row in result.all()]
+            
+            if queued_ids:
+                await session.execute(
+                    update(Guest)
+                    .where(
+                        Guest.id.in_(select(OutboxJob.guest_id).where(OutboxJob.state == 'pending')),
+                        # likely(): look guests up by id, not through every unsent guest
+                        func.likely(Guest.sent_to_whatsapp == 'pending')
+                    )
+                    .values(sent_to_whatsapp='queued')
+                    .execution_options(synchronize_session=False)
+                )
+            return queued_ids
+    
+    @staticmethod
+    async def claim_jobs(worker_token: str, limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        """Atomically claim up to `limit` due jobs and return them with the guest fields needed to send"""
+        now = utcnow()
+        async with get_async_db_session() as session:
+            due = (
+                select(OutboxJob.id)
+                .where(OutboxJob.state == 'pending', OutboxJob.available_at <= now)
+                .order_by(OutboxJob.available_at)
+                .limit(limit)
+            )
+            result = await session.execute(
+                update(OutboxJob)
+                .where(OutboxJob.id.in_(due.scalar_subquery()), OutboxJob.state == 'pending')
+                .values(
+                    state='claimed',
+                    claimed_by=worker_token,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds)
+                )
+                .returning(OutboxJob.id, OutboxJob.guest_id, OutboxJob.attempts)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = result.all()
+            if not claimed:
+                return []
+            
+            guests = await session.execute(
+                select(
+                    Guest.id, Guest.prefix, Guest.first_name, Guest.last_name,
+                    Guest.greeting_name, Guest.phone
+                ).where(Guest.id.in_([row.guest_id for row in claimed]))
+            )
+            guest_rows = {row.id: row for row in guests.all()}
+            
+            jobs = []
+            for row in claimed:
+                guest = guest_rows.get(row.guest_id)
+                if guest is None:
+                    continue
+                jobs.append({
+                    'job_id': row.id,
+                    'guest_id': row.guest_id,
+                    'attempts': row.attempts,
+                    'prefix': guest.prefix,
+                    'first_name': guest.first_name,
+                    'last_name': guest.last_name,
+                    'greeting_name': guest.greeting_name,
+                    'phone': guest.phone
+                })
+            return jobs
+    
+    @staticmethod
+    async def mark_in_flight(job_id: int, worker_token: str, lease_seconds: float) -> bool:
+        """Take a claimed job in flight. Returns False if the claim was lost (lease expired and reclaimed)."""
+        now = utcnow()
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                update(OutboxJob)
+                .where(
+                    OutboxJob.id == job_id,
+                    OutboxJob.state == 'claimed',
+                    OutboxJob.claimed_by == worker_token
+                )
+                .values(
+                    state='in_flight',
+                    attempts=OutboxJob.attempts + 1,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds)
+                )
+                .returning(OutboxJob.guest_id)
+                .execution_options(synchronize_session=False)
+            )
+            guest_id = result.scalar_one_or_none()
+            if guest_id is None:
+                return False
+            
+            # Update api_call_at before making the call
+            await session.execute(
+                update(Guest)
+                .where(Guest.id == guest_id)
+                .values(api_call_at=func.now())
+                .execution_options(synchronize_session=False)
+            )
+            return True
+    
+    @staticmethod
+    async def complete_job(
+        job_id: int,
+        worker_token: str,
+        succeeded: bool,
+        message_id: Optional[str] = None,
+        error: Optional[str] = None
+    ) -> bool:
+        """Record the final outcome of an in-flight job on both the job and its guest"""
+        state = 'succeeded' if succeeded else 'failed'
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                update(OutboxJob)
+                .where(
+                    OutboxJob.id == job_id,
+                    OutboxJob.state == 'in_flight',
+                    OutboxJob.claimed_by == worker_token
+                )
+                .values(state=state, message_id=message_id, last_error=error, lease_expires_at=None)
+                .returning(OutboxJob.guest_id)
+                .execution_options(synchronize_session=False)
+            )
+            guest_id = result.scalar_one_or_none()
+            if guest_id is None:
+                return False
+            
+            values = {'sent_to_whatsapp': state}
+            if message_id:
+                values['message_id'] = message_id
+            await session.execute(
+                update(Guest)
+                .where(Guest.id == guest_id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        if message_id:
+            guest_index.put_message_id(message_id, guest_id)
+        return True
+    
+    @staticmethod
+    async def retry_job(job_id: int, worker_token: str, delay_seconds: float, error: Optional[str] = None) -> bool:
+        """Return an in-flight job to pending, due again after `delay_seconds`"""
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                update(OutboxJob)
+                .where(
+                    OutboxJob.id == job_id,
+                    OutboxJob.state == 'in_flight',
+                    OutboxJob.claimed_by == worker_token
+                )
+                .values(
+                    state='pending',
+                    available_at=utcnow() + timedelta(seconds=delay_seconds),
+                    claimed_by=None,
+                    lease_expires_at=None,
+                    last_error=error
+                )
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount == 1
+    
+    @staticmethod
+    async def release_claims(worker_tokens: List[str]) -> int:
+        """Hand back jobs that were claimed but never taken in flight (graceful shutdown)"""
+        if not worker_tokens:
+            return 0
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                update(OutboxJob)
+                .where(OutboxJob.state == 'claimed', OutboxJob.claimed_by.in_(worker_tokens))
+                .values(state='pending', claimed_by=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount
+    
+    @staticmethod
+    async def reclaim_expired_leases() -> int:
+        """
+        Return jobs whose lease has expired to pending.
+        
+        An expired in_flight job belonged to a worker that died mid-send, so the
+        invite may or may not have been accepted; it is sent again (at-least-once).
+        """
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                update(OutboxJob)
+                .where(
+                    OutboxJob.state.in_(OutboxOperations.ACTIVE_STATES),
+                    OutboxJob.lease_expires_at < utcnow()
+                )
+                .values(state='pending', claimed_by=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            return result.rowcount
+    
+    @staticmethod
+    async def count_by_state() -> Dict[str, int]:
+        """Number of outbox jobs in each state"""
+        async with get_async_db_session() as session:
+            result = await session.execute(
+                select(OutboxJob.state, func.count()).group_by(OutboxJob.state)
+            )
+            return {state: count for state, count in result.all()}
+
+
 # Legacy compatibility functions
 def get_db_path():
     """Get the database path as a string (for backward compatibility)"""
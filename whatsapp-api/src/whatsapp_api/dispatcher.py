@@ -0,0 +1,345 @@
+import os
+import time
+import uuid
+import random
+import socket
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, List
+
+from .guest_events import publish_guest_changes
+
+logger = logging.getLogger(__name__)
+
+# Dispatcher configuration. WhatsApp Cloud API numbers start at 80 messages/second;
+# lower INVITE_RATE_PER_SECOND to match the throughput tier of the sending number.
+INVITE_MAX_CONCURRENCY = int(os.getenv("INVITE_MAX_CONCURRENCY", "10"))
+INVITE_RATE_PER_SECOND = float(os.getenv("INVITE_RATE_PER_SECOND", "80"))
+INVITE_RATE_BURST = int(os.getenv("INVITE_RATE_BURST", "10"))
+INVITE_MAX_ATTEMPTS = int(os.getenv("INVITE_MAX_ATTEMPTS", "5"))
+INVITE_BACKOFF_BASE = float(os.getenv("INVITE_BACKOFF_BASE", "1.0"))
+INVITE_BACKOFF_MAX = float(os.getenv("INVITE_BACKOFF_MAX", "60.0"))
+INVITE_OUTBOX_LEASE_SECONDS = float(os.getenv("INVITE_OUTBOX_LEASE_SECONDS", "120"))
+INVITE_OUTBOX_POLL_SECONDS = float(os.getenv("INVITE_OUTBOX_POLL_SECONDS", "2"))
+INVITE_OUTBOX_RECLAIM_SECONDS = float(os.getenv("INVITE_OUTBOX_RECLAIM_SECONDS", "30"))
+
+# HTTP statuses and Graph error codes worth another attempt
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_GRAPH_ERROR_CODES = {
+    4,       # Application request limit reached
+    80007,   # WhatsApp Business Account rate limit hit
+    130429,  # Cloud API throughput reached
+    131000,  # Something went wrong
+    133004,  # Server temporarily unavailable
+}
+
+
+class TokenBucket:
+    """Async token bucket limiting how many messages start per second"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause_for(self, seconds: float):
+        """Stop handing out tokens for a while, e.g. after the API reports throttling"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(result: Dict[str, Any]) -> bool:
+    """Decide whether a failed send result from send_whatsapp_message should be attempted again"""
+    if result.get("status") == "success":
+        return False
+    if result.get("code") in RETRYABLE_STATUS_CODES:
+        return True
+    error = (result.get("data") or {}).get("error") or {}
+    if error.get("code") in RETRYABLE_GRAPH_ERROR_CODES:
+        return True
+    # The request never reached the API, so sending again cannot duplicate the invite.
+    # Timeouts are not retried because the message may already have been accepted.
+    return result.get("error_type") == "connection"
+
+
+class InviteJob:
+    """An outbox job claimed by this dispatcher"""
+
+    __slots__ = ("job_id", "guest_id", "phone_number", "guest_name", "attempts")
+
+    def __init__(self, job_id: int, guest_id: int, phone_number: str, guest_name: str, attempts: int):
+        self.job_id = job_id
+        self.guest_id = guest_id
+        self.phone_number = phone_number
+        self.guest_name = guest_name
+        self.attempts = attempts
+
+
+class InviteDispatcher:
+    """
+    Sends invites from the durable outbox with a fixed pool of workers.
+
+    A feeder claims due jobs from the invite_outbox table under a lease and
+    hands them to the workers. Concurrency is capped by the number of workers,
+    the start rate by a token bucket, and retryable Graph errors are put back
+    in the outbox with jittered exponential backoff (or the Retry-After delay
+    when the API supplies one). Because all state lives in the outbox, any
+    dispatcher can resume the work after a restart.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = INVITE_MAX_CONCURRENCY,
+        rate_per_second: float = INVITE_RATE_PER_SECOND,
+        burst: int = INVITE_RATE_BURST,
+        max_attempts: int = INVITE_MAX_ATTEMPTS,
+        backoff_base: float = INVITE_BACKOFF_BASE,
+        backoff_max: float = INVITE_BACKOFF_MAX,
+        lease_seconds: float = INVITE_OUTBOX_LEASE_SECONDS,
+        poll_seconds: float = INVITE_OUTBOX_POLL_SECONDS,
+        reclaim_seconds: float = INVITE_OUTBOX_RECLAIM_SECONDS
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.reclaim_seconds = reclaim_seconds
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.worker_token = ""
+        self._queue: Optional[asyncio.Queue] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._feeder: Optional[asyncio.Task] = None
+        self._workers: List[asyncio.Task] = []
+        self._busy = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    async def start(self):
+        """Start the outbox feeder and the worker pool"""
+        if self._workers:
+            return
+        # Identifies this process's claims; a restarted process never reuses it
+        self.worker_token = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue(maxsize=self.max_concurrency)
+        self._wake = asyncio.Event()
+        self._feeder = asyncio.create_task(self._feed(), name="invite-feeder")
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"invite-worker-{i}")
+            for i in range(self.max_concurrency)
+        ]
+        logger.info(
+            f"Invite dispatcher {self.worker_token} started (workers={self.max_concurrency}, "
+            f"rate={self.bucket.rate}/s, max_attempts={self.max_attempts})"
+        )
+
+    async def stop(self):
+        """
+        Stop feeding, hand unstarted claims back to the outbox and let in-flight
+        sends finish (up to the Graph API deadline) before stopping the workers.
+        """
+        from .db_operations import OutboxOperations
+        from .graph_client import graph_client
+
+        if self._feeder:
+            self._feeder.cancel()
+            await asyncio.gather(self._feeder, return_exceptions=True)
+            self._feeder = None
+
+        # Claimed jobs still waiting locally are dropped; the outbox keeps them pending
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+        try:
+            released = await OutboxOperations.release_claims([self.worker_token])
+            if released:
+                logger.info(f"Released {released} claimed invites back to the outbox")
+        except Exception as e:
+            logger.error(f"Failed to release claimed invites: {str(e)}")
+
+        deadline = time.monotonic() + (graph_client.timeout.total or 30)
+        while self._busy and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._busy:
+            logger.warning(f"Stopping with {self._busy} invites in flight; their leases will expire and be retried")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Invite dispatcher stopped")
+
+    async def enqueue_ready_guests(self) -> int:
+        """Add every ready, unsent guest to the outbox and wake the feeder. Returns the number queued."""
+        from .db_operations import OutboxOperations
+
+        if self._wake is None:
+            raise RuntimeError("Invite dispatcher is not started")
+        queued_ids = await OutboxOperations.enqueue_ready_guests()
+        if queued_ids:
+            self._wake.set()
+            await publish_guest_changes(queued_ids)
+        return len(queued_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current queue and outcome counters for this process"""
+        return {
+            "worker_token": self.worker_token,
+            "claimed_waiting": self._queue.qsize() if self._queue else 0,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def _feed(self):
+        """Claim due jobs from the outbox and pass them to the workers"""
+        from .db_operations import OutboxOperations
+        from .guests import get_guest_display_name
+
+        last_reclaim = 0.0
+        while True:
+            claimed = []
+            try:
+                if time.monotonic() - last_reclaim >= self.reclaim_seconds:
+                    last_reclaim = time.monotonic()
+                    reclaimed = await OutboxOperations.reclaim_expired_leases()
+                    if reclaimed:
+                        logger.warning(f"Reclaimed {reclaimed} invites with expired leases")
+
+                claimed = await OutboxOperations.claim_jobs(
+                    self.worker_token, self.max_concurrency, self.lease_seconds
+                )
+                for row in claimed:
+                    name = get_guest_display_name(
+                        row['prefix'], row['first_name'], row['last_name'], row['greeting_name']
+                    )
+                    await self._queue.put(
+                        InviteJob(row['job_id'], row['guest_id'], row['phone'], name, row['attempts'])
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Invite feeder error: {str(e)}", exc_info=True)
+
+            if not claimed:
+                # Nothing due: sleep until new invites are queued or delayed retries fall due
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._busy += 1
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Invite worker error for guest {job.guest_id}: {str(e)}", exc_info=True)
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
+
+    async def _run_job(self, job: InviteJob):
+        """Make one send attempt for a claimed job and record the outcome in the outbox"""
+        from .db_operations import OutboxOperations
+        from .rest.whatsapp import send_invite_to_guest
+
+        await self.bucket.acquire()
+        if not await OutboxOperations.mark_in_flight(job.job_id, self.worker_token, self.lease_seconds):
+            logger.warning(f"Lost claim on invite job {job.job_id} for guest {job.guest_id}; skipping")
+            return
+        job.attempts += 1
+
+        self.in_flight += 1
+        try:
+            result = await send_invite_to_guest(job.phone_number, job.guest_name, guest_id=job.guest_id)
+        except Exception as e:
+            logger.error(f"Error sending invite to guest {job.guest_id}: {str(e)}")
+            result = {"status": "error", "message": str(e), "error_type": "unexpected"}
+        finally:
+            self.in_flight -= 1
+
+        # Extract message ID from response if available
+        message_id = None
+        if result.get("status") == "success":
+            message_id = result.get("data", {}).get("messages", [{}])[0].get("id")
+
+        if message_id:
+            await OutboxOperations.complete_job(job.job_id, self.worker_token, True, message_id=message_id)
+            await publish_guest_changes([job.guest_id])
+            self.sent += 1
+            logger.info(f"Successfully sent invite to guest {job.guest_id}")
+            return
+
+        error = str(result.get("data") or result.get("message") or result)
+        if is_retryable(result) and job.attempts < self.max_attempts:
+            retry_after = parse_retry_after(result.get("retry_after"))
+            delay = self.backoff_delay(job.attempts, retry_after)
+            if result.get("code") == 429 or retry_after is not None:
+                # Throttling applies to the whole number, not just this recipient
+                self.bucket.pause_for(delay)
+            await OutboxOperations.retry_job(job.job_id, self.worker_token, delay, error=error)
+            self.retries += 1
+            logger.warning(
+                f"Retrying invite to guest {job.guest_id} in {delay:.2f}s "
+                f"(attempt {job.attempts}/{self.max_attempts}, code={result.get('code')})"
+            )
+            return
+
+        await OutboxOperations.complete_job(job.job_id, self.worker_token, False, error=error)
+        await publish_guest_changes([job.guest_id])
+        self.failed += 1
+        logger.error(f"Failed to send invite to guest {job.guest_id} after {job.attempts} attempts")
+
+
+invite_dispatcher = InviteDispatcher()
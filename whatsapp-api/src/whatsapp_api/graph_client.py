@@ -0,0 +1,77 @@
+import os
+import logging
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Connection pool and deadline configuration for Graph API requests
+GRAPH_API_CONNECTOR_LIMIT = int(os.getenv("GRAPH_API_CONNECTOR_LIMIT", "100"))
+GRAPH_API_CONNECTOR_LIMIT_PER_HOST = int(os.getenv("GRAPH_API_CONNECTOR_LIMIT_PER_HOST", "50"))
+GRAPH_API_KEEPALIVE_TIMEOUT = float(os.getenv("GRAPH_API_KEEPALIVE_TIMEOUT", "60"))
+GRAPH_API_CONNECT_TIMEOUT = float(os.getenv("GRAPH_API_CONNECT_TIMEOUT", "5"))
+GRAPH_API_READ_TIMEOUT = float(os.getenv("GRAPH_API_READ_TIMEOUT", "15"))
+GRAPH_API_TOTAL_TIMEOUT = float(os.getenv("GRAPH_API_TOTAL_TIMEOUT", "30"))
+
+
+class GraphAPIClient:
+    """
+    Shared aiohttp session for Graph API requests.
+
+    One session (and so one keep-alive connection pool) is opened when the
+    application starts and closed on shutdown, so consecutive sends reuse
+    established TCP/TLS connections instead of handshaking per message.
+    """
+
+    def __init__(
+        self,
+        limit: int = GRAPH_API_CONNECTOR_LIMIT,
+        limit_per_host: int = GRAPH_API_CONNECTOR_LIMIT_PER_HOST,
+        keepalive_timeout: float = GRAPH_API_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = GRAPH_API_CONNECT_TIMEOUT,
+        read_timeout: float = GRAPH_API_READ_TIMEOUT,
+        total_timeout: float = GRAPH_API_TOTAL_TIMEOUT
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Open the pooled session"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        logger.info(
+            f"Graph API client started (limit={self.limit}, limit_per_host={self.limit_per_host}, "
+            f"timeouts={self.timeout})"
+        )
+
+    async def close(self):
+        """Close the pooled session and its connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Graph API client closed")
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, failing loudly if the app lifespan has not started it"""
+        if self._session is None or self._session.closed:
+            raise RuntimeError("Graph API client is not started")
+        return self._session
+
+
+graph_client = GraphAPIClient()
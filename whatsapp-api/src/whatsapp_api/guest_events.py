@@ -0,0 +1,159 @@
+import os
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Iterable, Set
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Server-sent events configuration
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "100"))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+# Larger changes (a filter-wide ready update, queueing every ready guest) are sent as a resync
+SSE_MAX_EVENT_GUESTS = int(os.getenv("SSE_MAX_EVENT_GUESTS", "500"))
+
+# Queued to every subscriber by close() so open streams end
+_CLOSED = object()
+
+# Guest fields carried by change events: what webhooks, sends and ready toggles modify
+STATUS_EVENT_FIELDS = (
+    'id', 'ready', 'sent_to_whatsapp', 'api_call_at', 'sent_at', 'delivered_at', 'read_at', 'failed_at',
+    'responded_with_button', 'message_id', 'delivery_status', 'delivery_error', 'updated_at'
+)
+
+
+def format_sse(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """One Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {orjson.dumps(data).decode()}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscriber:
+    """One connected stream: a bounded queue of pre-formatted messages"""
+
+    def __init__(self, max_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.needs_resync = False
+
+
+class GuestEventHub:
+    """
+    In-process fan-out of guest changes to connected browsers.
+
+    publish() never waits. Each subscriber has a bounded queue; when a slow
+    consumer's queue is full its backlog is dropped and replaced by a single
+    'resync' event, after which the client fetches what it missed with a
+    delta sync. Memory per subscriber is therefore capped at SSE_QUEUE_SIZE
+    messages however far behind it falls.
+    """
+
+    def __init__(self, queue_size: int = SSE_QUEUE_SIZE, max_subscribers: int = SSE_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscriber] = set()
+        self._next_id = 0
+        self.published = 0
+        self.resyncs = 0
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self) -> Optional[Subscriber]:
+        """Register a new stream, or None when the subscriber limit is reached"""
+        if len(self._subscribers) >= self.max_subscribers:
+            return None
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event: str, data: Any):
+        """Queue an event for every subscriber without waiting"""
+        if not self._subscribers:
+            return
+        self._next_id += 1
+        message = format_sse(event, data, self._next_id)
+        self.published += 1
+        for subscriber in self._subscribers:
+            if subscriber.needs_resync:
+                continue
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._overflow(subscriber)
+
+    def close(self):
+        """End every open stream (application shutdown)"""
+        for subscriber in self._subscribers:
+            self._drain(subscriber)
+            subscriber.queue.put_nowait(_CLOSED)
+
+    async def next_message(self, subscriber: Subscriber, timeout: float = SSE_KEEPALIVE_SECONDS) -> Optional[str]:
+        """
+        The subscriber's next message; a keep-alive comment after `timeout`
+        seconds of silence, or None once the hub is closed
+        """
+        try:
+            message = await asyncio.wait_for(subscriber.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return ": keepalive\n\n"
+        if message is _CLOSED:
+            return None
+        if subscriber.needs_resync and subscriber.queue.empty():
+            subscriber.needs_resync = False
+        return message
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "resyncs": self.resyncs,
+        }
+
+    def _overflow(self, subscriber: Subscriber):
+        self._drain(subscriber)
+        subscriber.queue.put_nowait(format_sse("resync", {}))
+        subscriber.needs_resync = True
+        self.resyncs += 1
+        logger.warning("Guest event subscriber fell behind; asking it to resync")
+
+    @staticmethod
+    def _drain(subscriber: Subscriber):
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+
+
+guest_events = GuestEventHub()
+
+
+async def publish_guest_changes(guest_ids: Iterable[int]):
+    """
+    Broadcast the current status fields of `guest_ids` after a commit.
+    Costs nothing when no browser is connected. More than
+    SSE_MAX_EVENT_GUESTS guests are announced with a 'resync' event instead,
+    so clients fetch them with a delta sync rather than one huge message
+    (and the row lookup stays within SQLite's bound-parameter limit).
+    """
+    guest_ids = sorted(set(guest_ids))
+    if not guest_ids or not guest_events.has_subscribers:
+        return
+    if len(guest_ids) > SSE_MAX_EVENT_GUESTS:
+        guest_events.publish("resync", {})
+        return
+    try:
+        from .db_operations import GuestOperations
+
+        rows = await GuestOperations.get_guest_status_rows(guest_ids, STATUS_EVENT_FIELDS)
+        if rows:
+            guest_events.publish("guests", {"guests": rows})
+    except Exception as e:
+        logger.error(f"Failed to publish guest changes: {str(e)}", exc_info=True)
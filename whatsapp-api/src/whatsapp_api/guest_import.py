@@ -0,0 +1,233 @@
+"""
+Bulk guest import from CSV (with a header row) or JSONL
+
+The input is read as a stream of lines and imported GUEST_IMPORT_BATCH_SIZE
+rows at a time, so memory use does not grow with the size of the file.
+
+Run from the whatsapp-api directory:
+    python -m src.whatsapp_api.guest_import guests.csv
+"""
+import io
+import os
+import csv
+import json
+import codecs
+import asyncio
+import logging
+import argparse
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+
+from .models import GuestCreate
+from .db_operations import GuestOperations, init_database
+
+logger = logging.getLogger(__name__)
+
+# Rows validated and inserted per transaction
+GUEST_IMPORT_BATCH_SIZE = int(os.getenv("GUEST_IMPORT_BATCH_SIZE", "500"))
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# Content types accepted for each format when no explicit format is given
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/jsonl': 'jsonl',
+    'application/x-jsonlines': 'jsonl',
+    'application/x-ndjson': 'jsonl',
+}
+
+# (line number, fields, error) - exactly one of fields and error is set
+ImportRecord = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+
+def import_format_for(content_type: Optional[str] = None, filename: Optional[str] = None) -> Optional[str]:
+    """Guess the import format from a Content-Type header or a file extension"""
+    if content_type:
+        import_format = IMPORT_CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+        if import_format:
+            return import_format
+    if filename:
+        extension = os.path.splitext(filename)[1].lstrip('.').lower()
+        if extension in ('ndjson', 'jsonlines'):
+            return 'jsonl'
+        if extension in IMPORT_FORMATS:
+            return extension
+    return None
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines, each ending with its newline"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()  # spreadsheets often prepend a BOM
+    pending = ''
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+async def csv_records(lines: AsyncIterator[str]) -> AsyncIterator[ImportRecord]:
+    """Rows of a CSV file keyed by its header; line numbers count the header as line 1"""
+    header = None
+    record = ''
+    line_number = 0
+    record_line = 1
+    async for line in lines:
+        line_number += 1
+        if not record:
+            record_line = line_number
+        record += line
+        if record.count('"') % 2:
+            continue  # a quoted field spans lines
+        values = next(csv.reader(io.StringIO(record)), [])
+        record = ''
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            continue
+        if len(values) != len(header):
+            yield record_line, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield record_line, dict(zip(header, values)), None
+    if record.strip():
+        yield record_line, None, "Unterminated quoted field"
+
+
+async def jsonl_records(lines: AsyncIterator[str]) -> AsyncIterator[ImportRecord]:
+    """One JSON object per line"""
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(fields, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, fields, None
+
+
+def parse_records(import_format: str, lines: AsyncIterator[str]) -> AsyncIterator[ImportRecord]:
+    if import_format == 'csv':
+        return csv_records(lines)
+    if import_format == 'jsonl':
+        return jsonl_records(lines)
+    raise ValueError(f"Unknown import format '{import_format}', expected one of: {', '.join(IMPORT_FORMATS)}")
+
+
+def build_guest(fields: Dict[str, Any]) -> GuestCreate:
+    """A GuestCreate from one imported row; blank values count as missing"""
+    values = {}
+    for name, value in fields.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            continue
+        values[name] = value
+    return GuestCreate(**values)
+
+
+def import_row_error(guest: GuestCreate) -> Optional[str]:
+    """Rules an imported row must meet on top of GuestCreate's"""
+    if guest.is_group_primary and not guest.phone:
+        return "phone: Phone is required for primary contacts"
+    return None
+
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'row'}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+async def import_guests(records: AsyncIterator[ImportRecord], batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Create guests from parsed records a batch at a time.
+
+    Rows are checked in file order against the same rules as POST /api/guests,
+    and a primary contact must have a phone.
+    A rejected row is reported by line number and does not stop the import;
+    batches already inserted stay inserted. batch_size defaults to
+    GUEST_IMPORT_BATCH_SIZE.
+    """
+    batch_size = batch_size or GUEST_IMPORT_BATCH_SIZE
+    report: Dict[str, Any] = {"rows": 0, "created": 0, "failed": 0, "errors": []}
+    batch: List[Tuple[int, GuestCreate]] = []
+
+    async def flush():
+        try:
+            created, errors = await GuestOperations.import_guest_batch(batch)
+        except IntegrityError:
+            # A guest created meanwhile took one of the batch's phones; check again
+            created, errors = await GuestOperations.import_guest_batch(batch)
+        report["created"] += created
+        report["errors"].extend(errors)
+        batch.clear()
+
+    async for line, fields, error in records:
+        report["rows"] += 1
+        if error is None:
+            try:
+                guest = build_guest(fields)
+            except ValidationError as e:
+                error = validation_message(e)
+            else:
+                error = import_row_error(guest)
+                if error is None:
+                    batch.append((line, guest))
+        if error:
+            report["errors"].append({"line": line, "error": error})
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    report["errors"].sort(key=lambda error: error["line"])
+    report["failed"] = len(report["errors"])
+    logger.info(f"Guest import: {report['created']} created, {report['failed']} rejected of {report['rows']} rows")
+    return report
+
+
+async def file_chunks(path: str, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def import_file(path: str, import_format: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    init_database()
+    return await import_guests(parse_records(import_format, iter_lines(file_chunks(path))), batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-create guests from a CSV or JSONL file")
+    parser.add_argument("path", help="CSV with a header row, or one JSON object per line")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=GUEST_IMPORT_BATCH_SIZE, help="rows per transaction")
+    args = parser.parse_args()
+
+    import_format = args.format or import_format_for(filename=args.path)
+    if import_format is None:
+        parser.error("cannot tell the format from the file name; pass --format")
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(import_file(args.path, import_format, args.batch_size))
+    print(json.dumps(report, indent=2))
+    raise SystemExit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
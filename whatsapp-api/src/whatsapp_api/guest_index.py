@@ -0,0 +1,153 @@
+import os
+import re
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Iterable, Set, Tuple
+
+from .webhook_events import GuestMatches
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of message_id/phone keys kept in memory
+GUEST_INDEX_SIZE = int(os.getenv("GUEST_INDEX_SIZE", "50000"))
+
+_NON_DIGITS = re.compile(r'\D')
+
+MESSAGE_ID = 'message_id'
+PHONE = 'phone'
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Digits only, so '+971 50 123 4567' and WhatsApp's '971501234567' share a key"""
+    return _NON_DIGITS.sub('', phone or '')
+
+
+class GuestIndex:
+    """
+    Bounded LRU map from message_id and normalized phone to guest_id.
+
+    Webhooks refer to guests by the message_id of the invite or by the
+    sender's phone, and during a campaign the same few hundred keys come back
+    over and over. Keys are written through when a message_id is stored and
+    filled from the database on a miss; any change to a guest drops its keys.
+    Only positive results are cached, so a miss always falls through to SQLite.
+    Guest operations are all async, so the index is only touched from the
+    event loop and takes no lock.
+    """
+
+    def __init__(self, max_size: int = GUEST_INDEX_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._keys_by_guest: Dict[int, Set[Tuple[str, str]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put_message_id(self, message_id: str, guest_id: int):
+        """Record the guest's current message_id, replacing any older one"""
+        for key in list(self._keys_by_guest.get(guest_id, ())):
+            if key[0] == MESSAGE_ID and key[1] != message_id:
+                self._remove(key)
+        self._put((MESSAGE_ID, message_id), guest_id)
+
+    def put_phone(self, phone: str, guest_id: int):
+        normalized = normalize_phone(phone)
+        if normalized:
+            self._put((PHONE, normalized), guest_id)
+
+    def invalidate_guest(self, guest_id: int):
+        """Forget every key that points at `guest_id`"""
+        for key in list(self._keys_by_guest.get(guest_id, ())):
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_guest.clear()
+
+    def lookup(
+        self,
+        message_ids: Iterable[str],
+        phones: Iterable[str]
+    ) -> Tuple[GuestMatches, Set[str], Set[str]]:
+        """
+        Resolve what the index knows.
+        Returns (matches, message_ids not found, phones not found).
+        """
+        matches = GuestMatches()
+        missing_message_ids: Set[str] = set()
+        missing_phones: Set[str] = set()
+        for message_id in message_ids:
+            guest_id = self._get((MESSAGE_ID, message_id))
+            if guest_id is None:
+                missing_message_ids.add(message_id)
+            else:
+                matches.by_message_id[message_id] = guest_id
+        for phone in phones:
+            guest_id = self._get((PHONE, normalize_phone(phone)))
+            if guest_id is None:
+                missing_phones.add(phone)
+            else:
+                matches.by_phone[phone] = guest_id
+        return matches, missing_message_ids, missing_phones
+
+    async def warm(self):
+        """Load the most recently sent invites so the first webhooks of a campaign hit"""
+        from .db_operations import GuestOperations
+
+        rows = await GuestOperations.get_recent_message_guests(self.max_size // 2)
+        for guest_id, message_id, phone in reversed(rows):
+            self.put_message_id(message_id, guest_id)
+            if phone:
+                self.put_phone(phone, guest_id)
+        logger.info(f"Guest index warmed with {len(self)} keys from {len(rows)} recent sends")
+
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+    def _get(self, key: Tuple[str, str]) -> Optional[int]:
+        guest_id = self._entries.get(key)
+        if guest_id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return guest_id
+
+    def _put(self, key: Tuple[str, str], guest_id: int):
+        previous = self._entries.get(key)
+        if previous is not None and previous != guest_id:
+            self._unlink(previous, key)
+        self._entries[key] = guest_id
+        self._entries.move_to_end(key)
+        self._keys_by_guest.setdefault(guest_id, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]):
+        guest_id = self._entries.pop(key, None)
+        if guest_id is not None:
+            self._unlink(guest_id, key)
+
+    def _unlink(self, guest_id: int, key: Tuple[str, str]):
+        """Drop `key` from the guest's key set, and the set once it is empty"""
+        keys = self._keys_by_guest.get(guest_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_guest[guest_id]
+
+
+guest_index = GuestIndex()
@@ -1,21 +1,63 @@
 from typing import List, Optional, Dict
 from .db_operations import GuestOperations
-from .models import GuestCreate, GuestUpdate, GuestResponse
+from .models import GuestCreate, GuestUpdate, GuestBulkUpdate, GuestResponse
 
 
-def get_all_guests() -> List[Dict]:
+async def get_all_guests() -> List[Dict]:
     """Get all guests from database"""
-    return GuestOperations.get_all_guests()
+    return await GuestOperations.get_all_guests()
 
 
-def create_guest(guest_data: GuestCreate) -> Dict:
+async def list_guests_page(**filters) -> Dict:
+    """One keyset page of guests; see GuestOperations.list_guests_page"""
+    return await GuestOperations.list_guests_page(**filters)
+
+
+async def get_guest_list_version() -> tuple:
+    """Changes whenever any guest is added, changed or deleted"""
+    return await GuestOperations.get_guest_list_version()
+
+
+async def count_guests_by_country() -> List[Dict]:
+    """Guest counts per calling code"""
+    return await GuestOperations.count_guests_by_country()
+
+
+async def get_guest(guest_id: int) -> Optional[Dict]:
+    """Get a single guest"""
+    return await GuestOperations.get_guest(guest_id)
+
+
+async def create_guest(guest_data: GuestCreate) -> Dict:
     """Create a new guest"""
-    return GuestOperations.create_guest(guest_data)
+    return await GuestOperations.create_guest(guest_data)
 
 
-def update_guest(guest_id: int, update_data: GuestUpdate) -> Optional[Dict]:
+async def update_guest(guest_id: int, update_data: GuestUpdate) -> Optional[Dict]:
     """Update a guest"""
-    return GuestOperations.update_guest(guest_id, update_data)
+    return await GuestOperations.update_guest(guest_id, update_data)
+
+
+async def bulk_update_ready(bulk_update: GuestBulkUpdate) -> Dict:
+    """Set ready for many guests in one statement"""
+    return await GuestOperations.bulk_update_ready(bulk_update)
+
+
+async def get_ready_guests() -> List[Dict]:
+    """Get guests marked ready that have not been sent an invite"""
+    return await GuestOperations.get_ready_guests_for_whatsapp()
 
 
- 
\ No newline at end of file
+def get_guest_display_name(
+    prefix: Optional[str],
+    first_name: str,
+    last_name: str,
+    greeting_name: Optional[str]
+) -> str:
+    """Name used in the invite: greeting name if set, otherwise prefix + first + last name"""
+    # Use greeting name if available, otherwise construct from prefix + first name
+    if greeting_name:
+        return greeting_name
+    # Combine prefix with the full name if prefix exists
+    name_parts = [prefix, first_name, last_name] if prefix else [first_name, last_name]
+    return " ".join(name_parts)
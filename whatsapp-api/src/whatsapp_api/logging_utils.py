@@ -3,9 +3,36 @@ import logging
 import time
 from typing import Optional, Dict, Any
 
+import orjson
+
+from .audit_writer import audit_writer
+from .compression import compact_json
+from .webhook_events import parse_webhook
+
 logger = logging.getLogger(__name__)
 
 
+# Header values never stored (credentials and per-request signatures)
+REDACTED_HEADERS = {
+    'authorization': 'Bearer [REDACTED]',
+    'x-hub-signature': '[REDACTED]',
+    'x-hub-signature-256': '[REDACTED]',
+}
+# Headers that differ on every request and would defeat header deduplication
+VOLATILE_HEADERS = {'content-length'}
+
+
+def canonical_headers(headers: Dict[str, Any]) -> bytes:
+    """Redacted headers as compact JSON with sorted keys, so equal sets serialize identically"""
+    safe_headers = {}
+    for name, value in headers.items():
+        key = name.lower()
+        if key in VOLATILE_HEADERS:
+            continue
+        safe_headers[name] = REDACTED_HEADERS.get(key, value)
+    return orjson.dumps(safe_headers, option=orjson.OPT_SORT_KEYS)
+
+
 async def log_whatsapp_api_call(
     db_path: str,
     guest_id: int,
@@ -19,27 +46,28 @@ async def log_whatsapp_api_call(
     error_message: Optional[str] = None
 ):
     """
-    Log WhatsApp API calls to the database
+    Log WhatsApp API calls to the database (buffered through the audit writer when it is running)
     """
     try:
-        from .db_operations import WhatsAppAPICallOperations
+        from .db_operations import WhatsAppAPICallOperations, AuditHeaderOperations, utcnow
+        from .db_models import WhatsAppAPICall
         
-        # Remove sensitive data from headers before logging
-        safe_headers = headers.copy()
-        if 'Authorization' in safe_headers:
-            safe_headers['Authorization'] = 'Bearer [REDACTED]'
-        
-        await WhatsAppAPICallOperations.create_api_call(
-            guest_id=guest_id,
-            direction=direction,
-            method=method,
-            url=url,
-            headers=json.dumps(safe_headers, indent=2),
-            payload=json.dumps(payload, indent=2) if payload else None,
-            status_code=status_code,
-            response_time_ms=response_time_ms,
-            error_message=error_message
-        )
+        row = {
+            'guest_id': guest_id,
+            'direction': direction,
+            'method': method,
+            'url': url,
+            'headers_id': await AuditHeaderOperations.intern(canonical_headers(headers)),
+            'payload': compact_json(payload) if payload else None,
+            'status_code': status_code,
+            'response_time_ms': response_time_ms,
+            'error_message': error_message
+        }
+        if audit_writer.running:
+            # Stamp the row now; the buffered INSERT may run a little later
+            await audit_writer.record(WhatsAppAPICall.__table__, {'timestamp': utcnow(), **row})
+        else:
+            await WhatsAppAPICallOperations.create_api_call(**row)
             
         # Also log to Python logger for immediate visibility
         log_message = f"WhatsApp API {direction} - Method: {method}, URL: {url}"
@@ -67,23 +95,26 @@ async def log_webhook_payload(
     is_multiple: bool = False
 ):
     """
-    Log webhook payloads to the database
+    Log webhook payloads to the database (buffered through the audit writer when it is running)
     """
     try:
-        from .db_operations import WebhookPayloadOperations
+        from .db_operations import WebhookPayloadOperations, AuditHeaderOperations, utcnow
+        from .db_models import WebhookPayload
         
-        # Remove sensitive headers
-        safe_headers = headers.copy()
-        if 'X-Hub-Signature-256' in safe_headers:
-            safe_headers['X-Hub-Signature-256'] = '[REDACTED]'
-            
-        await WebhookPayloadOperations.create_webhook_payload(
-            event_type=event_type,
-            payload=json.dumps(payload, indent=2),
-            headers=json.dumps(safe_headers, indent=2),
-            guest_id=guest_id,
-            is_multiple=is_multiple
-        )
+        row = {
+            'event_type': event_type,
+            'payload': compact_json(payload),
+            'headers_id': await AuditHeaderOperations.intern(canonical_headers(headers)),
+            'guest_id': guest_id,
+            'is_multiple': is_multiple
+        }
+        if audit_writer.running:
+            # Stamp the row now; the buffered INSERT may run a little later
+            await audit_writer.record(
+                WebhookPayload.__table__, {'timestamp': utcnow(), 'processed': False, **row}
+            )
+        else:
+            await WebhookPayloadOperations.create_webhook_payload(**row)
             
         # Log to Python logger
         log_msg = f"Webhook received - Event Type: {event_type}"
@@ -103,105 +134,25 @@ def extract_webhook_event_type(payload: Dict[str, Any]) -> str:
     Extract the event type from a WhatsApp webhook payload
     """
     try:
-        # WhatsApp webhook structure: entry[0].changes[0].value.statuses[0].status
-        if 'entry' in payload and payload['entry']:
-            changes = payload['entry'][0].get('changes', [])
-            if changes:
-                value = changes[0].get('value', {})
-                
-                # Check for message status updates
-                if 'statuses' in value and value['statuses']:
-                    return value['statuses'][0].get('status', 'unknown_status')
-                
-                # Check for incoming messages
-                if 'messages' in value and value['messages']:
-                    return 'incoming_message'
-                    
-                # Check for other event types
-                if 'contacts' in value:
-                    return 'contact_update'
-                    
-        return 'unknown'
+        return parse_webhook(payload).event_type
     except Exception as e:
         logger.error(f"Failed to extract webhook event type: {str(e)}", exc_info=True)
         return 'error'
 
 
-async def extract_guest_info_from_webhook(db_path: str, payload: Dict[str, Any]) -> tuple[Optional[int], bool]:
-    """
-    Extract guest_id from webhook payload by looking up message_id or phone number
-    Returns (guest_id, is_multiple)
-    """
-    try:
-        from .db_operations import GuestOperations
-        
-        print(f"DEBUG: Full webhook payload: {json.dumps(payload, indent=2)}")
-        
-        guest_ids = set()
-        
-        # Extract message IDs and phone numbers from the webhook
-        if 'entry' in payload and payload['entry']:
-            for entry in payload['entry']:
-                changes = entry.get('changes', [])
-                for change in changes:
-                    value = change.get('value', {})
-                    
-                    # Check for status updates (sent/delivered/read)
-                    statuses = value.get('statuses', [])
-                    for status in statuses:
-                        message_id = status.get('id')
-                        if message_id:
-                            print(f"DEBUG: Searching for message_id in DB: {message_id}")
-                            guest = await GuestOperations.get_guest_by_message_id(message_id)
-                            if guest:
-                                print(f"DEBUG: Found guest by message_id: {guest.id}")
-                                guest_ids.add(guest.id)
-                            else:
-                                print(f"DEBUG: No guest found for message_id: {message_id}")
-                    
-                    # Check for incoming messages
-                    messages = value.get('messages', [])
-                    for message in messages:
-                        # Get phone number from incoming message
-                        from_number = message.get('from')
-                        if from_number:
-                            print(f"DEBUG: Searching for phone number in DB: {from_number}")
-                            guest = await GuestOperations.get_guest_by_phone(from_number)
-                            if guest:
-                                print(f"DEBUG: Found guest by phone: {guest.id}")
-                                guest_ids.add(guest.id)
-                            else:
-                                print(f"DEBUG: No guest found for phone: {from_number}")
-        
-        # Determine if multiple guests
-        if len(guest_ids) == 0:
-            print("DEBUG: No guests found in webhook payload")
-            return (None, False)
-        elif len(guest_ids) == 1:
-            guest_id = list(guest_ids)[0]
-            print(f"DEBUG: Single guest found: {guest_id}")
-            return (guest_id, False)
-        else:
-            # Multiple guests - return None for guest_id
-            print(f"DEBUG: Multiple guests found: {guest_ids}")
-            return (None, True)
-            
-    except Exception as e:
-        logger.error(f"Failed to extract guest info from webhook: {str(e)}", exc_info=True)
-        return (None, False)
-
-
 class APICallTimer:
-    """Context manager to time API calls"""
+    """Context manager to time API calls; the timings are set when the block exits"""
     
     def __init__(self):
         self.start_time = None
+        self.elapsed = None
         self.response_time_ms = None
         
     def __enter__(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         return self
         
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.start_time:
-            self.response_time_ms = int((time.time() - self.start_time) * 1000)
\ No newline at end of file
+            self.elapsed = time.perf_counter() - self.start_time
+            self.response_time_ms = int(self.elapsed * 1000)
\ No newline at end of file
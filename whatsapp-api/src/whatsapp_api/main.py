@@ -1,10 +1,21 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
-from .db_operations import init_database
+from .db_operations import init_database, engine, async_engine
+from .graph_client import graph_client
+from .dispatcher import invite_dispatcher
+from .audit_writer import audit_writer
+from .audit_retention import audit_retention
+from .webhook_queue import webhook_queue
+from .webhook_dedupe import webhook_dedupe
+from .guest_index import guest_index
+from .guest_events import guest_events
+from .profiling import loop_monitor, enable_request_profiling
 from .rest.whatsapp import router as whatsapp_router
 from .rest.crud import router as crud_router
+from .rest.metrics import router as metrics_router
 from .pages.guests import router as guests_page_router
 
 # Configure logging with more detailed format
@@ -15,7 +26,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Wedding RSVP Management")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize database and shared clients on startup, release them on shutdown"""
+    init_database()
+    await loop_monitor.start()
+    await guest_index.warm()
+    await audit_writer.start()
+    await graph_client.start()
+    await invite_dispatcher.start()
+    await webhook_dedupe.start()
+    await webhook_queue.start()
+    await audit_retention.start()
+    logger.info("Application started")
+    try:
+        yield
+    finally:
+        guest_events.close()
+        await audit_retention.stop()
+        await webhook_queue.stop()
+        await webhook_dedupe.stop()
+        await invite_dispatcher.stop()
+        await graph_client.close()
+        await audit_writer.stop()
+        await loop_monitor.stop()
+        logger.info("Application stopped")
+
+
+app = FastAPI(title="Wedding RSVP Management", lifespan=lifespan)
+enable_request_profiling(app, engine, async_engine)
 
 # Mount static files (CSS, JS, images, etc.)
 app.mount("/static", StaticFiles(directory="src/static"), name="static")
@@ -23,16 +63,10 @@ app.mount("/static", StaticFiles(directory="src/static"), name="static")
 # Include routers
 app.include_router(whatsapp_router)
 app.include_router(crud_router)
+app.include_router(metrics_router)
 app.include_router(guests_page_router)
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup"""
-    init_database()
-    logger.info("Application started")
-
-
 # Simple route for the homepage
 @app.get("/")
 async def read_root():
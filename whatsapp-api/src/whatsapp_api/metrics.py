@@ -0,0 +1,157 @@
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, from a fast SQLite commit to a slow Graph API call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every metric, in the order it is rendered
+REGISTRY: List["Metric"] = []
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A named metric with optional labels, rendered in the Prometheus text format.
+
+    Updates are plain dict and int arithmetic on the event loop thread, with
+    no locks, so recording costs about a microsecond. `collect`, if given, is
+    called at scrape time instead and returns {label values: value}; it
+    exposes counters a component already keeps (see rest/metrics.py).
+    """
+    kind = 'untyped'
+
+    def __init__(
+        self, name: str, help: str, labels: Tuple[str, ...] = (),
+        collect: Optional[Callable[[], Dict[Labels, float]]] = None
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.collect = collect
+        self._values: Dict[Labels, float] = {}
+        REGISTRY.append(self)
+
+    def samples(self) -> List[str]:
+        values = self.collect() if self.collect else self._values
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A total that only goes up"""
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A current value, e.g. a queue depth"""
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class _HistogramSeries:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets (non-cumulative until rendered)"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, _HistogramSeries] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _HistogramSeries(len(self.buckets))
+        # Buckets are "less than or equal to" their bound
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            suffix = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+# Hot-path metrics, recorded where the work happens
+graph_api_response_seconds = Histogram(
+    "whatsapp_graph_api_response_seconds",
+    "Graph API send latency by HTTP status (or connection/timeout/error when there was no response)",
+    ("status",)
+)
+webhook_processing_seconds = Histogram(
+    "whatsapp_webhook_processing_seconds",
+    "Time to resolve, log and apply one webhook payload, by event type",
+    ("event_type",)
+)
+webhook_statuses_applied = Counter(
+    "whatsapp_webhook_statuses_applied_total",
+    "Webhook statuses and invite button replies applied to a known guest",
+    ("status",)
+)
+db_session_seconds = Histogram(
+    "whatsapp_db_session_seconds",
+    "Lifetime of a database session, including its commit",
+    ("kind",)
+)
+db_commit_seconds = Histogram(
+    "whatsapp_db_commit_seconds",
+    "Time spent committing a database session",
+    ("kind",)
+)
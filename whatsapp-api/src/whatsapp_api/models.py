@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional
+from pydantic import BaseModel, Field, validator, root_validator
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 import re
 
@@ -28,6 +28,34 @@ class GuestUpdate(BaseModel):
     ready: Optional[bool] = None
 
 
+class GuestFilter(BaseModel):
+    """The filters of GET /api/guests"""
+    group_id: Optional[str] = None
+    ready: Optional[bool] = None
+    sent_to_whatsapp: Optional[str] = None
+    delivery_status: Optional[str] = None
+    calling_code: Optional[str] = None
+
+
+class GuestBulkUpdate(BaseModel):
+    """
+    Set ready for many guests at once. Guests must match every selector
+    given: ids, group_ids and filter. An empty filter selects all guests.
+    """
+    ready: bool
+    # Bound as one SQL parameter each; keeps well under SQLite's limit
+    ids: Optional[List[int]] = Field(None, max_length=10000)
+    group_ids: Optional[List[str]] = Field(None, max_length=10000)
+    filter: Optional[GuestFilter] = None
+    return_rows: bool = False
+
+    @root_validator(skip_on_failure=True)
+    def validate_selection(cls, values):
+        if values.get('ids') is None and values.get('group_ids') is None and values.get('filter') is None:
+            raise ValueError('Select guests with ids, group_ids or filter')
+        return values
+
+
 class GuestResponse(GuestBase):
     id: int
     sent_to_whatsapp: str
@@ -37,9 +65,27 @@ class GuestResponse(GuestBase):
     read_at: Optional[datetime]
     responded_with_button: Optional[datetime]
     message_id: Optional[str]
+    delivery_status: Optional[str] = None
+    failed_at: Optional[datetime] = None
+    delivery_error: Optional[str] = None
+    calling_code: Optional[str] = None
     created_at: datetime
     updated_at: datetime
     phone_class: Optional[str] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class GuestBulkUpdateResult(BaseModel):
+    updated: int
+    guest_ids: List[int]
+    guests: Optional[List[GuestResponse]] = None
+
+
+class GuestPage(BaseModel):
+    """A page of GET /api/guests; guests carry only the requested fields"""
+    guests: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    sync_token: str
+    deleted: Optional[List[int]] = None
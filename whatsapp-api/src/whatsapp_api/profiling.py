@@ -0,0 +1,270 @@
+import io
+import os
+import sys
+import time
+import random
+import asyncio
+import cProfile
+import logging
+import pstats
+import threading
+import traceback
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Request diagnostics; nothing is installed unless REQUEST_PROFILING=1
+REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "0") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", "50"))
+# Share of requests run under cProfile; the profile is logged only if the request turns out slow
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "25"))
+
+# Event loop watchdog; 0 turns it off
+LOOP_STALL_MS = float(os.getenv("LOOP_STALL_MS", "0"))
+# Stack frames logged for a stall
+LOOP_STALL_STACK_DEPTH = 15
+
+
+class RequestStats:
+    """SQL issued while serving one request"""
+    __slots__ = ('queries', 'blocking_queries', 'db_seconds', '_started')
+
+    def __init__(self):
+        self.queries = 0
+        self.blocking_queries = 0  # sync-engine statements run on the event loop thread
+        self.db_seconds = 0.0
+        self._started: List[float] = []
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def count_statements(engine: Engine, sync: bool = False):
+    """
+    Add each statement `engine` runs to the current request's RequestStats.
+    With `sync`, statements run on the event loop thread (a sync session
+    called from an async endpoint) are also counted as blocking.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _request_stats.get()
+        if stats is None:
+            return
+        stats.queries += 1
+        if sync and _on_event_loop():
+            stats.blocking_queries += 1
+        stats._started.append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _request_stats.get()
+        if stats is not None and stats._started:
+            stats.db_seconds += time.perf_counter() - stats._started.pop()
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def format_profile(profiler: cProfile.Profile, limit: int = PROFILE_TOP_FUNCTIONS) -> str:
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+class RequestProfilingMiddleware:
+    """
+    ASGI middleware that counts the SQL statements and database time of each
+    request and logs requests slower than SLOW_REQUEST_MS or issuing more than
+    SLOW_REQUEST_QUERIES statements. A PROFILE_SAMPLE_RATE share of requests
+    also runs under cProfile, and a slow one has its profile logged. cProfile
+    sees the whole event loop thread, so the profile includes whatever else
+    ran while the request was in progress; one request is profiled at a time.
+    Event streams (text/event-stream) are never reported as slow.
+    """
+
+    def __init__(
+        self,
+        app,
+        slow_ms: float = SLOW_REQUEST_MS,
+        slow_queries: int = SLOW_REQUEST_QUERIES,
+        sample_rate: float = PROFILE_SAMPLE_RATE
+    ):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.slow_queries = slow_queries
+        self.sample_rate = sample_rate
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        response = {"status": None, "streaming": False}
+
+        async def send_and_watch(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        response["streaming"] = True
+            await send(message)
+
+        profiler = None
+        if self.sample_rate and not self._profiling and random.random() < self.sample_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_watch)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            _request_stats.reset(token)
+            if not response["streaming"]:
+                self._report(scope, response["status"], elapsed_ms, stats, profiler)
+
+    def _report(self, scope, status, elapsed_ms: float, stats: RequestStats, profiler: Optional[cProfile.Profile]):
+        slow = elapsed_ms >= self.slow_ms
+        if not slow and stats.queries <= self.slow_queries:
+            return
+        message = (
+            f"Slow request: {scope['method']} {scope['path']} -> {status} in {elapsed_ms:.1f} ms, "
+            f"{stats.queries} SQL statements taking {stats.db_seconds * 1000:.1f} ms"
+        )
+        if stats.blocking_queries:
+            message += f" ({stats.blocking_queries} on the event loop thread)"
+        if profiler is not None and slow:
+            message += "\n" + format_profile(profiler)
+        logger.warning(message)
+
+
+class EventLoopMonitor:
+    """
+    Watchdog for event loop stalls.
+
+    A heartbeat task on the loop records when it last ran; a background
+    thread checks it and, when the loop has not run for LOOP_STALL_MS, logs
+    the task and stack that is holding the loop (usually a blocking call in a
+    coroutine). The stall's total length is logged once the loop recovers.
+    """
+
+    def __init__(self, stall_ms: float = LOOP_STALL_MS):
+        self.stall_ms = stall_ms
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._last_beat = 0.0
+        self.stalls = 0
+        self.longest_stall_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.stall_ms > 0
+
+    async def start(self):
+        """Start the heartbeat and the watchdog thread (no-op when LOOP_STALL_MS is 0)"""
+        if not self.enabled or self._heartbeat is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopping.clear()
+        self._heartbeat = asyncio.create_task(self._beat(), name="event-loop-heartbeat")
+        self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop monitor started (stall threshold {self.stall_ms} ms)")
+
+    async def stop(self):
+        if self._heartbeat is None:
+            return
+        self._stopping.set()
+        self._heartbeat.cancel()
+        await asyncio.gather(self._heartbeat, return_exceptions=True)
+        self._heartbeat = None
+        self._watchdog.join(timeout=1)
+        self._watchdog = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "stall_ms": self.stall_ms,
+            "stalls": self.stalls,
+            "longest_stall_ms": round(self.longest_stall_ms, 1),
+        }
+
+    async def _beat(self):
+        interval = self.stall_ms / 4000
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(interval)
+
+    def _watch(self):
+        interval = self.stall_ms / 4000
+        stalled_since = None
+        while not self._stopping.wait(interval):
+            behind_ms = (time.monotonic() - self._last_beat) * 1000
+            if behind_ms >= self.stall_ms and stalled_since is None:
+                stalled_since = self._last_beat
+                self.stalls += 1
+                logger.warning(
+                    f"Event loop stalled for over {behind_ms:.0f} ms; running {self._describe_running()}"
+                )
+            elif behind_ms < self.stall_ms and stalled_since is not None:
+                # The heartbeat ran again: the stall lasted until its last beat
+                stall_ms = (self._last_beat - stalled_since) * 1000
+                self.longest_stall_ms = max(self.longest_stall_ms, stall_ms)
+                logger.warning(f"Event loop recovered after a {stall_ms:.0f} ms stall")
+                stalled_since = None
+
+    def _describe_running(self) -> str:
+        """The task on the loop and its innermost stack frames, read from the watchdog thread"""
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        if task is not None:
+            coro = task.get_coro()
+            running = f"task {task.get_name()!r} ({getattr(coro, '__qualname__', coro)})"
+        else:
+            running = "no task (a callback)"
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return running
+        stack = ''.join(traceback.format_stack(frame, limit=LOOP_STALL_STACK_DEPTH))
+        return f"{running} at:\n{stack}"
+
+
+loop_monitor = EventLoopMonitor()
+
+
+def enable_request_profiling(app, engine: Engine, async_engine: AsyncEngine):
+    """Install the request middleware and the statement counters (only when REQUEST_PROFILING=1)"""
+    if not REQUEST_PROFILING:
+        return
+    count_statements(engine, sync=True)
+    count_statements(async_engine.sync_engine)
+    app.add_middleware(RequestProfilingMiddleware)
+    logger.info(
+        f"Request profiling enabled (slow: {SLOW_REQUEST_MS} ms or {SLOW_REQUEST_QUERIES} statements, "
+        f"profile sample rate {PROFILE_SAMPLE_RATE})"
+    )
@@ -1,14 +1,21 @@
 import os
+import hashlib
+import orjson
 import logging
 from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Response, Query, Request, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from ..db_operations import get_db_session
-from ..models import GuestCreate, GuestUpdate, GuestResponse
-from ..guests import get_all_guests, create_guest, update_guest
-from ..db_models import Guest
+from ..models import GuestCreate, GuestUpdate, GuestBulkUpdate, GuestBulkUpdateResult, GuestResponse, GuestPage
+from ..db_operations import GUEST_PAGE_SIZE, GUEST_PAGE_SIZE_MAX
+from ..guest_events import guest_events, publish_guest_changes
+from ..guest_import import IMPORT_FORMATS, import_format_for, iter_lines, parse_records, import_guests
+from ..guests import (
+    list_guests_page, get_guest_list_version, count_guests_by_country, get_guest, create_guest, update_guest,
+    bulk_update_ready, get_ready_guests
+)
 
 # Load environment variables
 load_dotenv(dotenv_path='/Users/madhavsharma/dotenv/aamantran.env')
@@ -19,63 +26,150 @@ TABLE_NAME = os.getenv("TABLE_NAME")
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/api", tags=["crud"])
+# Guest dicts come straight from the database and are already the API shape, so
+# endpoints return them with ORJSONResponse instead of re-validating them
+# against their response_model (which stays for the OpenAPI docs)
+router = APIRouter(prefix="/api", tags=["crud"], default_response_class=ORJSONResponse)
 
 
-@router.get("/guests", response_model=List[GuestResponse])
-async def get_guests_endpoint():
-    """Get all guests"""
+# Rows serialized per orjson.dumps call; the encoder holds the GIL for a whole call
+JSON_ENCODE_CHUNK_SIZE = 2000
+
+
+def guest_list_etag(version: tuple, query: str) -> str:
+    """Weak ETag for one guest-list URL at one version of the guest table"""
+    digest = hashlib.sha1(f"{version[0]}|{version[1]}|{query}".encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def encode_json_array(items: List[Any]) -> bytes:
+    """
+    Serialize a list to a JSON array a chunk at a time, so the event loop
+    thread still gets the GIL while a large body is encoded
+    """
+    chunks = [
+        orjson.dumps(items[i:i + JSON_ENCODE_CHUNK_SIZE])[1:-1]
+        for i in range(0, len(items), JSON_ENCODE_CHUNK_SIZE)
+    ]
+    return b"[" + b",".join(chunk for chunk in chunks if chunk) + b"]"
+
+
+@router.get("/guests", response_model=GuestPage)
+async def get_guests_endpoint(
+    request: Request,
+    limit: int = Query(GUEST_PAGE_SIZE, ge=1, le=GUEST_PAGE_SIZE_MAX),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    group_id: Optional[str] = None,
+    ready: Optional[bool] = None,
+    sent_to_whatsapp: Optional[str] = None,
+    delivery_status: Optional[str] = Query(None, description="sent, delivered, read, failed or none"),
+    calling_code: Optional[str] = Query(None, description="Country calling code, e.g. 971"),
+    fields: Optional[str] = Query(None, description="Comma-separated guest fields to return"),
+    since: Optional[str] = Query(None, description="sync_token from an earlier response; only changes after it are returned"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get guests a page at a time in (group_id, id) order
+    
+    Responses carry an ETag; a request with a matching If-None-Match gets an
+    empty 304 when no guest has changed since.
+    """
     try:
-        guests = get_all_guests()
-        return guests
+        version = await get_guest_list_version()
+        etag = guest_list_etag(version, request.url.query)
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        page = await list_guests_page(
+            limit=limit,
+            cursor=cursor,
+            group_id=group_id,
+            ready=ready,
+            sent_to_whatsapp=sent_to_whatsapp,
+            delivery_status=delivery_status,
+            calling_code=calling_code,
+            fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+            since=since,
+            version=version
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching guests: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch guests")
+    
+    # Encoding thousands of rows is CPU work; keep it off the event loop
+    guests_json = await run_in_threadpool(encode_json_array, page.pop('guests'))
+    body = b'{"guests":' + guests_json + b',' + orjson.dumps(page)[1:]
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+@router.get("/guests/events")
+async def guest_events_endpoint(request: Request):
+    """
+    Server-Sent Events stream of guest changes
+    
+    'guests' events carry the status fields of guests just changed by a
+    webhook or an invite send. A 'resync' event means events were dropped
+    because the client fell behind; it should fetch the list with since=.
+    """
+    subscriber = guest_events.subscribe()
+    if subscriber is None:
+        raise HTTPException(status_code=503, detail="Too many event subscribers")
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                message = await guest_events.next_message(subscriber)
+                if message is None:
+                    break
+                yield message
+        finally:
+            guest_events.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/guests/countries")
+async def guest_countries_endpoint():
+    """
+    Guests per country calling code, with how many are ready and sent
+    
+    calling_code is null for guests without a phone or with an unknown code.
+    """
+    try:
+        return ORJSONResponse({"countries": await count_guests_by_country()})
+    except Exception as e:
+        logger.error(f"Error counting guests by country: {e}")
+        raise HTTPException(status_code=500, detail="Failed to count guests by country")
 
 
 @router.get("/guests/{guest_id}")
-async def get_guest(guest_id: int):
+async def get_guest_endpoint(guest_id: int):
     """
     Get a specific guest by ID
     """
     try:
-        with get_db_session() as session:
-            guest = session.query(Guest).filter(Guest.id == guest_id).first()
-            if not guest:
-                raise HTTPException(status_code=404, detail="Guest not found")
-            
-            guest_dict = {
-                'id': guest.id,
-                'prefix': guest.prefix,
-                'first_name': guest.first_name,
-                'last_name': guest.last_name,
-                'greeting_name': guest.greeting_name,
-                'phone': guest.phone,
-                'group_id': guest.group_id,
-                'is_group_primary': guest.is_group_primary,
-                'ready': guest.ready,
-                'sent_to_whatsapp': guest.sent_to_whatsapp,
-                'api_call_at': guest.api_call_at,
-                'sent_at': guest.sent_at,
-                'delivered_at': guest.delivered_at,
-                'read_at': guest.read_at,
-                'responded_with_button': guest.responded_with_button,
-                'message_id': guest.message_id,
-                'created_at': guest.created_at,
-                'updated_at': guest.updated_at
-            }
-            return {"guest": guest_dict}
+        guest = await get_guest(guest_id)
     except Exception as e:
         logger.error(f"Error fetching guest: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch guest")
+    if not guest:
+        raise HTTPException(status_code=404, detail="Guest not found")
+    return ORJSONResponse({"guest": guest})
 
 
 @router.post("/guests", response_model=GuestResponse, status_code=201)
 async def create_guest_endpoint(guest: GuestCreate):
     """Create a new guest"""
     try:
-        new_guest = create_guest(guest)
-        return new_guest
+        new_guest = await create_guest(guest)
+        return ORJSONResponse(new_guest, status_code=201)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -83,47 +177,74 @@ async def create_guest_endpoint(guest: GuestCreate):
         raise HTTPException(status_code=500, detail="Failed to create guest")
 
 
+@router.post("/guests/import")
+async def import_guests_endpoint(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv or jsonl; defaults from the Content-Type")
+):
+    """
+    Bulk-create guests from a CSV (with a header row) or JSONL request body
+    
+    The body is parsed and inserted in batches as it arrives. Each row is
+    checked like POST /api/guests; rejected rows are listed by line number
+    in the report and do not stop the import.
+    """
+    import_format = format or import_format_for(request.headers.get("content-type"))
+    if import_format not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail="Send text/csv or application/x-ndjson, or pass format=csv or format=jsonl"
+        )
+    try:
+        return await import_guests(parse_records(import_format, iter_lines(request.stream())))
+    except Exception as e:
+        logger.error(f"Error importing guests: {e}")
+        raise HTTPException(status_code=500, detail="Failed to import guests")
+
+
 @router.patch("/guests/{guest_id}", response_model=GuestResponse)
 async def update_guest_endpoint(guest_id: int, update_data: GuestUpdate):
     """Update a guest"""
     try:
-        updated_guest = update_guest(guest_id, update_data)
-        if not updated_guest:
-            raise HTTPException(status_code=404, detail="Guest not found")
-        return updated_guest
+        updated_guest = await update_guest(guest_id, update_data)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error updating guest: {e}")
         raise HTTPException(status_code=500, detail="Failed to update guest")
+    if not updated_guest:
+        raise HTTPException(status_code=404, detail="Guest not found")
+    await publish_guest_changes([guest_id])
+    return ORJSONResponse(updated_guest)
+
+
+@router.patch("/guests", response_model=GuestBulkUpdateResult)
+async def bulk_update_guests_endpoint(bulk_update: GuestBulkUpdate):
+    """
+    Set ready for every guest matching ids, group_ids and/or filter
+    
+    Runs as a single UPDATE. Guests already sent an invite are never
+    changed, and guests without a phone are never marked ready.
+    """
+    try:
+        result = await bulk_update_ready(bulk_update)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error bulk updating guests: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update guests")
+    await publish_guest_changes(result['guest_ids'])
+    return ORJSONResponse(result)
 
 
 @router.get("/ready-guests")
-async def get_ready_guests():
+async def get_ready_guests_endpoint():
     """
     Get all guests marked as ready for invitation
     """
     try:
-        with get_db_session() as session:
-            guests = session.query(Guest).filter(
-                Guest.ready == True,
-                Guest.sent_to_whatsapp == 'pending',
-                Guest.phone.isnot(None)
-            ).all()
-            
-            ready_guests = []
-            for guest in guests:
-                guest_dict = {
-                    'id': guest.id,
-                    'prefix': guest.prefix,
-                    'first_name': guest.first_name,
-                    'last_name': guest.last_name,
-                    'greeting_name': guest.greeting_name,
-                    'phone': guest.phone
-                }
-                ready_guests.append(guest_dict)
-                
-            return {"ready_guests": ready_guests, "count": len(ready_guests)}
+        ready_guests = await get_ready_guests()
+        return {"ready_guests": ready_guests, "count": len(ready_guests)}
     except Exception as e:
         logger.error(f"Error fetching ready guests: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch ready guests")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to fetch ready guests")
@@ -0,0 +1,91 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..metrics import Counter, Gauge, render
+from ..dispatcher import invite_dispatcher
+from ..audit_writer import audit_writer
+from ..webhook_queue import webhook_queue
+from ..webhook_dedupe import webhook_dedupe
+from ..guest_index import guest_index
+from ..guest_events import guest_events
+from ..storage import db_lock_errors
+from ..profiling import loop_monitor
+
+router = APIRouter(tags=["metrics"])
+
+# The components already count these; they are read when /metrics is scraped
+Counter(
+    "whatsapp_invites_total", "Invite send outcomes in this process (retried = an attempt that will be retried)",
+    ("result",),
+    collect=lambda: {
+        ("sent",): invite_dispatcher.sent,
+        ("failed",): invite_dispatcher.failed,
+        ("retried",): invite_dispatcher.retries,
+    }
+)
+Gauge(
+    "whatsapp_invites_in_flight", "Invite sends waiting on the Graph API",
+    collect=lambda: {(): invite_dispatcher.in_flight}
+)
+Counter(
+    "whatsapp_webhooks_total", "Webhook payloads by outcome (rejected = answered 503 because the queue was full)",
+    ("result",),
+    collect=lambda: {
+        ("accepted",): webhook_queue.accepted,
+        ("rejected",): webhook_queue.rejected,
+        ("processed",): webhook_queue.processed,
+        ("errors",): webhook_queue.errors,
+    }
+)
+Gauge(
+    "whatsapp_queue_depth", "Items waiting in each in-process queue",
+    ("queue",),
+    collect=lambda: {
+        ("webhook",): webhook_queue.stats()["depth"],
+        ("invite",): invite_dispatcher.stats()["claimed_waiting"],
+        ("audit",): audit_writer.stats()["buffered"],
+    }
+)
+Counter(
+    "whatsapp_webhook_duplicate_events_total",
+    "Redelivered webhook events dropped, by where the earlier delivery was found",
+    ("found_in",),
+    collect=lambda: {
+        ("memory",): webhook_dedupe.duplicates_in_memory,
+        ("database",): webhook_dedupe.duplicates_in_database,
+    }
+)
+Counter(
+    "whatsapp_webhook_payloads_skipped_total",
+    "Webhook payloads not logged or applied because every event in them was a duplicate",
+    collect=lambda: {(): webhook_dedupe.payloads_skipped}
+)
+Counter(
+    "whatsapp_audit_records_written_total", "Audit rows (API calls, webhook payloads) written by the audit writer",
+    collect=lambda: {(): audit_writer.records_written}
+)
+Counter(
+    "whatsapp_guest_index_lookups_total", "Webhook guest lookups answered from memory (hit) or the database (miss)",
+    ("result",),
+    collect=lambda: {("hit",): guest_index.hits, ("miss",): guest_index.misses}
+)
+Gauge(
+    "whatsapp_guest_event_subscribers", "Open /api/guests/events streams",
+    collect=lambda: {(): guest_events.stats()["subscribers"]}
+)
+Counter(
+    "whatsapp_db_lock_errors_total", "Statements that failed with 'database is locked'",
+    collect=lambda: {(): db_lock_errors.count}
+)
+Counter(
+    "whatsapp_event_loop_stalls_total", "Times the event loop did not run for LOOP_STALL_MS (0 when the monitor is off)",
+    collect=lambda: {(): loop_monitor.stalls}
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Send, webhook and database metrics in the Prometheus text format
+    """
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,11 +1,25 @@
 import os
+import time
+import asyncio
 from typing import Optional, Dict, Any
 import aiohttp
 import logging
 from dotenv import load_dotenv
-from fastapi import APIRouter, Request, Response, BackgroundTasks
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import JSONResponse
-from ..logging_utils import log_whatsapp_api_call, log_webhook_payload, extract_webhook_event_type, extract_guest_info_from_webhook, APICallTimer
+from ..logging_utils import log_whatsapp_api_call, log_webhook_payload, APICallTimer
+from ..webhook_events import parse_webhook, ParsedWebhook, GuestMatches
+from ..graph_client import graph_client
+from ..dispatcher import invite_dispatcher
+from ..audit_writer import audit_writer
+from ..audit_retention import audit_retention
+from ..webhook_queue import webhook_queue, WEBHOOK_RETRY_AFTER_SECONDS
+from ..webhook_dedupe import webhook_dedupe
+from ..guest_index import guest_index
+from ..guest_events import guest_events, publish_guest_changes
+from ..storage import db_lock_errors
+from ..profiling import loop_monitor
+from ..metrics import graph_api_response_seconds, webhook_processing_seconds, webhook_statuses_applied
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +27,7 @@ logger = logging.getLogger(__name__)
 load_dotenv(dotenv_path='/Users/madhavsharma/dotenv/aamantran.env')
 
 # WhatsApp API configuration
-WHATSAPP_API_BASE_URL = "https://graph.facebook.com"
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com")  # e.g. a local stand-in for load tests
 WHATSAPP_API_VERSION = "v23.0"
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
@@ -89,67 +103,98 @@ async def send_whatsapp_message(data: Dict[str, Any], guest_id: int) -> Dict[str
         payload=data
     )
     
-    async with aiohttp.ClientSession() as session:
-        try:
-            with APICallTimer() as timer:
-                async with session.post(url, json=data, headers=headers) as response:
-                    response_data = await response.json()
-                    
-                    # Log the API response
-                    await log_whatsapp_api_call(
-                        db_path=db_path,
-                        guest_id=guest_id,
-                        direction="response",
-                        method="POST",
-                        url=url,
-                        headers=headers,
-                        payload=response_data,
-                        status_code=response.status,
-                        response_time_ms=timer.response_time_ms
-                    )
-
-                    if response.status == 200:
-                        print(f"Message sent successfully: {response_data}")
-                        return {"status": "success", "data": response_data}
-                    else:
-                        print(f"Error sending message. Status: {response.status}")
-                        print(f"Response: {response_data}")
-                        return {"status": "error", "code": response.status, "data": response_data}
-
-        except aiohttp.ClientConnectorError as e:
-            error_msg = f"Connection error: {str(e)}"
-            print(f"Connection Error: {str(e)}")
-            
-            # Log the error
-            await log_whatsapp_api_call(
-                db_path=db_path,
-                guest_id=guest_id,
-                direction="response",
-                method="POST",
-                url=url,
-                headers=headers,
-                payload=None,
-                error_message=error_msg
-            )
-            
-            return {"status": "error", "message": error_msg}
-        except Exception as e:
-            error_msg = f"Unexpected error: {str(e)}"
-            print(f"Unexpected error: {str(e)}")
-            
-            # Log the error
-            await log_whatsapp_api_call(
-                db_path=db_path,
-                guest_id=guest_id,
-                direction="response",
-                method="POST",
-                url=url,
-                headers=headers,
-                payload=None,
-                error_message=error_msg
-            )
-            
-            return {"status": "error", "message": error_msg}
+    timer = APICallTimer()
+    try:
+        # Raises (and returns an error result below) if the shared client has not started
+        session = graph_client.session
+        # Time the request and response body only; the timer is read once the block exits
+        with timer:
+            async with session.post(url, json=data, headers=headers) as response:
+                response_data = await response.json()
+                status_code = response.status
+                retry_after = response.headers.get("Retry-After")
+        graph_api_response_seconds.observe(timer.elapsed, str(status_code))
+        
+        # Log the API response
+        await log_whatsapp_api_call(
+            db_path=db_path,
+            guest_id=guest_id,
+            direction="response",
+            method="POST",
+            url=url,
+            headers=headers,
+            payload=response_data,
+            status_code=status_code,
+            response_time_ms=timer.response_time_ms
+        )
+
+        if status_code == 200:
+            logger.info(f"Message sent successfully: {response_data}")
+            return {"status": "success", "data": response_data}
+        else:
+            logger.error(f"Error sending message. Status: {status_code}, response: {response_data}")
+            result = {"status": "error", "code": status_code, "data": response_data}
+            if retry_after:
+                result["retry_after"] = retry_after
+            return result
+
+    except aiohttp.ClientConnectorError as e:
+        error_msg = f"Connection error: {str(e)}"
+        if timer.elapsed is not None:
+            graph_api_response_seconds.observe(timer.elapsed, "connection")
+        logger.error(f"Connection Error: {str(e)}")
+        
+        # Log the error
+        await log_whatsapp_api_call(
+            db_path=db_path,
+            guest_id=guest_id,
+            direction="response",
+            method="POST",
+            url=url,
+            headers=headers,
+            payload=None,
+            error_message=error_msg
+        )
+        
+        return {"status": "error", "message": error_msg, "error_type": "connection"}
+    except asyncio.TimeoutError:
+        error_msg = f"Timeout error: no response within {graph_client.timeout.total}s"
+        if timer.elapsed is not None:
+            graph_api_response_seconds.observe(timer.elapsed, "timeout")
+        logger.warning(f"Graph API send timed out: {error_msg}")
+
+        # Log the error
+        await log_whatsapp_api_call(
+            db_path=db_path,
+            guest_id=guest_id,
+            direction="response",
+            method="POST",
+            url=url,
+            headers=headers,
+            payload=None,
+            error_message=error_msg
+        )
+
+        return {"status": "error", "message": error_msg, "error_type": "timeout"}
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}"
+        if timer.elapsed is not None:
+            graph_api_response_seconds.observe(timer.elapsed, "error")
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        
+        # Log the error
+        await log_whatsapp_api_call(
+            db_path=db_path,
+            guest_id=guest_id,
+            direction="response",
+            method="POST",
+            url=url,
+            headers=headers,
+            payload=None,
+            error_message=error_msg
+        )
+        
+        return {"status": "error", "message": error_msg, "error_type": "unexpected"}
 
 
 @router.get("/webhook")
@@ -157,16 +202,16 @@ async def verify_webhook(request: Request):
     """
     Webhook verification endpoint for WhatsApp
     """
-    print(request)
+    logger.debug(f"Webhook verification request: {request.query_params}")
     mode = request.query_params.get("hub.mode")
     token = request.query_params.get("hub.verify_token")
     challenge = request.query_params.get("hub.challenge")
 
     if mode == "subscribe" and token == WEBHOOK_VERIFY_TOKEN:
-        print("Webhook verified successfully!")
+        logger.info("Webhook verified successfully!")
         return Response(content=challenge, media_type="text/plain")
     else:
-        print("Webhook verification failed!")
+        logger.warning("Webhook verification failed!")
         return Response(content="Forbidden", status_code=403)
 
 
@@ -174,49 +219,100 @@ async def verify_webhook(request: Request):
 async def handle_webhook(request: Request):
     """
     Handle WhatsApp webhook events
+    The payload is queued for the webhook workers and acknowledged immediately
     """
     try:
-        from ..db_operations import get_db_path
-        db_path = get_db_path()
-        
         # Get webhook data
         data = await request.json()
         headers = dict(request.headers)
+    except Exception as e:
+        logger.error(f"Error reading webhook: {str(e)}", exc_info=True)
+        # A malformed body will not improve on redelivery
+        return Response(content="OK", status_code=200)
+    
+    if not webhook_queue.running:
+        try:
+            await process_webhook_payload(data, headers)
+        except Exception as e:
+            logger.error(f"Error handling webhook: {str(e)}", exc_info=True)
+        return Response(content="OK", status_code=200)
+    
+    if not webhook_queue.submit(data, headers):
+        # Shed load: a non-2xx answer makes WhatsApp redeliver the payload later
+        return Response(
+            content="Busy",
+            status_code=503,
+            headers={"Retry-After": str(WEBHOOK_RETRY_AFTER_SECONDS)}
+        )
+    
+    # Return 200 OK immediately to acknowledge receipt
+    return Response(content="OK", status_code=200)
+
+
+async def process_webhook_payload(data: Dict[str, Any], headers: Dict[str, Any]):
+    """
+    Log a webhook payload against its guest and apply its status updates
+    (runs on the webhook queue workers)
+    
+    The payload is parsed once and its guests are resolved with one query;
+    the same matches are used for the audit row and the status updates.
+    Events already processed (Meta redelivers webhooks) are dropped first,
+    after waiting for any copy of them still being processed, and a payload
+    with nothing new is not logged or applied at all.
+    
+    Raises if the payload could not be processed (the queue worker counts it),
+    after giving its event keys back so a redelivery is processed.
+    """
+    started = time.perf_counter()
+    event_type = 'unparsed'
+    claimed = set()
+    applied = False
+    try:
+        from ..db_operations import GuestOperations, get_db_path
+        db_path = get_db_path()
         
-        # Extract event type
-        event_type = extract_webhook_event_type(data)
-        
-        # Extract guest information
-        guest_id, is_multiple = await extract_guest_info_from_webhook(db_path, data)
+        parsed = parse_webhook(data)
+        event_type = parsed.event_type
+        keys = parsed.event_keys
+        if keys:
+            claimed = await webhook_dedupe.claim(keys)
+            if not claimed:
+                webhook_dedupe.skipped()
+                logger.info(f"Skipped redelivered webhook event: {parsed.event_type}")
+                return
+            if len(claimed) < len(set(keys)):
+                parsed = parsed.only(claimed)
+        matches = await GuestOperations.resolve_webhook_guests(parsed.message_ids, parsed.phones)
+        guest_id, is_multiple = matches.audit_association()
         
         # Log webhook payload with guest association
         await log_webhook_payload(
             db_path=db_path,
-            event_type=event_type,
+            event_type=parsed.event_type,
             payload=data,
             headers=headers,
             guest_id=guest_id,
             is_multiple=is_multiple
         )
         
-        # Process webhook based on event type
-        logger.info(f"Received webhook event: {event_type}")
+        logger.info(f"Received webhook event: {parsed.event_type}")
         
         # Process status updates and button responses
-        await process_webhook_updates(data)
-        
-        # Return 200 OK immediately to acknowledge receipt
-        return Response(content="OK", status_code=200)
+        await process_webhook_updates(parsed, matches)
+        applied = True
         
-    except Exception as e:
-        logger.error(f"Error handling webhook: {str(e)}", exc_info=True)
-        # Still return 200 to prevent retries from WhatsApp
-        return Response(content="OK", status_code=200)
+    finally:
+        # Keys of a payload that failed (or was cancelled) are given back for a redelivery
+        if applied:
+            await webhook_dedupe.commit(claimed)
+        else:
+            webhook_dedupe.forget(claimed)
+        webhook_processing_seconds.observe(time.perf_counter() - started, event_type)
 
 
 async def send_invite_to_guest(phone_number: str, guest_name: str, guest_id: int):
     """
-    Background task to send WhatsApp invite to a single guest
+    Send a WhatsApp invite to a single guest (one attempt, called by the invite dispatcher)
     """
     try:
         message_data = create_template_message(
@@ -243,48 +339,22 @@ async def send_invite_to_guest(phone_number: str, guest_name: str, guest_id: int
 
 
 @router.post("/send-invites-to-ready-guests")
-async def send_invites_to_ready_guests(background_tasks: BackgroundTasks):
+async def send_invites_to_ready_guests():
     """
     Send WhatsApp invites to all guests marked as ready
-    This endpoint triggers background tasks to send messages
+    This endpoint adds the guests to the durable invite outbox; pressing it again
+    while invites are still queued does not queue them twice
     """
     try:
-        from ..db_operations import GuestOperations
-        
-        guests_to_send = GuestOperations.get_ready_guests_for_whatsapp()
+        queued_count = await invite_dispatcher.enqueue_ready_guests()
         
-        if not guests_to_send:
+        if not queued_count:
             return {"message": "No ready guests to send invites to", "count": 0}
         
-        # Queue background tasks for each guest
-        for guest in guests_to_send:
-            guest_id = guest['id']
-            prefix = guest['prefix']
-            first_name = guest['first_name']
-            last_name = guest['last_name']
-            greeting_name = guest['greeting_name']
-            phone = guest['phone']
-            
-            # Use greeting name if available, otherwise construct from prefix + first name
-            if greeting_name:
-                name = greeting_name
-            else:
-                # Combine prefix with the full name if prefix exists
-                name_parts = [prefix, first_name, last_name] if prefix else [first_name, last_name]
-                name = " ".join(name_parts)
-            
-            # Add background task to send invite
-            background_tasks.add_task(
-                send_invite_with_db_update,
-                guest_id=guest_id,
-                phone_number=phone,
-                guest_name=name
-            )
-        
         return {
             "message": "Invite sending initiated",
             "status": "processing",
-            "queued_count": len(guests_to_send)
+            "queued_count": queued_count
         }
             
     except Exception as e:
@@ -292,79 +362,51 @@ async def send_invites_to_ready_guests(background_tasks: BackgroundTasks):
         return {"status": "error", "message": str(e)}
 
 
-async def process_webhook_updates(data):
+@router.get("/stats")
+async def get_stats():
     """
-    Process webhook data to update guest statuses
+    Runtime counters for the invite and webhook pipelines
     """
-    from ..db_operations import GuestOperations
+    from ..db_operations import OutboxOperations
     
-    try:
-        if 'entry' in data and data['entry']:
-            for entry in data['entry']:
-                changes = entry.get('changes', [])
-                for change in changes:
-                    value = change.get('value', {})
-                    
-                    # Handle status updates (sent/delivered/read)
-                    statuses = value.get('statuses', [])
-                    for status in statuses:
-                        message_id = status.get('id')
-                        status_type = status.get('status')
-                        timestamp = int(status.get('timestamp', 0))
-                        
-                        if message_id and status_type:
-                            await GuestOperations.update_guest_status_by_message_id(
-                                message_id, status_type, timestamp
-                            )
-                            logger.info(f"Updated guest status: {status_type} for message {message_id}")
-                    
-                    # Handle button responses
-                    messages = value.get('messages', [])
-                    for message in messages:
-                        if message.get('type') == 'button':
-                            button = message.get('button', {})
-                            if button.get('payload') == 'Send me the invite':
-                                phone = message.get('from')
-                                timestamp = int(message.get('timestamp', 0))
-                                
-                                if phone:
-                                    await GuestOperations.update_guest_button_response(phone, timestamp)
-                                    logger.info(f"Updated button response for phone {phone}")
-                    
-    except Exception as e:
-        logger.error(f"Error processing webhook updates: {str(e)}", exc_info=True)
+    return {
+        "invite_dispatcher": invite_dispatcher.stats(),
+        "audit_writer": audit_writer.stats(),
+        "audit_retention": audit_retention.stats(),
+        "webhook_queue": webhook_queue.stats(),
+        "webhook_dedupe": webhook_dedupe.stats(),
+        "guest_index": guest_index.stats(),
+        "guest_events": guest_events.stats(),
+        "invite_outbox": await OutboxOperations.count_by_state(),
+        "database": {"lock_errors": db_lock_errors.count},
+        "event_loop": loop_monitor.stats()
+    }
 
 
-async def send_invite_with_db_update(guest_id: int, phone_number: str, guest_name: str):
+async def process_webhook_updates(parsed: ParsedWebhook, matches: GuestMatches):
     """
-    Send invite and update database status
+    Apply a parsed webhook's statuses and button responses to the matched guests
+    in one transaction
+    
+    Raises if the transaction fails, so the caller gives back the events' keys.
     """
     from ..db_operations import GuestOperations
     
-    try:
-        # Update api_call_at before making the call
-        GuestOperations.update_guest_api_call_time(guest_id)
-        
-        # Send the invite
-        result = await send_invite_to_guest(phone_number, guest_name, guest_id=guest_id)
-        
-        # Extract message ID from response if available
-        message_id = None
-        if result.get("status") == "success":
-            message_id = result.get("data", {}).get("messages", [{}])[0].get("id")
-        
-        # Update guest status based on result
-        if result.get("status") == "success" and message_id:
-            GuestOperations.update_guest_whatsapp_status(guest_id, 'succeeded', message_id)
-            logger.info(f"Successfully sent invite to guest {guest_id}")
-        else:
-            GuestOperations.update_guest_whatsapp_status(guest_id, 'failed')
-            logger.error(f"Failed to send invite to guest {guest_id}")
-        
-    except Exception as e:
-        logger.error(f"Error sending invite to guest {guest_id}: {str(e)}")
-        # Update guest status to failed
-        GuestOperations.update_guest_whatsapp_status(guest_id, 'failed')
+    if not parsed.statuses and not parsed.messages:
+        return
+    matched = await GuestOperations.apply_status_updates(parsed, matches)
+    for status in parsed.statuses:
+        if status.message_id in matches.by_message_id:
+            webhook_statuses_applied.inc(status.status)
+    for message in parsed.messages:
+        if message.is_invite_request and message.phone in matches.by_phone:
+            webhook_statuses_applied.inc('button')
+    logger.info(
+        f"Applied {len(parsed.statuses)} statuses and {len(parsed.messages)} messages "
+        f"({matched} guest rows matched)"
+    )
+    if matched:
+        await publish_guest_changes(matches.guest_ids)
 
 
 # ======================================================================================================================
@@ -404,19 +446,20 @@ async def send_template_message_endpoint() -> Dict[str, Any]:
 
     url = f"{WHATSAPP_API_BASE_URL}/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=message_data, headers=headers) as response:
-                response_data = await response.json()
+    try:
+        async with graph_client.session.post(url, json=message_data, headers=headers) as response:
+            response_data = await response.json()
 
-                if response.status == 200:
-                    print(f"Test message sent successfully: {response_data}")
-                    return {"status": "success", "data": response_data}
-                else:
-                    print(f"Test message error. Status: {response.status}")
-                    print(f"Response: {response_data}")
-                    return {"status": "error", "code": response.status, "data": response_data}
+            if response.status == 200:
+                logger.info(f"Test message sent successfully: {response_data}")
+                return {"status": "success", "data": response_data}
+            else:
+                logger.error(f"Test message error. Status: {response.status}, response: {response_data}")
+                return {"status": "error", "code": response.status, "data": response_data}
 
-        except Exception as e:
-            print(f"Test endpoint error: {str(e)}")
-            return {"status": "error", "message": str(e)}
\ No newline at end of file
+    except asyncio.TimeoutError:
+        logger.error("Test endpoint error: request timed out")
+        return {"status": "error", "message": "Request timed out"}
+    except Exception as e:
+        logger.error(f"Test endpoint error: {str(e)}")
+        return {"status": "error", "message": str(e)}
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import logging
+from typing import Optional, Dict, Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Named sets of SQLite pragmas applied to every new connection.
+#   legacy  - SQLite defaults (rollback journal, synchronous=FULL): the original behaviour
+#   wal     - write-ahead log, fsync at checkpoints only; readers never block the writer
+#   durable - write-ahead log but still fsync on every commit
+STORAGE_PROFILES: Dict[str, Dict[str, Any]] = {
+    'legacy': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -20000,  # negative = KiB, so ~20 MB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -20000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Environment variables that override a single pragma of the chosen profile
+PRAGMA_OVERRIDES = {
+    'journal_mode': 'SQLITE_JOURNAL_MODE',
+    'synchronous': 'SQLITE_SYNCHRONOUS',
+    'busy_timeout': 'SQLITE_BUSY_TIMEOUT_MS',
+    'mmap_size': 'SQLITE_MMAP_SIZE',
+    'cache_size': 'SQLITE_CACHE_SIZE',
+    'temp_store': 'SQLITE_TEMP_STORE',
+}
+
+SQLITE_STORAGE_PROFILE = os.getenv("SQLITE_STORAGE_PROFILE", "wal")
+
+
+def storage_pragmas(profile: Optional[str] = None) -> Dict[str, Any]:
+    """Pragmas for `profile` (default SQLITE_STORAGE_PROFILE) with any SQLITE_* overrides applied"""
+    profile = profile or SQLITE_STORAGE_PROFILE
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(
+            f"Unknown SQLITE_STORAGE_PROFILE '{profile}', expected one of: {', '.join(STORAGE_PROFILES)}"
+        )
+    pragmas = dict(STORAGE_PROFILES[profile])
+    for pragma, env_var in PRAGMA_OVERRIDES.items():
+        value = os.getenv(env_var)
+        if value:
+            pragmas[pragma] = value
+    return pragmas
+
+
+def apply_storage_profile(engine: Engine, pragmas: Dict[str, Any]):
+    """
+    Run `pragmas` on every connection `engine` opens.
+
+    For an AsyncEngine pass `async_engine.sync_engine`; the aiosqlite
+    connection adapter accepts the same cursor calls.
+    """
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # journal_mode first: it cannot change inside a transaction
+            for pragma, value in sorted(pragmas.items(), key=lambda item: item[0] != 'journal_mode'):
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
+
+
+class LockErrorCounter:
+    """
+    Counts "database is locked" errors: statements that gave up after waiting
+    busy_timeout for another connection's write lock
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def watch(self, engine: Engine):
+        """Count lock errors raised on `engine` (for an AsyncEngine pass `async_engine.sync_engine`)"""
+
+        @event.listens_for(engine, "handle_error")
+        def count_lock_error(context):
+            if 'database is locked' in str(context.original_exception):
+                self.count += 1
+
+
+db_lock_errors = LockErrorCounter()
+
+
+def describe_storage(connection) -> Dict[str, Any]:
+    """The pragmas in effect on a live connection, for logs and stats"""
+    return {
+        pragma: connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+        for pragma in PRAGMA_OVERRIDES
+    }
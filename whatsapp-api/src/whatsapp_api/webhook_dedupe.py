@@ -0,0 +1,225 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Dict, Any, List, Set
+
+from .audit_writer import audit_writer
+
+logger = logging.getLogger(__name__)
+
+# Event keys remembered in memory; older keys are still found in webhook_event_keys
+WEBHOOK_DEDUPE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_SIZE", "100000"))
+# How long keys stay in webhook_event_keys (Meta stops redelivering after a few days)
+WEBHOOK_DEDUPE_KEEP_DAYS = float(os.getenv("WEBHOOK_DEDUPE_KEEP_DAYS", "7"))
+WEBHOOK_DEDUPE_PRUNE_INTERVAL = float(os.getenv("WEBHOOK_DEDUPE_PRUNE_INTERVAL", "3600"))
+
+
+class WebhookDeduplicator:
+    """
+    Drops webhook events that were already processed.
+
+    Meta redelivers a webhook whenever it did not see a quick 200, so the same
+    receipt can arrive several times. Every event has a stable key (see
+    StatusEvent.event_key and MessageEvent.event_key), checked before the
+    payload is resolved, logged or applied. A payload whose events were all
+    seen is dropped without touching the database; a partly seen one is
+    processed for its new events only.
+
+    Recent keys are kept in a bounded LRU set, warmed on startup from
+    webhook_event_keys. While the set holds every stored key (nothing has been
+    evicted) a key missing from it is new, and the check costs no query; after
+    an eviction, keys missing from memory are looked up in the table.
+
+    A claimed key is in progress until its payload is committed (the key joins
+    the recent set and is written to the table through the audit writer) or
+    forgotten because processing failed. A copy of the same event claimed
+    meanwhile waits for that outcome: it is dropped if the first copy was
+    committed and processed in its place if the first copy failed, so a
+    receipt is neither applied twice nor lost.
+
+    The set is per process: this relies on the app running as one process, as
+    the webhook queue and the guest index already do.
+    """
+
+    def __init__(
+        self,
+        max_size: int = WEBHOOK_DEDUPE_SIZE,
+        keep_days: float = WEBHOOK_DEDUPE_KEEP_DAYS,
+        prune_interval: float = WEBHOOK_DEDUPE_PRUNE_INTERVAL
+    ):
+        self.max_size = max_size
+        self.keep_days = keep_days
+        self.prune_interval = prune_interval
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        # Claimed keys whose payload is still being processed, set once it is committed or forgotten
+        self._in_progress: Dict[str, asyncio.Event] = {}
+        # True while _recent holds every key in webhook_event_keys
+        self._complete = False
+        self._task: Optional[asyncio.Task] = None
+        self.events_checked = 0
+        self.new_events = 0
+        self.duplicates_in_memory = 0
+        self.duplicates_in_database = 0
+        self.database_checks = 0
+        self.payloads_skipped = 0
+        self.released = 0
+        self.waits = 0
+        self.evictions = 0
+        self.pruned = 0
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    async def start(self):
+        """Load the most recent keys and start pruning old ones from webhook_event_keys"""
+        from .db_operations import WebhookEventKeyOperations
+
+        if self._task is not None:
+            return
+        keys = await WebhookEventKeyOperations.get_recent_keys(self.max_size + 1)
+        self._recent.clear()
+        for key in reversed(keys[:self.max_size]):
+            self._recent[key] = None
+        self._complete = len(keys) <= self.max_size
+        self._task = asyncio.create_task(self._prune_periodically(), name="webhook-dedupe-prune")
+        logger.info(
+            f"Webhook deduplication started with {len(self._recent)} recent event keys"
+            f"{'' if self._complete else ' (older keys are checked in the database)'}"
+        )
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def claim(self, keys: List[str]) -> Set[str]:
+        """
+        The keys not seen before, reserved for the caller, who processes only
+        their events and then calls commit() (or forget() if processing failed)
+
+        Waits while any of the keys is in progress for another caller. Nothing
+        is reserved while waiting, so two callers cannot wait on each other.
+        """
+        from .db_operations import WebhookEventKeyOperations
+
+        self.events_checked += len(keys)
+        keys = list(dict.fromkeys(keys))
+        while True:
+            busy = next((self._in_progress[key] for key in keys if key in self._in_progress), None)
+            if busy is None:
+                break
+            self.waits += 1
+            await busy.wait()
+
+        unseen = []
+        for key in keys:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                self.duplicates_in_memory += 1
+            else:
+                unseen.append(key)
+                self._in_progress[key] = asyncio.Event()
+        if not unseen or self._complete:
+            self.new_events += len(unseen)
+            return set(unseen)
+
+        self.database_checks += 1
+        try:
+            seen = await WebhookEventKeyOperations.find_seen(unseen)
+        except asyncio.CancelledError:
+            for key in unseen:
+                self._settle(key, processed=False)
+            raise
+        except Exception as e:
+            # Repeating work is harmless, losing a receipt is not
+            logger.warning(f"Webhook duplicate check failed, processing {len(unseen)} events anyway: {str(e)}")
+            seen = set()
+        for key in seen:
+            self._settle(key, processed=True)
+        self.duplicates_in_database += len(seen)
+        self.new_events += len(unseen) - len(seen)
+        return set(unseen) - seen
+
+    async def commit(self, keys: Set[str]):
+        """Store the keys of a processed payload"""
+        from .db_operations import WebhookEventKeyOperations, utcnow
+        from .db_models import WebhookEventKey
+
+        if not keys:
+            return
+        for key in keys:
+            self._settle(key, processed=True)
+        try:
+            if audit_writer.running:
+                received_at = utcnow()
+                for key in keys:
+                    await audit_writer.record(WebhookEventKey.__table__, {'event_key': key, 'received_at': received_at})
+            else:
+                await WebhookEventKeyOperations.add_keys(list(keys))
+        except Exception as e:
+            # The keys are still remembered in memory; only a redelivery after a restart would be applied again
+            logger.error(f"Error storing {len(keys)} webhook event keys: {str(e)}", exc_info=True)
+
+    def forget(self, keys: Set[str]):
+        """Give back claimed keys whose payload failed, so a waiting copy or a redelivery is processed"""
+        for key in keys:
+            self._settle(key, processed=False)
+        self.released += len(keys)
+
+    def skipped(self):
+        """Count a payload dropped because every event in it was a duplicate"""
+        self.payloads_skipped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "recent_keys": len(self._recent),
+            "in_progress": len(self._in_progress),
+            "max_size": self.max_size,
+            "complete": self._complete,
+            "events_checked": self.events_checked,
+            "new_events": self.new_events,
+            "duplicate_events": self.duplicates_in_memory + self.duplicates_in_database,
+            "duplicates_in_memory": self.duplicates_in_memory,
+            "duplicates_in_database": self.duplicates_in_database,
+            "database_checks": self.database_checks,
+            "payloads_skipped": self.payloads_skipped,
+            "released": self.released,
+            "waits": self.waits,
+            "evictions": self.evictions,
+            "pruned": self.pruned,
+        }
+
+    def _settle(self, key: str, processed: bool):
+        """End a claimed key's processing and wake the callers waiting on it"""
+        if processed:
+            self._remember(key)
+        event = self._in_progress.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _remember(self, key: str):
+        self._recent[key] = None
+        if len(self._recent) > self.max_size:
+            self._recent.popitem(last=False)
+            self.evictions += 1
+            self._complete = False
+
+    async def _prune_periodically(self):
+        from .db_operations import WebhookEventKeyOperations, utcnow
+
+        while True:
+            try:
+                pruned = await WebhookEventKeyOperations.prune(utcnow() - timedelta(days=self.keep_days))
+                self.pruned += pruned
+                if pruned:
+                    logger.info(f"Pruned {pruned} webhook event keys older than {self.keep_days} days")
+            except Exception as e:
+                logger.error(f"Error pruning webhook event keys: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.prune_interval)
+
+
+webhook_dedupe = WebhookDeduplicator()
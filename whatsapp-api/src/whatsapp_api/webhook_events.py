@@ -0,0 +1,150 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Set
+
+logger = logging.getLogger(__name__)
+
+# Quick-reply payload of the invite template's button
+INVITE_BUTTON_PAYLOAD = 'Send me the invite'
+
+
+@dataclass
+class StatusEvent:
+    """A delivery receipt (sent/delivered/read/failed) for a message we sent"""
+    message_id: str
+    status: str
+    timestamp: Optional[int] = None
+    recipient: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def event_key(self) -> str:
+        """Same for every delivery of this receipt (Meta redelivers unacknowledged webhooks)"""
+        return f"status:{self.message_id}:{self.status}:{self.timestamp}"
+
+
+@dataclass
+class MessageEvent:
+    """An incoming message from a guest"""
+    phone: str
+    type: str
+    timestamp: Optional[int] = None
+    message_id: Optional[str] = None
+    button_payload: Optional[str] = None
+
+    @property
+    def is_invite_request(self) -> bool:
+        return self.type == 'button' and self.button_payload == INVITE_BUTTON_PAYLOAD
+
+    @property
+    def event_key(self) -> Optional[str]:
+        return f"message:{self.message_id}" if self.message_id else None
+
+
+@dataclass
+class ParsedWebhook:
+    """Everything the webhook handlers need from one payload, read in a single pass"""
+    event_type: str = 'unknown'
+    statuses: List[StatusEvent] = field(default_factory=list)
+    messages: List[MessageEvent] = field(default_factory=list)
+
+    @property
+    def message_ids(self) -> Set[str]:
+        return {status.message_id for status in self.statuses}
+
+    @property
+    def phones(self) -> Set[str]:
+        return {message.phone for message in self.messages}
+
+    @property
+    def event_keys(self) -> List[str]:
+        """Keys of the events that have one (a message without an id has none)"""
+        keys = [status.event_key for status in self.statuses]
+        keys.extend(message.event_key for message in self.messages if message.event_key)
+        return keys
+
+    def only(self, keys: Set[str]) -> "ParsedWebhook":
+        """The same webhook with just the events in `keys` (and those without a key)"""
+        return ParsedWebhook(
+            event_type=self.event_type,
+            statuses=[status for status in self.statuses if status.event_key in keys],
+            messages=[message for message in self.messages if message.event_key is None or message.event_key in keys]
+        )
+
+
+@dataclass
+class GuestMatches:
+    """Guests referenced by a webhook payload, keyed the way the payload refers to them"""
+    by_message_id: Dict[str, int] = field(default_factory=dict)
+    by_phone: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def guest_ids(self) -> Set[int]:
+        return set(self.by_message_id.values()) | set(self.by_phone.values())
+
+    def audit_association(self) -> tuple[Optional[int], bool]:
+        """(guest_id, is_multiple) for the webhook_payloads row"""
+        guest_ids = self.guest_ids
+        if len(guest_ids) == 1:
+            return (next(iter(guest_ids)), False)
+        return (None, len(guest_ids) > 1)
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_error(status: Dict[str, Any]) -> Optional[str]:
+    errors = status.get('errors')
+    if not errors:
+        return None
+    first_error = errors[0]
+    return f"{first_error.get('code')}: {first_error.get('title') or first_error.get('message')}"
+
+
+def parse_webhook(payload: Dict[str, Any]) -> ParsedWebhook:
+    """
+    Walk a WhatsApp webhook payload once and return its typed events.
+
+    event_type follows the first change of the first entry, as the audit log
+    has always recorded it.
+    """
+    parsed = ParsedWebhook()
+    entries = payload.get('entry') or []
+    for entry_index, entry in enumerate(entries):
+        for change_index, change in enumerate(entry.get('changes', [])):
+            value = change.get('value', {})
+            statuses = value.get('statuses', [])
+            messages = value.get('messages', [])
+
+            if entry_index == 0 and change_index == 0:
+                if statuses:
+                    parsed.event_type = statuses[0].get('status', 'unknown_status')
+                elif messages:
+                    parsed.event_type = 'incoming_message'
+                elif 'contacts' in value:
+                    parsed.event_type = 'contact_update'
+
+            for status in statuses:
+                if status.get('id') and status.get('status'):
+                    parsed.statuses.append(StatusEvent(
+                        message_id=status['id'],
+                        status=status['status'],
+                        timestamp=_to_int(status.get('timestamp')),
+                        recipient=status.get('recipient_id'),
+                        error=_status_error(status)
+                    ))
+
+            for message in messages:
+                if message.get('from'):
+                    parsed.messages.append(MessageEvent(
+                        phone=message['from'],
+                        type=message.get('type', 'unknown'),
+                        timestamp=_to_int(message.get('timestamp')),
+                        message_id=message.get('id'),
+                        button_payload=message.get('button', {}).get('payload')
+                    ))
+    return parsed
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# Ingestion configuration
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_SHUTDOWN_DRAIN_SECONDS = float(os.getenv("WEBHOOK_SHUTDOWN_DRAIN_SECONDS", "10"))
+# Retry-After sent with 503 when the queue is full
+WEBHOOK_RETRY_AFTER_SECONDS = int(os.getenv("WEBHOOK_RETRY_AFTER_SECONDS", "5"))
+
+# Number of recent lag samples kept for percentiles
+LAG_SAMPLES = 1000
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of `samples`, or None when there are none"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class WebhookIngestQueue:
+    """
+    Bounded in-process queue between the webhook endpoint and the DB work.
+
+    The endpoint only parses the body and enqueues it, so Meta gets its 200
+    straight away. A pool of workers does the guest lookup, payload logging
+    and status updates. When the queue is full the endpoint answers 503 so
+    Meta redelivers the payload later instead of it being dropped.
+    """
+
+    def __init__(
+        self,
+        max_size: int = WEBHOOK_QUEUE_SIZE,
+        workers: int = WEBHOOK_WORKERS,
+        drain_seconds: float = WEBHOOK_SHUTDOWN_DRAIN_SECONDS
+    ):
+        self.max_size = max_size
+        self.worker_count = workers
+        self.drain_seconds = drain_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._accepting = False
+        self._lags_ms: deque = deque(maxlen=LAG_SAMPLES)
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    async def start(self):
+        """Start the worker pool"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"webhook-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+        self._accepting = True
+        logger.info(f"Webhook queue started (max_size={self.max_size}, workers={self.worker_count})")
+
+    async def stop(self):
+        """Stop accepting payloads and give the workers time to finish the backlog"""
+        self._accepting = False
+        if self._queue is not None and not self._queue.empty():
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.drain_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Webhook queue stopped with {self._queue.qsize()} payloads unprocessed")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Webhook queue stopped")
+
+    def submit(self, payload: Dict[str, Any], headers: Dict[str, Any]) -> bool:
+        """Enqueue a payload without waiting. Returns False when the queue is full (shed load)."""
+        try:
+            self._queue.put_nowait((time.monotonic(), payload, headers))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Webhook queue full ({self.max_size}); asking for redelivery")
+            return False
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, throughput counters and enqueue-to-processing lag"""
+        lags = list(self._lags_ms)
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "max_size": self.max_size,
+            "max_depth": self.max_depth,
+            "workers": len(self._workers),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "errors": self.errors,
+            "lag_ms_p50": percentile(lags, 0.50),
+            "lag_ms_p99": percentile(lags, 0.99),
+            "lag_ms_max": max(lags) if lags else None,
+        }
+
+    async def _worker(self):
+        from .rest.whatsapp import process_webhook_payload
+
+        while True:
+            enqueued_at, payload, headers = await self._queue.get()
+            self._lags_ms.append((time.monotonic() - enqueued_at) * 1000)
+            try:
+                await process_webhook_payload(payload, headers)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error processing queued webhook: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+
+webhook_queue = WebhookIngestQueue()
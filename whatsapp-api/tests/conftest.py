@@ -0,0 +1,17 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# The engines are created at import time, so point them at a scratch database
+# before any test imports the application.
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="whatsapp-api-tests-")
+os.environ["WEDDING_DB_PATH"] = os.path.join(_TEST_DB_DIR, "wedding.db")
+atexit.register(shutil.rmtree, _TEST_DB_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,131 @@
+"""
+Audit storage: compressed text columns read back exactly what was written,
+the header-set cache keeps the most recently used sets, and the retention
+job's gzip archive holds every row it deletes.
+"""
+import gzip
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import orjson
+import pytest
+from sqlalchemy import delete, insert, select, text
+
+from src.whatsapp_api.audit_retention import AuditRetention
+from src.whatsapp_api.compression import DEFLATE_DICT_V1, RAW, compact_json, decompress_text
+from src.whatsapp_api.db_models import AuditHeaders, WebhookPayload
+from src.whatsapp_api.db_operations import AuditHeaderOperations, engine, init_database
+
+RECEIPT = {
+    "object": "whatsapp_business_account",
+    "entry": [{"id": "1234", "changes": [{"field": "messages", "value": {
+        "messaging_product": "whatsapp", "statuses": [
+            {"id": "wamid.abc", "status": "delivered", "timestamp": "1700000005", "recipient_id": "971500000001"}
+        ]}}]}]
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_audit_tables():
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(WebhookPayload))
+
+
+def stored(payload_id: int):
+    """(value read through CompressedText, raw value in SQLite)"""
+    with engine.connect() as conn:
+        value = conn.execute(select(WebhookPayload.payload).where(WebhookPayload.id == payload_id)).scalar_one()
+        raw = conn.execute(text("SELECT payload FROM webhook_payloads WHERE id = :id"), {"id": payload_id}).scalar_one()
+    return value, raw
+
+
+def write_payload(payload, **values) -> int:
+    with engine.begin() as conn:
+        return conn.execute(insert(WebhookPayload).values(payload=payload, **values)).inserted_primary_key[0]
+
+
+@pytest.mark.parametrize("payload, format_byte", [
+    (compact_json(RECEIPT).decode(), DEFLATE_DICT_V1),
+    (compact_json(RECEIPT), DEFLATE_DICT_V1),  # bytes are stored as their UTF-8 text
+    ('{"name":"Zoë 🎉 नमस्ते"}' * 20, DEFLATE_DICT_V1),
+    ('x', RAW),  # too short to compress
+    ('', RAW),
+])
+def test_compressed_text_round_trip(payload, format_byte):
+    value, raw = stored(write_payload(payload))
+    assert value == (payload.decode() if isinstance(payload, bytes) else payload)
+    assert raw[:1] == format_byte
+
+
+def test_receipts_are_stored_much_smaller():
+    payload = compact_json(RECEIPT)
+    _, raw = stored(write_payload(payload))
+    assert len(raw) * 3 < len(payload)
+
+
+def test_text_stored_before_compression_reads_unchanged():
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO webhook_payloads (payload) VALUES (:payload)"), {"payload": '{"legacy":true}'})
+        payload_id = conn.execute(text("SELECT max(id) FROM webhook_payloads")).scalar_one()
+    assert stored(payload_id)[0] == '{"legacy":true}'
+    assert decompress_text(None) is None
+    with pytest.raises(ValueError):
+        decompress_text(b'\x7fnot a format')
+
+
+@pytest.mark.anyio
+async def test_header_cache_keeps_recently_used_sets(monkeypatch):
+    monkeypatch.setattr("src.whatsapp_api.db_operations.AUDIT_HEADER_CACHE_SIZE", 2)
+    monkeypatch.setattr(AuditHeaderOperations, "_ids", OrderedDict())
+    first, second, third = (orjson.dumps({"X-Set": str(i)}) for i in range(3))
+
+    first_id = await AuditHeaderOperations.intern(first)
+    await AuditHeaderOperations.intern(second)
+    assert await AuditHeaderOperations.intern(first) == first_id  # now the most recent
+    await AuditHeaderOperations.intern(third)
+
+    cached = set(AuditHeaderOperations._ids.values())
+    assert len(cached) == 2 and first_id in cached
+    # An evicted set is looked up again and keeps its id
+    second_id = await AuditHeaderOperations.intern(second)
+    with engine.connect() as conn:
+        assert conn.execute(select(AuditHeaders.headers).where(AuditHeaders.id == second_id)).scalar_one() \
+            == second.decode()
+
+
+@pytest.mark.anyio
+async def test_retention_archive_holds_every_deleted_row(tmp_path):
+    headers = orjson.dumps({"Content-Type": "application/json"}, option=orjson.OPT_SORT_KEYS)
+    headers_id = await AuditHeaderOperations.intern(headers)
+    now = datetime(2026, 6, 1)
+    old = [
+        write_payload(compact_json({**RECEIPT, "n": i}), event_type='delivered', headers_id=headers_id,
+                      timestamp=now - timedelta(days=30, minutes=i))
+        for i in range(5)
+    ]
+    # Written before headers_id existed: headers kept on the row, as plain text
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO webhook_payloads (timestamp, event_type, payload, headers) "
+            "VALUES (:timestamp, 'read', :payload, :headers)"
+        ), {"timestamp": now - timedelta(days=40), "payload": '{"legacy":true}', "headers": '{"X-Old":"1"}'})
+    recent = write_payload(compact_json(RECEIPT), headers_id=headers_id, timestamp=now - timedelta(hours=1))
+
+    retention = AuditRetention(days=7, archive_dir=str(tmp_path), batch_size=2, batch_pause=0)
+    moved = await retention.run_once(now=now)
+    assert moved["webhook_payloads"] == 6
+
+    [archive] = tmp_path.glob("webhook_payloads-*.jsonl.gz")
+    # One gzip member per batch, read back as a single file
+    with open(archive, 'rb') as raw:
+        assert raw.read().count(b'\x1f\x8b\x08') >= 3
+    records = [orjson.loads(line) for line in gzip.decompress(archive.read_bytes()).splitlines()]
+    assert [record["event_type"] for record in records] == ['read'] + ['delivered'] * 5
+    assert records[0]["payload"] == {"legacy": True} and records[0]["headers"] == {"X-Old": "1"}
+    assert sorted(record["payload"]["n"] for record in records[1:]) == list(range(5))
+    assert all(record["headers"] == {"Content-Type": "application/json"} for record in records[1:])
+    assert {record["id"] for record in records[1:]} == set(old)
+
+    with engine.connect() as conn:
+        assert list(conn.execute(select(WebhookPayload.id)).scalars()) == [recent]
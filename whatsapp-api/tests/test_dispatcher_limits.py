@@ -0,0 +1,100 @@
+"""
+Invite rate limiting and retry decisions: the token bucket's burst, refill
+and pause, Retry-After parsing, backoff, and which send failures are retried.
+"""
+import asyncio
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.whatsapp_api.dispatcher import InviteDispatcher, TokenBucket, is_retryable, parse_retry_after
+
+
+async def timed_acquires(bucket: TokenBucket, count: int) -> float:
+    started = time.monotonic()
+    for _ in range(count):
+        await bucket.acquire()
+    return time.monotonic() - started
+
+
+@pytest.mark.anyio
+async def test_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=20, capacity=5)
+    assert await timed_acquires(bucket, 5) < 0.03
+    # Empty: each further token takes 1/rate
+    assert 0.09 <= await timed_acquires(bucket, 2) < 0.2
+
+
+@pytest.mark.anyio
+async def test_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=100, capacity=3)
+    await timed_acquires(bucket, 3)
+    await asyncio.sleep(0.1)  # enough for 10 tokens, but only 3 fit
+    assert await timed_acquires(bucket, 3) < 0.02
+    assert await timed_acquires(bucket, 1) >= 0.005
+
+
+@pytest.mark.anyio
+async def test_paused_bucket_hands_out_nothing():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    bucket.pause_for(0.2)
+    bucket.pause_for(0.05)  # a shorter pause does not cut the longer one short
+    assert 0.19 <= await timed_acquires(bucket, 1) < 0.4
+
+
+def test_retry_after_in_seconds():
+    assert parse_retry_after("30") == 30.0
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after("-5") == 0.0
+
+
+def test_retry_after_as_http_date():
+    later = datetime.now(timezone.utc) + timedelta(seconds=120)
+    assert 115 <= parse_retry_after(format_datetime(later, usegmt=True)) <= 120
+    earlier = datetime.now(timezone.utc) - timedelta(seconds=60)
+    assert parse_retry_after(format_datetime(earlier, usegmt=True)) == 0.0
+
+
+@pytest.mark.parametrize("value", [None, "", "soon", "Mon, 99 Foo 2024"])
+def test_unusable_retry_after(value):
+    assert parse_retry_after(value) is None
+
+
+def graph_error(status: int, code: int) -> dict:
+    return {"status": "error", "code": status, "data": {"error": {"code": code, "message": "..."}}}
+
+
+@pytest.mark.parametrize("result", [
+    {"status": "error", "code": 429, "data": {}},
+    {"status": "error", "code": 503, "data": None},
+    graph_error(400, 4),         # application request limit
+    graph_error(400, 80007),     # business account rate limit
+    graph_error(400, 130429),    # throughput reached
+    graph_error(500, 131000),
+    graph_error(400, 133004),    # server temporarily unavailable
+    {"status": "error", "message": "Connection error: refused", "error_type": "connection"},
+])
+def test_retryable_failures(result):
+    assert is_retryable(result)
+
+
+@pytest.mark.parametrize("result", [
+    {"status": "success", "data": {"messages": [{"id": "wamid.x"}]}},
+    graph_error(400, 131026),    # message undeliverable
+    graph_error(400, 132001),    # template does not exist
+    graph_error(401, 190),       # access token expired
+    # The message may have been accepted before the timeout; sending again could duplicate it
+    {"status": "error", "message": "Timeout error", "error_type": "timeout"},
+    {"status": "error", "message": "Unexpected error: boom", "error_type": "unexpected"},
+])
+def test_terminal_failures(result):
+    assert not is_retryable(result)
+
+
+def test_backoff_grows_to_its_cap_and_honours_retry_after():
+    dispatcher = InviteDispatcher(backoff_base=1.0, backoff_max=8.0)
+    for attempt, ceiling in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (10, 8.0)]:
+        assert all(0 <= dispatcher.backoff_delay(attempt) <= ceiling for _ in range(50))
+    assert dispatcher.backoff_delay(1, retry_after=30.0) == 30.0
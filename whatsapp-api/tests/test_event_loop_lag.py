@@ -0,0 +1,112 @@
+"""
+Loading a large guest list must not stall the event loop: webhooks that arrive
+while the whole list is paged through GET /api/guests should be acknowledged as fast as before it.
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+from sqlalchemy import delete, insert
+
+from src.whatsapp_api.db_models import Guest
+from src.whatsapp_api.db_operations import engine
+from src.whatsapp_api.main import app, lifespan
+from src.whatsapp_api.webhook_queue import percentile
+
+GUESTS = 20000
+# Largest page the API serves
+PAGE_SIZE = 5000
+WEBHOOK_INTERVAL = 0.005
+# Worst case allowed while the guest list is loading. Loading and encoding are
+# chunked, so what remains is mostly garbage-collector pauses; a handler that
+# blocks the loop for the whole query takes around a second here.
+MAX_LOOP_LAG_MS = 250
+MAX_WEBHOOK_LATENCY_MS = 250
+
+STATUS_PAYLOAD = {
+    "object": "whatsapp_business_account",
+    "entry": [{"changes": [{"value": {"statuses": [
+        {"id": "wamid.unknown", "status": "delivered", "timestamp": "1700000000"}
+    ]}}]}]
+}
+
+
+def seed_guests(count: int):
+    with engine.begin() as conn:
+        conn.execute(delete(Guest))
+        conn.execute(insert(Guest), [
+            {
+                'first_name': f'Guest{i}',
+                'last_name': 'Lag',
+                'phone': f'9715{i:08d}',
+                'group_id': f'group-{i // 4}',
+                'is_group_primary': i % 4 == 0,
+                'ready': False,
+                'sent_to_whatsapp': 'pending',
+            }
+            for i in range(count)
+        ])
+
+
+async def post_webhooks(client: httpx.AsyncClient, stop: asyncio.Event) -> list:
+    """
+    Send a webhook every WEBHOOK_INTERVAL and time each one from when it was
+    due, so time spent waiting for a blocked loop to start it is counted too
+    """
+    latencies = []
+    due = time.perf_counter()
+    while True:
+        response = await client.post("/whatsapp/webhook", json=STATUS_PAYLOAD)
+        latencies.append((time.perf_counter() - due) * 1000)
+        assert response.status_code == 200
+        if stop.is_set():
+            return latencies
+        due = max(due + WEBHOOK_INTERVAL, time.perf_counter())
+        await asyncio.sleep(due - time.perf_counter())
+
+
+async def measure_lag(stop: asyncio.Event) -> list:
+    """How late the loop runs a 1 ms timer"""
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append((time.perf_counter() - started) * 1000 - 1)
+    return lags
+
+
+@pytest.mark.anyio
+async def test_webhooks_stay_fast_while_guest_list_loads():
+    async with lifespan(app):
+        seed_guests(GUESTS)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            stop = asyncio.Event()
+            webhooks = asyncio.create_task(post_webhooks(client, stop))
+            lag = asyncio.create_task(measure_lag(stop))
+            await asyncio.sleep(0.1)
+
+            pages = []
+            cursor = None
+            while True:
+                params = {"limit": PAGE_SIZE, **({"cursor": cursor} if cursor else {})}
+                response = await client.get("/api/guests", params=params)
+                assert response.status_code == 200
+                pages.append(response)
+                cursor = response.json()["next_cursor"]
+                if not cursor:
+                    break
+
+            stop.set()
+            latencies = await webhooks
+            lags = await lag
+
+    assert sum(len(page.json()["guests"]) for page in pages) == GUESTS
+
+    summary = (
+        f"webhook p50={percentile(latencies, 0.5):.1f}ms max={max(latencies):.1f}ms, "
+        f"loop lag p99={percentile(lags, 0.99):.1f}ms max={max(lags):.1f}ms"
+    )
+    assert max(lags) < MAX_LOOP_LAG_MS, summary
+    assert max(latencies) < MAX_WEBHOOK_LATENCY_MS, summary
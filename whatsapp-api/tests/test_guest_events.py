@@ -0,0 +1,150 @@
+"""
+Guest change events: the per-subscriber queues with their resync on overflow,
+keep-alives and shutdown, and large changes being announced as a resync
+instead of a message carrying every row.
+"""
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import delete, insert
+
+from src.whatsapp_api.db_models import Guest, OutboxJob
+from src.whatsapp_api.db_operations import engine, init_database
+from src.whatsapp_api.guest_events import SSE_MAX_EVENT_GUESTS, GuestEventHub, guest_events
+from src.whatsapp_api.main import app
+
+# Over SQLite's 32766 bound-parameter limit, had the rows been looked up
+MANY_GUESTS = 40000
+
+
+def seed_guests(count: int):
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        conn.execute(insert(Guest), [
+            {
+                'first_name': f'Guest{i}',
+                'last_name': 'Events',
+                'phone': f'9715{i:08d}',
+                'group_id': f'group-{i // 4}',
+                'is_group_primary': i % 4 == 0,
+                'ready': False,
+                'sent_to_whatsapp': 'pending',
+            }
+            for i in range(count)
+        ])
+
+
+async def patch_ready(body: dict) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        response = await client.patch("/api/guests", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.anyio
+async def test_filter_wide_ready_update_sends_resync():
+    seed_guests(MANY_GUESTS)
+    subscriber = guest_events.subscribe()
+    try:
+        result = await patch_ready({"ready": True, "filter": {}})
+        assert result["updated"] == MANY_GUESTS
+
+        message = await guest_events.next_message(subscriber, timeout=1)
+        assert "event: resync" in message
+        assert subscriber.queue.empty()
+    finally:
+        guest_events.unsubscribe(subscriber)
+
+
+@pytest.mark.anyio
+async def test_small_ready_update_sends_the_rows():
+    seed_guests(SSE_MAX_EVENT_GUESTS)
+    subscriber = guest_events.subscribe()
+    try:
+        result = await patch_ready({"ready": True, "group_ids": ["group-0"]})
+        assert result["updated"] == 4
+
+        message = await guest_events.next_message(subscriber, timeout=1)
+        assert "event: guests" in message
+        assert message.count('"ready":true') == 4
+    finally:
+        guest_events.unsubscribe(subscriber)
+
+
+def small_hub(queue_size: int = 3) -> GuestEventHub:
+    return GuestEventHub(queue_size=queue_size, max_subscribers=2)
+
+
+async def drain(hub: GuestEventHub, subscriber) -> list:
+    messages = []
+    while not subscriber.queue.empty():
+        messages.append(await hub.next_message(subscriber, timeout=0.1))
+    return messages
+
+
+@pytest.mark.anyio
+async def test_slow_subscriber_gets_one_resync_instead_of_a_backlog():
+    hub = small_hub(queue_size=3)
+    slow, fast = hub.subscribe(), hub.subscribe()
+
+    for i in range(3):
+        hub.publish("guests", {"guests": [{"id": i}]})
+    assert len(await drain(hub, fast)) == 3
+    # The slow subscriber's queue is full: the next event replaces its backlog with a resync
+    hub.publish("guests", {"guests": [{"id": 3}]})
+    assert slow.needs_resync and slow.queue.qsize() == 1
+    assert hub.resyncs == 1
+
+    # While the resync is unread, further events are skipped for the slow subscriber only
+    hub.publish("guests", {"guests": [{"id": 4}]})
+    hub.publish("guests", {"guests": [{"id": 5}]})
+    assert slow.queue.qsize() == 1
+    assert len(await drain(hub, fast)) == 3
+
+    [resync] = await drain(hub, slow)
+    assert "event: resync" in resync
+    assert not slow.needs_resync and hub.resyncs == 1
+
+    # Once it has read the resync it gets events again
+    hub.publish("guests", {"guests": [{"id": 6}]})
+    [message] = await drain(hub, slow)
+    assert '"id":6' in message and "event: guests" in message
+
+
+@pytest.mark.anyio
+async def test_idle_stream_gets_keepalive():
+    hub = small_hub()
+    subscriber = hub.subscribe()
+    assert await hub.next_message(subscriber, timeout=0.01) == ": keepalive\n\n"
+    hub.publish("guests", {"guests": []})
+    assert "event: guests" in await hub.next_message(subscriber, timeout=0.01)
+
+
+@pytest.mark.anyio
+async def test_subscriber_limit():
+    hub = small_hub()
+    first, second = hub.subscribe(), hub.subscribe()
+    assert hub.subscribe() is None
+    hub.unsubscribe(first)
+    assert hub.subscribe() is not None
+    assert hub.stats()["subscribers"] == 2 and second is not None
+
+
+@pytest.mark.anyio
+async def test_close_ends_every_stream_even_with_a_full_queue():
+    hub = small_hub(queue_size=2)
+    full, waiting = hub.subscribe(), hub.subscribe()
+    hub.publish("guests", {"guests": []})
+    hub.publish("guests", {"guests": []})
+    await drain(hub, waiting)
+
+    reader = asyncio.create_task(hub.next_message(waiting, timeout=10))
+    await asyncio.sleep(0)
+    hub.close()
+    # Pending events are dropped so the close marker always fits
+    assert await hub.next_message(full, timeout=0.1) is None
+    assert await asyncio.wait_for(reader, timeout=1) is None
@@ -0,0 +1,125 @@
+"""
+Bulk guest import: quoted CSV fields spanning lines, duplicate phones, the
+group rules in file order, and a partly rejected file reporting every bad
+row while the good rows are created.
+"""
+import httpx
+import pytest
+from sqlalchemy import delete, insert, select
+
+from src.whatsapp_api.db_models import Guest, OutboxJob
+from src.whatsapp_api.db_operations import engine, init_database
+from src.whatsapp_api.main import app
+
+HEADER = "first_name,last_name,phone,group_id,is_group_primary\n"
+
+
+@pytest.fixture(autouse=True)
+def existing_guest():
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        conn.execute(insert(Guest).values(
+            first_name='Existing', last_name='Guest', phone='971500000001', group_id='existing',
+            is_group_primary=True, sent_to_whatsapp='pending'
+        ))
+
+
+async def post(path: str, content=None, json=None, content_type: str = "text/csv") -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        if json is not None:
+            return await client.post(path, json=json)
+        return await client.post(path, content=content, headers={"Content-Type": content_type})
+
+
+async def import_csv(body: str) -> dict:
+    response = await post("/api/guests/import", content=(HEADER + body).encode())
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def imported_guests() -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(select(Guest.first_name, Guest.last_name, Guest.phone).where(Guest.first_name != 'Existing'))
+        return {row.first_name: row for row in rows}
+
+
+@pytest.mark.anyio
+async def test_quoted_field_spanning_lines():
+    report = await import_csv(
+        'Asha,"Rao\nof Pune",971500000010,rao,true\n'
+        'Ravi,Rao,971500000011,rao,false\n'
+        'Bad,Row,971500000012\n'
+    )
+
+    assert report["rows"] == 3 and report["created"] == 2
+    # Line numbers count the header, and the quoted field moves the next row down
+    assert report["errors"] == [{"line": 5, "error": "Expected 5 columns, got 3"}]
+    assert imported_guests()["Asha"].last_name == "Rao\nof Pune"
+
+
+@pytest.mark.anyio
+async def test_duplicate_phones_are_rejected():
+    report = await import_csv(
+        'Asha,Rao,971500000010,rao,true\n'
+        'Ravi,Rao,971500000001,rao,false\n'
+        'Mira,Rao,971500000010,rao,false\n'
+    )
+
+    assert report["created"] == 1
+    assert report["errors"] == [
+        {"line": 3, "error": "Phone number already exists for another guest"},
+        {"line": 4, "error": "Phone number appears earlier in the import"},
+    ]
+
+
+@pytest.mark.anyio
+async def test_group_rules_follow_file_order():
+    report = await import_csv(
+        'Ravi,Rao,971500000011,rao,false\n'
+        'Asha,Rao,971500000010,rao,true\n'
+        'Mira,Rao,971500000012,rao,false\n'
+        'Second,Primary,971500000013,rao,true\n'
+        'Joins,Existing,971500000014,existing,false\n'
+    )
+
+    assert report["errors"] == [
+        {"line": 2, "error": "First member of a group must be the primary contact"},
+        {"line": 5, "error": "Group already has a primary contact"},
+    ]
+    assert set(imported_guests()) == {"Asha", "Mira", "Joins"}
+
+
+@pytest.mark.anyio
+async def test_partly_rejected_import_across_batches(monkeypatch):
+    monkeypatch.setattr("src.whatsapp_api.guest_import.GUEST_IMPORT_BATCH_SIZE", 2)
+    body = (
+        '{"first_name": "Asha", "last_name": "Rao", "phone": "971500000010", "group_id": "rao", "is_group_primary": true}\n'
+        '{"first_name": "NoPhone", "last_name": "Primary", "group_id": "solo", "is_group_primary": true}\n'
+        'not json\n'
+        '{"first_name": "", "last_name": "Rao", "phone": "971500000011", "group_id": "rao", "is_group_primary": false}\n'
+        '{"first_name": "Ravi", "last_name": "Rao", "phone": "971500000012", "group_id": "rao", "is_group_primary": false}\n'
+        '{"first_name": "Mira", "last_name": "Rao", "group_id": "rao", "is_group_primary": false}\n'
+        '{"first_name": "Copy", "last_name": "Rao", "phone": "971500000010", "group_id": "rao", "is_group_primary": false}\n'
+    )
+    response = await post("/api/guests/import", content=body.encode(), content_type="application/x-ndjson")
+    assert response.status_code == 200, response.text
+    report = response.json()
+
+    assert report["rows"] == 7 and report["created"] == 3 and report["failed"] == 4
+    assert [error["line"] for error in report["errors"]] == [2, 3, 4, 7]
+    assert report["errors"][0]["error"] == "phone: Phone is required for primary contacts"
+    # Asha was inserted with the first batch, so the second batch finds her phone in the table
+    assert report["errors"][3]["error"] == "Phone number already exists for another guest"
+    assert set(imported_guests()) == {"Asha", "Ravi", "Mira"}
+
+
+@pytest.mark.anyio
+async def test_single_create_keeps_accepting_a_primary_without_phone():
+    # The phone rule is enforced by the import only
+    response = await post("/api/guests", json={
+        "first_name": "NoPhone", "last_name": "Primary", "group_id": "solo", "is_group_primary": True
+    })
+    assert response.status_code == 201, response.text
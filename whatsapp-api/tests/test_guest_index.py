@@ -0,0 +1,58 @@
+"""
+The in-memory guest index: least recently used keys are evicted first,
+invalidation drops every key of a guest, and a key moving to another guest
+leaves no empty bookkeeping behind.
+"""
+from src.whatsapp_api.guest_index import GuestIndex
+
+
+def lookup(index: GuestIndex, message_ids=(), phones=()):
+    matches, _, _ = index.lookup(message_ids, phones)
+    return {**matches.by_message_id, **matches.by_phone}
+
+
+def test_least_recently_used_key_is_evicted():
+    index = GuestIndex(max_size=3)
+    index.put_message_id("wamid.1", 1)
+    index.put_message_id("wamid.2", 2)
+    index.put_phone("+971 50 000 0003", 3)
+    assert lookup(index, ["wamid.1"]) == {"wamid.1": 1}  # now the most recent
+
+    index.put_message_id("wamid.4", 4)
+    assert len(index) == 3 and index.stats()["evictions"] == 1
+    assert lookup(index, ["wamid.1", "wamid.2", "wamid.4"]) == {"wamid.1": 1, "wamid.4": 4}
+    assert lookup(index, phones=["971500000003"]) == {"971500000003": 3}
+    # Guest 2 had only the evicted key
+    assert 2 not in index._keys_by_guest
+
+
+def test_invalidate_drops_every_key_of_the_guest():
+    index = GuestIndex(max_size=10)
+    index.put_message_id("wamid.1", 1)
+    index.put_phone("971500000001", 1)
+    index.put_message_id("wamid.2", 2)
+
+    index.invalidate_guest(1)
+    assert lookup(index, ["wamid.1", "wamid.2"], ["971500000001"]) == {"wamid.2": 2}
+    assert set(index._keys_by_guest) == {2}
+    index.invalidate_guest(99)  # unknown guests are ignored
+
+
+def test_new_message_id_replaces_the_old_one():
+    index = GuestIndex(max_size=10)
+    index.put_message_id("wamid.first", 1)
+    index.put_message_id("wamid.second", 1)
+    assert lookup(index, ["wamid.first", "wamid.second"]) == {"wamid.second": 1}
+    assert len(index) == 1
+
+
+def test_key_moving_to_another_guest_leaves_no_empty_set():
+    index = GuestIndex(max_size=10)
+    index.put_phone("971500000001", 1)
+    # The phone now belongs to guest 2 (guest 1 was deleted and the number reused)
+    index.put_phone("+971500000001", 2)
+
+    assert lookup(index, phones=["971500000001"]) == {"971500000001": 2}
+    assert set(index._keys_by_guest) == {2}
+    index.clear()
+    assert len(index) == 0 and index._keys_by_guest == {}
@@ -0,0 +1,113 @@
+"""
+GET /api/guests: conditional requests answered with 304, delta syncs with
+since= listing changed and deleted guests, and cursors that page through the
+list exactly once while guests are being added.
+"""
+from datetime import datetime
+
+import httpx
+import pytest
+from sqlalchemy import delete, insert
+
+from src.whatsapp_api.db_models import Guest, GuestTombstone, OutboxJob
+from src.whatsapp_api.db_operations import engine, init_database
+from src.whatsapp_api.main import app
+
+# Seeded guests last changed long before any sync token a test takes
+SEEDED_AT = datetime(2024, 1, 1)
+
+
+def guest_row(i: int, group_id: str) -> dict:
+    return {
+        'first_name': f'Guest{i}', 'last_name': 'List', 'phone': f'9716{i:08d}', 'group_id': group_id,
+        'is_group_primary': True, 'sent_to_whatsapp': 'pending', 'updated_at': SEEDED_AT,
+    }
+
+
+def add_guests(*rows: dict) -> list:
+    with engine.begin() as conn:
+        return [conn.execute(insert(Guest).values(**row)).inserted_primary_key[0] for row in rows]
+
+
+@pytest.fixture
+def guest_ids() -> list:
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        conn.execute(delete(GuestTombstone))
+    return add_guests(*(guest_row(i, f'group-{i:02d}') for i in range(10)))
+
+
+async def request(method: str, path: str, **kwargs) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.request(method, path, **kwargs)
+
+
+@pytest.mark.anyio
+async def test_unchanged_list_answers_304(guest_ids):
+    first = await request("GET", "/api/guests", params={"limit": 5})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert set(first.json()) == {"guests", "next_cursor", "sync_token"}
+
+    again = await request("GET", "/api/guests", params={"limit": 5}, headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b"" and again.headers["ETag"] == etag
+    # The ETag belongs to one URL
+    other = await request("GET", "/api/guests", params={"limit": 6}, headers={"If-None-Match": etag})
+    assert other.status_code == 200
+
+    response = await request("PATCH", f"/api/guests/{guest_ids[0]}", json={"ready": True})
+    assert response.status_code == 200
+    changed = await request("GET", "/api/guests", params={"limit": 5}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+
+@pytest.mark.anyio
+async def test_delta_sync_lists_changes_and_deletions(guest_ids):
+    await request("PATCH", f"/api/guests/{guest_ids[0]}", json={"ready": True})
+    sync_token = (await request("GET", "/api/guests")).json()["sync_token"]
+
+    await request("PATCH", f"/api/guests/{guest_ids[3]}", json={"ready": True})
+    with engine.begin() as conn:
+        conn.execute(delete(Guest).where(Guest.id.in_(guest_ids[5:7])))
+
+    delta = (await request("GET", "/api/guests", params={"since": sync_token})).json()
+    # Guests changed within GUEST_SYNC_OVERLAP_SECONDS before the token are sent again
+    assert [guest["id"] for guest in delta["guests"]] == [guest_ids[0], guest_ids[3]]
+    assert all(guest["ready"] for guest in delta["guests"])
+    assert delta["deleted"] == guest_ids[5:7]
+    assert delta["next_cursor"] is None
+
+    # No deletions since the new token, and none of the untouched guests
+    again = (await request("GET", "/api/guests", params={"since": delta["sync_token"]})).json()
+    assert again["deleted"] == []
+    assert {guest["id"] for guest in again["guests"]} <= {guest_ids[0], guest_ids[3]}
+
+
+@pytest.mark.anyio
+async def test_bad_tokens_are_rejected(guest_ids):
+    assert (await request("GET", "/api/guests", params={"since": "not-a-token"})).status_code == 400
+    assert (await request("GET", "/api/guests", params={"cursor": "not-a-cursor"})).status_code == 400
+
+
+@pytest.mark.anyio
+async def test_cursor_pages_are_stable_while_guests_are_added(guest_ids):
+    seen = []
+    params = {"limit": 3, "fields": "id,group_id"}
+    page = (await request("GET", "/api/guests", params=params)).json()
+    added = 0
+    while True:
+        seen.extend(guest["id"] for guest in page["guests"])
+        if page["next_cursor"] is None:
+            break
+        # Guests added before and after the cursor between two pages
+        added += 1
+        early, late = add_guests(guest_row(100 + added, f'early-{added}'), guest_row(200 + added, f'zz-{added}'))
+        page = (await request("GET", "/api/guests", params={**params, "cursor": page["next_cursor"]})).json()
+
+    assert len(seen) == len(set(seen))
+    # Every original guest once, in order, plus each guest added after the cursor
+    assert [guest_id for guest_id in seen if guest_id in guest_ids] == guest_ids
+    assert len(seen) == len(guest_ids) + added and late in seen and early not in seen
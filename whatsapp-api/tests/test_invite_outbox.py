@@ -0,0 +1,329 @@
+"""
+The invite outbox state machine: queueing and re-arming jobs, claims and
+leases, retryable versus terminal send failures, and restarts, checked
+through the outbox operations and a dispatcher whose Graph API send is faked.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import delete, insert, select, update
+
+from src.whatsapp_api.db_models import Guest, OutboxJob
+from src.whatsapp_api.db_operations import OutboxOperations, engine, init_database
+from src.whatsapp_api.dispatcher import InviteDispatcher
+from src.whatsapp_api.guest_events import SSE_MAX_EVENT_GUESTS, guest_events
+
+
+def seed_ready_guests(count: int):
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        conn.execute(insert(Guest), [
+            {
+                'first_name': f'Guest{i}',
+                'last_name': 'Outbox',
+                'phone': f'9715{i:08d}',
+                'group_id': f'group-{i}',
+                'is_group_primary': True,
+                'ready': True,
+                'sent_to_whatsapp': 'pending',
+            }
+            for i in range(count)
+        ])
+
+
+@pytest.mark.anyio
+async def test_queueing_many_guests_sends_resync():
+    seed_ready_guests(SSE_MAX_EVENT_GUESTS + 1)
+    dispatcher = InviteDispatcher()
+    dispatcher._wake = asyncio.Event()  # enqueue only; no feeder or workers
+    subscriber = guest_events.subscribe()
+    try:
+        assert await dispatcher.enqueue_ready_guests() == SSE_MAX_EVENT_GUESTS + 1
+
+        message = await guest_events.next_message(subscriber, timeout=1)
+        assert "event: resync" in message
+    finally:
+        guest_events.unsubscribe(subscriber)
+
+
+class FakeSender:
+    """Stands in for send_invite_to_guest; `results` gives each guest's answers in order"""
+
+    def __init__(self, results=None, delay: float = 0.0):
+        self.results = results or {}
+        self.delay = delay
+        self.calls = []
+        self.call_times = []
+        self.started = asyncio.Event()
+
+    async def __call__(self, phone_number: str, guest_name: str, guest_id: int):
+        self.calls.append(guest_id)
+        self.call_times.append(asyncio.get_running_loop().time())
+        self.started.set()
+        await asyncio.sleep(self.delay)
+        answers = self.results.get(guest_id)
+        if answers:
+            return answers.pop(0) if len(answers) > 1 else answers[0]
+        return {"status": "success", "data": {"messages": [{"id": f"wamid.outbox{guest_id}"}]}}
+
+
+THROTTLED = {"status": "error", "code": 503, "data": {"error": {"message": "Service unavailable"}}}
+SENT = {"status": "success", "data": {"messages": [{"id": "wamid.after429"}]}}
+REJECTED = {"status": "error", "code": 400, "data": {"error": {"code": 131026, "message": "Message undeliverable"}}}
+
+
+@pytest.fixture
+def fake_sender(monkeypatch):
+    def install(**kwargs) -> FakeSender:
+        sender = FakeSender(**kwargs)
+        monkeypatch.setattr("src.whatsapp_api.rest.whatsapp.send_invite_to_guest", sender)
+        return sender
+    return install
+
+
+def quick_dispatcher(**kwargs) -> InviteDispatcher:
+    options = dict(
+        max_concurrency=2, rate_per_second=1000, burst=100, max_attempts=3,
+        backoff_base=0.01, backoff_max=0.01, poll_seconds=0.02, reclaim_seconds=0.05
+    )
+    options.update(kwargs)
+    return InviteDispatcher(**options)
+
+
+def guest_ids() -> list:
+    with engine.connect() as conn:
+        return list(conn.execute(select(Guest.id).order_by(Guest.id)).scalars())
+
+
+def jobs_by_guest() -> dict:
+    with engine.connect() as conn:
+        return {job.guest_id: job for job in conn.execute(select(OutboxJob))}
+
+
+def guest_states() -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(select(Guest.id, Guest.sent_to_whatsapp)).all())
+
+
+async def wait_for_outbox_to_settle(timeout: float = 10):
+    """Until no job is pending, claimed or in flight"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        states = await OutboxOperations.count_by_state()
+        if not any(states.get(state) for state in ('pending', 'claimed', 'in_flight')):
+            return states
+        assert asyncio.get_running_loop().time() < deadline, f"outbox did not settle: {states}"
+        await asyncio.sleep(0.02)
+
+
+@pytest.mark.anyio
+async def test_enqueue_rearms_only_finished_jobs():
+    seed_ready_guests(3)
+    first, second, third = guest_ids()
+    assert sorted(await OutboxOperations.enqueue_ready_guests()) == [first, second, third]
+    assert await OutboxOperations.enqueue_ready_guests() == []
+
+    claimed = await OutboxOperations.claim_jobs("worker-a", 10, 60)
+    assert {job['guest_id'] for job in claimed} == {first, second, third}
+    jobs = {job['guest_id']: job['job_id'] for job in claimed}
+    for guest_id in (first, second):
+        assert await OutboxOperations.mark_in_flight(jobs[guest_id], "worker-a", 60)
+    await OutboxOperations.complete_job(jobs[first], "worker-a", True, message_id="wamid.first")
+    await OutboxOperations.complete_job(jobs[second], "worker-a", False, error="rejected")
+
+    # Every guest is put back to pending; only the finished jobs are queued again
+    with engine.begin() as conn:
+        conn.execute(update(Guest).values(sent_to_whatsapp='pending'))
+    assert sorted(await OutboxOperations.enqueue_ready_guests()) == [first, second]
+
+    jobs = jobs_by_guest()
+    for guest_id in (first, second):
+        assert (jobs[guest_id].state, jobs[guest_id].attempts, jobs[guest_id].last_error) == ('pending', 0, None)
+        assert jobs[guest_id].claimed_by is None
+    assert (jobs[third].state, jobs[third].claimed_by) == ('claimed', "worker-a")
+
+
+@pytest.mark.anyio
+async def test_expired_lease_is_reclaimed_and_the_old_claim_is_lost():
+    seed_ready_guests(2)
+    await OutboxOperations.enqueue_ready_guests()
+    claimed = await OutboxOperations.claim_jobs("crashed-worker", 10, 0.05)
+    in_flight, waiting = claimed
+    assert await OutboxOperations.mark_in_flight(in_flight['job_id'], "crashed-worker", 0.05)
+
+    # Leases still valid: nothing to reclaim, and no one else can claim the jobs
+    assert await OutboxOperations.reclaim_expired_leases() == 0
+    assert await OutboxOperations.claim_jobs("other-worker", 10, 60) == []
+
+    await asyncio.sleep(0.1)
+    assert await OutboxOperations.reclaim_expired_leases() == 2
+    jobs = jobs_by_guest()
+    assert jobs[in_flight['guest_id']].state == jobs[waiting['guest_id']].state == 'pending'
+    # The attempt already made on the in-flight job still counts
+    assert jobs[in_flight['guest_id']].attempts == 1
+
+    reclaimed = await OutboxOperations.claim_jobs("other-worker", 10, 60)
+    assert {job['job_id'] for job in reclaimed} == {in_flight['job_id'], waiting['job_id']}
+    # The crashed worker's stale claim can no longer move the jobs
+    assert not await OutboxOperations.mark_in_flight(waiting['job_id'], "crashed-worker", 60)
+    assert not await OutboxOperations.complete_job(in_flight['job_id'], "crashed-worker", True, message_id="wamid.x")
+    assert not await OutboxOperations.retry_job(in_flight['job_id'], "crashed-worker", 0)
+
+
+@pytest.mark.anyio
+async def test_retry_job_backs_off_before_the_job_is_due_again():
+    seed_ready_guests(1)
+    await OutboxOperations.enqueue_ready_guests()
+    [job] = await OutboxOperations.claim_jobs("worker-a", 10, 60)
+    await OutboxOperations.mark_in_flight(job['job_id'], "worker-a", 60)
+
+    assert await OutboxOperations.retry_job(job['job_id'], "worker-a", 0.2, error="throttled")
+    stored = jobs_by_guest()[job['guest_id']]
+    assert (stored.state, stored.claimed_by, stored.last_error, stored.attempts) == ('pending', None, "throttled", 1)
+    assert await OutboxOperations.claim_jobs("worker-a", 10, 60) == []
+
+    await asyncio.sleep(0.25)
+    [again] = await OutboxOperations.claim_jobs("worker-a", 10, 60)
+    assert (again['job_id'], again['attempts']) == (job['job_id'], 1)
+
+
+@pytest.mark.anyio
+async def test_retryable_failure_is_sent_again(fake_sender):
+    seed_ready_guests(1)
+    [guest_id] = guest_ids()
+    accepted = {"status": "success", "data": {"messages": [{"id": "wamid.retried"}]}}
+    sender = fake_sender(results={guest_id: [THROTTLED, THROTTLED, accepted]})
+
+    dispatcher = quick_dispatcher()
+    await dispatcher.start()
+    try:
+        await dispatcher.enqueue_ready_guests()
+        await wait_for_outbox_to_settle()
+    finally:
+        await dispatcher.stop()
+
+    assert sender.calls == [guest_id] * 3
+    job = jobs_by_guest()[guest_id]
+    assert (job.state, job.attempts, job.message_id) == ('succeeded', 3, "wamid.retried")
+    assert guest_states()[guest_id] == 'succeeded'
+    assert (dispatcher.sent, dispatcher.retries, dispatcher.failed) == (1, 2, 0)
+
+
+@pytest.mark.anyio
+async def test_429_pauses_every_send_for_retry_after(fake_sender):
+    seed_ready_guests(3)
+    throttled, *others = guest_ids()
+    too_many = {"status": "error", "code": 429, "retry_after": "0.3", "data": {"error": {"code": 130429}}}
+    sender = fake_sender(results={throttled: [too_many, SENT]})
+
+    dispatcher = quick_dispatcher(max_concurrency=1)
+    await dispatcher.start()
+    try:
+        await dispatcher.enqueue_ready_guests()
+        await wait_for_outbox_to_settle()
+    finally:
+        await dispatcher.stop()
+
+    assert sender.calls[0] == throttled and sorted(sender.calls[1:]) == sorted([throttled, *others])
+    # The throttling holds back the other guests too, not just the retry
+    assert min(sender.call_times[1:]) - sender.call_times[0] >= 0.3
+    assert (dispatcher.sent, dispatcher.retries) == (3, 1)
+
+
+@pytest.mark.anyio
+async def test_retryable_failure_gives_up_after_max_attempts(fake_sender):
+    seed_ready_guests(1)
+    [guest_id] = guest_ids()
+    sender = fake_sender(results={guest_id: [THROTTLED]})
+
+    dispatcher = quick_dispatcher(max_attempts=3)
+    await dispatcher.start()
+    try:
+        await dispatcher.enqueue_ready_guests()
+        await wait_for_outbox_to_settle()
+    finally:
+        await dispatcher.stop()
+
+    assert sender.calls == [guest_id] * 3
+    job = jobs_by_guest()[guest_id]
+    assert (job.state, job.attempts) == ('failed', 3)
+    assert "Service unavailable" in job.last_error
+    assert guest_states()[guest_id] == 'failed'
+
+
+@pytest.mark.anyio
+async def test_terminal_failure_is_not_retried(fake_sender):
+    seed_ready_guests(2)
+    rejected, accepted = guest_ids()
+    sender = fake_sender(results={rejected: [REJECTED]})
+
+    dispatcher = quick_dispatcher()
+    await dispatcher.start()
+    try:
+        await dispatcher.enqueue_ready_guests()
+        await wait_for_outbox_to_settle()
+    finally:
+        await dispatcher.stop()
+
+    assert sorted(sender.calls) == [rejected, accepted]
+    jobs = jobs_by_guest()
+    assert (jobs[rejected].state, jobs[rejected].attempts) == ('failed', 1)
+    assert "131026" in jobs[rejected].last_error
+    assert (jobs[accepted].state, jobs[accepted].message_id) == ('succeeded', f"wamid.outbox{accepted}")
+    assert guest_states() == {rejected: 'failed', accepted: 'succeeded'}
+    assert (dispatcher.sent, dispatcher.retries, dispatcher.failed) == (1, 0, 1)
+
+
+@pytest.mark.anyio
+async def test_restart_mid_campaign_sends_every_invite_once(fake_sender):
+    seed_ready_guests(8)
+    sender = fake_sender(delay=0.2)
+
+    first = quick_dispatcher(max_concurrency=2)
+    await first.start()
+    await first.enqueue_ready_guests()
+    # Stop while two sends are in flight and the next claims are waiting for a worker
+    await sender.started.wait()
+    await asyncio.sleep(0.05)
+    await first.stop()
+
+    states = await OutboxOperations.count_by_state()
+    assert not states.get('claimed') and not states.get('in_flight'), states
+    assert states.get('succeeded') == len(sender.calls) < 8
+
+    second = quick_dispatcher(max_concurrency=2)
+    await second.start()
+    try:
+        await wait_for_outbox_to_settle()
+    finally:
+        await second.stop()
+
+    assert sorted(sender.calls) == guest_ids()
+    assert set(guest_states().values()) == {'succeeded'}
+
+
+@pytest.mark.anyio
+async def test_jobs_of_a_crashed_worker_are_sent_after_their_lease_expires(fake_sender):
+    seed_ready_guests(3)
+    await OutboxOperations.enqueue_ready_guests()
+    # A process claimed every job, took one in flight and died without stopping
+    crashed = await OutboxOperations.claim_jobs("crashed-worker", 10, 0.1)
+    await OutboxOperations.mark_in_flight(crashed[0]['job_id'], "crashed-worker", 0.1)
+    sender = fake_sender()
+
+    dispatcher = quick_dispatcher()
+    await dispatcher.start()
+    try:
+        await wait_for_outbox_to_settle()
+    finally:
+        await dispatcher.stop()
+
+    # The in-flight send may or may not have reached Meta before the crash, so
+    # it is sent again (at least once); the claimed-only jobs are sent once
+    assert sorted(sender.calls) == guest_ids()
+    jobs = jobs_by_guest()
+    assert jobs[crashed[0]['guest_id']].attempts == 2
+    assert all(jobs[job['guest_id']].attempts == 1 for job in crashed[1:])
+    assert set(guest_states().values()) == {'succeeded'}
@@ -0,0 +1,48 @@
+"""
+Calling codes from phone numbers: the trie finds one-, two- and three-digit
+codes, and a code is only taken from a full international number.
+"""
+import pytest
+
+from src.whatsapp_api.phone_countries import CALLING_CODES, calling_code_for, regions_for
+
+
+@pytest.mark.parametrize("phone, code", [
+    ('+14155552671', '1'),
+    ('+7 912 345 67 89', '7'),
+    ('+44 20 7946 0958', '44'),
+    ('+91 98765 43210', '91'),
+    ('+971 50 123 4567', '971'),
+    ('+353 85 123 4567', '353'),
+    ('0044 20 7946 0958', '44'),
+    # WhatsApp's form: digits only, with the calling code
+    ('971501234567', '971'),
+    ('447946095800', '44'),
+    ('14155552671', '1'),
+])
+def test_calling_code_of_international_numbers(phone, code):
+    assert calling_code_for(phone) == code
+
+
+@pytest.mark.parametrize("phone", [
+    # National numbers: their first digits are not a calling code
+    '4155552671', '5551234', '07946 095800', '(415) 555-2671',
+    # No code starts with these
+    '+999 123 4567', '+0 123 4567', '+28 123 4567',
+    # More than E.164 allows
+    '+9715012345678901',
+    '', '   ', None,
+])
+def test_no_calling_code(phone):
+    assert calling_code_for(phone) is None
+
+
+def test_shared_calling_codes():
+    assert calling_code_for('+1 416 555 0123') == '1' and 'CA' in regions_for('1') and 'US' in regions_for('1')
+    assert calling_code_for('+7 701 123 4567') == '7' and regions_for('7') == ('RU', 'KZ')
+    assert regions_for(None) == () and regions_for('999') == ()
+
+
+def test_every_code_is_found():
+    for code in CALLING_CODES:
+        assert calling_code_for(f'+{code}{"5" * (12 - len(code))}') == code
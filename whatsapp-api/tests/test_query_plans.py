@@ -0,0 +1,205 @@
+"""
+The hot guest queries must stay indexed: each one is run through the real
+database operations against a large synthetic guest list, the SQL it issues is
+captured, and EXPLAIN QUERY PLAN must show no full table scan and no sort of
+the whole result.
+"""
+import re
+from datetime import timedelta
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Tuple
+
+import pytest
+from sqlalchemy import delete, event, func, insert, text, update
+
+from src.whatsapp_api.db_models import Guest, GuestTombstone, OutboxJob
+from src.whatsapp_api.db_operations import (
+    GuestOperations, OutboxOperations, async_engine, engine, get_async_db_session, init_database,
+    encode_sync_token, utcnow
+)
+from src.whatsapp_api.guest_index import guest_index
+from src.whatsapp_api.webhook_events import parse_webhook
+
+GUESTS = 50000
+SENT_EVERY = 2    # every other guest has been sent an invite
+READY_EVERY = 50  # a few unsent guests are ready to send
+
+# "SCAN guests", "SCAN guests USING INDEX idx", "SCAN guests USING COVERING INDEX idx"
+SCAN = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+SORT = re.compile(r'USE TEMP B-TREE FOR (?:RIGHT PART OF |LAST TERM OF )?ORDER BY')
+
+
+def seed_guests():
+    now = utcnow()
+    with engine.begin() as conn:
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        conn.execute(delete(GuestTombstone))
+        conn.execute(insert(Guest), [
+            {
+                'first_name': f'Guest{i}',
+                'last_name': 'Plan',
+                'phone': f'+9715{i:08d}' if i % 3 else f'+4477{i:08d}',
+                'group_id': f'group-{i // 4:06d}',
+                'is_group_primary': i % 4 == 0,
+                'ready': i % SENT_EVERY == 1 or i % READY_EVERY == 0,
+                'sent_to_whatsapp': 'succeeded' if i % SENT_EVERY == 1 else 'pending',
+                'api_call_at': now if i % SENT_EVERY == 1 else None,
+                'message_id': f'wamid.plan{i}' if i % SENT_EVERY == 1 else None,
+                'delivery_status': 'delivered' if i % SENT_EVERY == 1 else None,
+                'updated_at': now - timedelta(seconds=GUESTS - i),
+            }
+            for i in range(GUESTS)
+        ])
+
+
+@pytest.fixture(scope="module")
+def guest_database():
+    init_database()
+    seed_guests()
+    with engine.connect() as conn:
+        partial_indexes = {
+            name for name, sql in conn.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'index'"))
+            if sql and ' WHERE ' in sql.upper()
+        }
+    return partial_indexes
+
+
+@dataclass
+class HotQuery:
+    name: str
+    run: Callable[[], Awaitable]
+    # Queries that return every guest may walk a whole (ordered) index
+    full_index_scan_ok: bool = False
+    # Queries that only return recent changes may sort them
+    sort_ok: bool = False
+    # Plan steps that must appear, for queries with a purpose-built index
+    uses: Tuple[str, ...] = ()
+
+
+async def webhook_status_update():
+    guest_index.clear()
+    parsed = parse_webhook({"entry": [{"changes": [{"value": {"statuses": [
+        {"id": f"wamid.plan{i}", "status": "read", "timestamp": "1700000000"} for i in range(1, 200, SENT_EVERY)
+    ]}}]}]})
+    matches = await GuestOperations.resolve_webhook_guests(parsed.message_ids, parsed.phones)
+    await GuestOperations.apply_status_updates(parsed, matches)
+
+
+async def webhook_phone_lookup():
+    guest_index.clear()
+    await GuestOperations.resolve_webhook_guests([], [f'9715{i:08d}' for i in range(1, 100, 3)])
+
+
+async def group_rules():
+    async with get_async_db_session() as session:
+        await GuestOperations.validate_group_rules('group-000100', True, session)
+
+
+async def guest_page_after_cursor():
+    first = await GuestOperations.list_guests_page(limit=100)
+    await GuestOperations.list_guests_page(limit=100, cursor=first['next_cursor'])
+
+
+async def delta_sync():
+    version = await GuestOperations.get_guest_list_version()
+    async with get_async_db_session() as session:
+        await session.execute(update(Guest).where(Guest.id == 1).values(api_call_at=func.now()))
+    await GuestOperations.list_guests_page(limit=100, since=encode_sync_token(version))
+
+
+HOT_QUERIES = [
+    HotQuery(
+        "ready guests to send", GuestOperations.get_ready_guests_for_whatsapp,
+        uses=("USING INDEX idx_guest_ready_to_send",)
+    ),
+    HotQuery(
+        "queue ready guests", OutboxOperations.enqueue_ready_guests,
+        uses=("USING INDEX idx_guest_ready_to_send", "SEARCH guests USING INTEGER PRIMARY KEY")
+    ),
+    HotQuery(
+        "webhook lookup and status update by message_id", webhook_status_update,
+        uses=("USING INDEX idx_message_id",)
+    ),
+    HotQuery("webhook lookup by phone", webhook_phone_lookup),
+    HotQuery(
+        "recent sends for the guest index", lambda: GuestOperations.get_recent_message_guests(1000),
+        uses=("USING INDEX idx_guest_recent_sends",)
+    ),
+    HotQuery(
+        "full guest list by group", GuestOperations.get_all_guests, full_index_scan_ok=True,
+        uses=("USING INDEX idx_guest_group_primary",)
+    ),
+    HotQuery(
+        "group rules for a new guest", group_rules,
+        uses=("USING COVERING INDEX idx_guest_group_primary",)
+    ),
+    HotQuery("first guest page", lambda: GuestOperations.list_guests_page(limit=100), full_index_scan_ok=True),
+    HotQuery("guest page after a cursor", guest_page_after_cursor, full_index_scan_ok=True),
+    HotQuery("guest page by group", lambda: GuestOperations.list_guests_page(group_id='group-000042')),
+    HotQuery("guest page of ready guests", lambda: GuestOperations.list_guests_page(ready=True)),
+    HotQuery("guest page by send state", lambda: GuestOperations.list_guests_page(sent_to_whatsapp='pending')),
+    HotQuery("guest page by delivery status", lambda: GuestOperations.list_guests_page(delivery_status='none')),
+    HotQuery("guest page by country", lambda: GuestOperations.list_guests_page(calling_code='44')),
+    HotQuery("delta sync", delta_sync, sort_ok=True),
+    HotQuery("guest list version", GuestOperations.get_guest_list_version),
+]
+
+
+async def capture_statements(run: Callable[[], Awaitable]) -> List[Tuple[str, tuple]]:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+            statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        await run()
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def query_plan(statement: str, parameters) -> List[str]:
+    with engine.connect() as conn:
+        cursor = conn.connection.cursor()
+        try:
+            return [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())]
+        finally:
+            cursor.close()
+
+
+def plan_problems(plan: List[str], partial_indexes: set, hot_query: HotQuery) -> List[str]:
+    problems = []
+    for step in plan:
+        scan = SCAN.match(step)
+        if scan and scan.group(1) != 'CONSTANT':  # "SCAN CONSTANT ROW" is a SELECT without FROM
+            table, index = scan.groups()
+            if index is None:
+                problems.append(f"full table scan: {step}")
+            elif index not in partial_indexes and not hot_query.full_index_scan_ok:
+                problems.append(f"walks the whole index: {step}")
+        if SORT.search(step) and not hot_query.sort_ok:
+            problems.append(f"sorts every matching row: {step}")
+    return problems
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("hot_query", HOT_QUERIES, ids=lambda hot_query: hot_query.name)
+async def test_hot_query_is_indexed(guest_database, hot_query: HotQuery):
+    statements = await capture_statements(hot_query.run)
+    assert statements, "the operation issued no SQL"
+
+    failures = []
+    steps = []
+    for statement, parameters in statements:
+        plan = query_plan(statement, parameters)
+        steps.extend(plan)
+        problems = plan_problems(plan, guest_database, hot_query)
+        if problems:
+            failures.append(f"{' '.join(statement.split())}\n    " + "\n    ".join(problems))
+    for expected in hot_query.uses:
+        if not any(expected in step for step in steps):
+            failures.append(f"no plan step {expected!r} in {steps}")
+    assert not failures, "\n".join(failures)
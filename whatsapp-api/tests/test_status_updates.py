@@ -0,0 +1,98 @@
+"""
+Webhook statuses are applied monotonically: delivery_status never moves back
+down sent < failed < delivered < read, and each timestamp keeps its earliest
+value, whatever order (or how many times) the receipts arrive in.
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from src.whatsapp_api.db_models import Guest, OutboxJob
+from src.whatsapp_api.db_operations import GuestOperations, engine, init_database
+from src.whatsapp_api.webhook_events import GuestMatches, ParsedWebhook, StatusEvent
+
+MESSAGE_ID = "wamid.monotonic"
+SENT, DELIVERED, READ = 1700000000, 1700000005, 1700000060
+
+
+@pytest.fixture
+def guest_id() -> int:
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        return conn.execute(insert(Guest).values(
+            first_name='Status', last_name='Order', phone='971500000001', group_id='status',
+            is_group_primary=True, sent_to_whatsapp='succeeded', message_id=MESSAGE_ID
+        )).inserted_primary_key[0]
+
+
+async def apply(guest_id: int, *statuses: StatusEvent) -> int:
+    parsed = ParsedWebhook(event_type=statuses[0].status, statuses=list(statuses))
+    return await GuestOperations.apply_status_updates(parsed, GuestMatches(by_message_id={MESSAGE_ID: guest_id}))
+
+
+def status(name: str, timestamp: int, error: str = None) -> StatusEvent:
+    return StatusEvent(message_id=MESSAGE_ID, status=name, timestamp=timestamp, error=error)
+
+
+def stored(guest_id: int):
+    with engine.connect() as conn:
+        return conn.execute(select(Guest).where(Guest.id == guest_id)).one()
+
+
+@pytest.mark.anyio
+async def test_receipts_in_reverse_order_keep_read(guest_id):
+    assert await apply(guest_id, status('read', READ)) == 1
+    await apply(guest_id, status('delivered', DELIVERED))
+    await apply(guest_id, status('sent', SENT))
+
+    guest = stored(guest_id)
+    assert guest.delivery_status == 'read'
+    assert guest.sent_at == datetime.fromtimestamp(SENT)
+    assert guest.delivered_at == datetime.fromtimestamp(DELIVERED)
+    assert guest.read_at == datetime.fromtimestamp(READ)
+
+
+@pytest.mark.anyio
+async def test_duplicate_receipts_keep_the_earliest_timestamp(guest_id):
+    await apply(guest_id, status('delivered', DELIVERED))
+    await apply(guest_id, status('delivered', DELIVERED + 30))
+    await apply(guest_id, status('delivered', DELIVERED))
+    await apply(guest_id, status('sent', SENT + 10))
+    await apply(guest_id, status('sent', SENT))
+
+    guest = stored(guest_id)
+    assert guest.delivery_status == 'delivered'
+    assert guest.delivered_at == datetime.fromtimestamp(DELIVERED)
+    assert guest.sent_at == datetime.fromtimestamp(SENT)
+    assert guest.read_at is None
+
+
+@pytest.mark.anyio
+async def test_failed_after_delivered_does_not_move_status_back(guest_id):
+    await apply(guest_id, status('sent', SENT))
+    await apply(guest_id, status('delivered', DELIVERED))
+    await apply(guest_id, status('failed', READ, error="131026: Message undeliverable"))
+
+    guest = stored(guest_id)
+    assert guest.delivery_status == 'delivered'
+    # The failure is still recorded
+    assert guest.failed_at == datetime.fromtimestamp(READ)
+    assert guest.delivery_error == "131026: Message undeliverable"
+
+
+@pytest.mark.anyio
+async def test_one_payload_with_out_of_order_and_repeated_statuses(guest_id):
+    await apply(
+        guest_id,
+        status('read', READ), status('sent', SENT + 1), status('delivered', DELIVERED),
+        status('sent', SENT), status('read', READ + 5)
+    )
+
+    guest = stored(guest_id)
+    assert guest.delivery_status == 'read'
+    assert guest.sent_at == datetime.fromtimestamp(SENT)
+    assert guest.delivered_at == datetime.fromtimestamp(DELIVERED)
+    assert guest.read_at == datetime.fromtimestamp(READ)
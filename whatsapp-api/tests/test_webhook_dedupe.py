@@ -0,0 +1,130 @@
+"""
+Webhook deduplication: a payload whose status updates fail gives its event
+keys back, and a copy of an event arriving while the first copy is still
+being processed waits for its outcome instead of being dropped.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import OperationalError
+
+from src.whatsapp_api.db_models import Guest, OutboxJob, WebhookEventKey
+from src.whatsapp_api.db_operations import GuestOperations, engine, init_database
+from src.whatsapp_api.rest.whatsapp import process_webhook_payload
+from src.whatsapp_api.webhook_dedupe import WebhookDeduplicator, webhook_dedupe
+
+MESSAGE_ID = "wamid.dedupe"
+
+
+def delivered(timestamp: int):
+    """A delivery receipt and its event key; each test uses its own timestamp, as the keys stay remembered"""
+    payload = {
+        "object": "whatsapp_business_account",
+        "entry": [{"changes": [{"field": "messages", "value": {"statuses": [{
+            "id": MESSAGE_ID, "status": "delivered", "timestamp": str(timestamp), "recipient_id": "971500000001"
+        }]}}]}]
+    }
+    return payload, f"status:{MESSAGE_ID}:delivered:{timestamp}"
+
+
+@pytest.fixture
+def guest_id() -> int:
+    init_database()
+    with engine.begin() as conn:
+        conn.execute(delete(WebhookEventKey))
+        conn.execute(delete(OutboxJob))
+        conn.execute(delete(Guest))
+        return conn.execute(insert(Guest).values(
+            first_name='Dedupe', last_name='Guest', phone='971500000001', group_id='dedupe',
+            is_group_primary=True, sent_to_whatsapp='succeeded', message_id=MESSAGE_ID
+        )).inserted_primary_key[0]
+
+
+def delivery_status(guest_id: int):
+    with engine.connect() as conn:
+        return conn.execute(select(Guest.delivery_status).where(Guest.id == guest_id)).scalar_one()
+
+
+def fail_updates(monkeypatch, times: int, before=None):
+    """Make the next `times` status updates fail as a locked database would"""
+    apply_status_updates = GuestOperations.apply_status_updates
+    calls = []
+
+    async def flaky(parsed, matches):
+        calls.append(parsed)
+        if len(calls) <= times:
+            if before is not None:
+                await before.wait()
+            raise OperationalError("UPDATE guests", {}, Exception("database is locked"))
+        return await apply_status_updates(parsed, matches)
+
+    monkeypatch.setattr(GuestOperations, "apply_status_updates", staticmethod(flaky))
+    return calls
+
+
+@pytest.mark.anyio
+async def test_failed_updates_give_the_keys_back(guest_id, monkeypatch):
+    calls = fail_updates(monkeypatch, times=1)
+    payload, key = delivered(1700000005)
+
+    with pytest.raises(OperationalError):
+        await process_webhook_payload(payload, {})
+    assert delivery_status(guest_id) is None
+    assert await webhook_dedupe.claim([key]) == {key}
+    webhook_dedupe.forget({key})
+
+    # The redelivery is applied, and a further copy is then skipped
+    await process_webhook_payload(payload, {})
+    assert delivery_status(guest_id) == 'delivered'
+    await process_webhook_payload(payload, {})
+    assert len(calls) == 2
+    assert await webhook_dedupe.claim([key]) == set()
+
+
+@pytest.mark.anyio
+async def test_copy_waits_for_a_failing_first_copy(guest_id, monkeypatch):
+    release = asyncio.Event()
+    calls = fail_updates(monkeypatch, times=1, before=release)
+    payload, key = delivered(1700000006)
+
+    first = asyncio.create_task(process_webhook_payload(payload, {}))
+    for _ in range(100):
+        if calls:
+            break
+        await asyncio.sleep(0.01)
+    assert calls
+    copy = asyncio.create_task(process_webhook_payload(payload, {}))
+    await asyncio.sleep(0.05)
+    assert not copy.done()
+
+    release.set()
+    await asyncio.wait_for(asyncio.wait([first, copy]), timeout=5)
+    assert isinstance(first.exception(), OperationalError) and copy.exception() is None
+    assert len(calls) == 2
+    assert delivery_status(guest_id) == 'delivered'
+    assert await webhook_dedupe.claim([key]) == set()
+
+
+@pytest.mark.anyio
+async def test_waiting_claim_follows_the_first_outcome(guest_id):
+    dedupe = WebhookDeduplicator(prune_interval=3600)
+    await dedupe.start()
+    try:
+        assert await dedupe.claim(["a", "b"]) == {"a", "b"}
+        forgotten = asyncio.create_task(dedupe.claim(["a", "c"]))
+        committed = asyncio.create_task(dedupe.claim(["b"]))
+        await asyncio.sleep(0.01)
+        assert not forgotten.done() and not committed.done()
+        assert dedupe.stats()["in_progress"] == 2
+
+        dedupe.forget({"a"})
+        assert await asyncio.wait_for(forgotten, timeout=1) == {"a", "c"}
+        await dedupe.commit({"b"})
+        assert await asyncio.wait_for(committed, timeout=1) == set()
+
+        stats = dedupe.stats()
+        assert stats["in_progress"] == 2 and stats["waits"] == 2
+        assert stats["duplicates_in_memory"] == 1
+    finally:
+        await dedupe.stop()
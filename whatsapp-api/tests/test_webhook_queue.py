@@ -0,0 +1,65 @@
+"""
+Webhook ingestion queue: a full queue sheds load with 503 and Retry-After,
+and payloads that fail on a worker are counted as errors.
+"""
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from src.whatsapp_api.db_operations import GuestOperations, init_database
+from src.whatsapp_api.main import app
+from src.whatsapp_api.webhook_queue import WEBHOOK_RETRY_AFTER_SECONDS, WebhookIngestQueue
+
+
+def status_payload(message_id: str) -> dict:
+    return {"entry": [{"changes": [{"value": {"statuses": [
+        {"id": message_id, "status": "delivered", "timestamp": "1700000005"}
+    ]}}]}]}
+
+
+@pytest.fixture
+async def queue(request, monkeypatch):
+    init_database()
+    queue = WebhookIngestQueue(drain_seconds=0, **request.param)
+    monkeypatch.setattr("src.whatsapp_api.rest.whatsapp.webhook_queue", queue)
+    await queue.start()
+    yield queue
+    await queue.stop()
+
+
+async def post_webhook(payload: dict) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/whatsapp/webhook", json=payload)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("queue", [{"max_size": 2, "workers": 0}], indirect=True)
+async def test_full_queue_answers_503_with_retry_after(queue):
+    for i in range(2):
+        response = await post_webhook(status_payload(f"wamid.shed{i}"))
+        assert response.status_code == 200
+
+    response = await post_webhook(status_payload("wamid.shed2"))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(WEBHOOK_RETRY_AFTER_SECONDS)
+    assert queue.stats()["accepted"] == 2 and queue.stats()["rejected"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("queue", [{"max_size": 10, "workers": 1}], indirect=True)
+async def test_failed_payloads_are_counted(queue, monkeypatch):
+    async def locked(parsed, matches):
+        raise OperationalError("UPDATE guests", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(GuestOperations, "apply_status_updates", staticmethod(locked))
+    response = await post_webhook(status_payload("wamid.fails"))
+    assert response.status_code == 200
+
+    for _ in range(100):
+        if queue.errors:
+            break
+        await asyncio.sleep(0.01)
+    assert queue.stats()["errors"] == 1 and queue.stats()["processed"] == 0